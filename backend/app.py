@@ -1,21 +1,39 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, g, has_request_context
 from flask_cors import CORS
+import click
 import pandas as pd
 import numpy as np
+import openpyxl
 import mysql.connector
 from mysql.connector import Error
 import os
 from dotenv import load_dotenv
 import uuid
 from datetime import datetime
+from collections import namedtuple
 import re
 import tempfile
-import json
+import io
+import threading
+import base64
+import hashlib
+import math
+import time
+
+from db_pool import ConnectionPool
+from parse_cache import ParseCache
+from import_jobs import ImportProgress, JobQueueFull, JobRunner, JobStore
+from json_provider import FastJSONProvider
+from query_stats import InstrumentedConnection, QueryStats
+from columnar import ARROW, COLUMNAR_JSON, MSGPACK, arrow_body, frame_columns, msgpack_body, negotiate
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, SIZE_BUCKETS, MetricsRegistry
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+# Every jsonify()/request.get_json() goes through the fast provider (orjson when installed)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Database connection configuration
@@ -26,85 +44,212 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', ''),
 }
 
+# Connection pool configuration
+DB_POOL_CONFIG = {
+    'size': int(os.getenv('DB_POOL_SIZE', '5')),
+    'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    'recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    'pre_ping': os.getenv('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no'),
+}
+
+# Rows per multi-row INSERT statement during Excel imports
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Streaming imports: rows parsed per batch, and the upload size that switches it on automatically
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '5000'))
+STREAM_IMPORT_MIN_BYTES = int(os.getenv('STREAM_IMPORT_MIN_BYTES', str(20 * 1024 * 1024)))
+
+# Records converted to column arrays at a time while writing Excel exports
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))
+
+# Cash sales page size (default and cap) and rows fetched per round trip when streaming NDJSON
+CASH_SALES_PAGE_SIZE = int(os.getenv('CASH_SALES_PAGE_SIZE', '500'))
+CASH_SALES_MAX_PAGE_SIZE = int(os.getenv('CASH_SALES_MAX_PAGE_SIZE', '5000'))
+CASH_SALES_STREAM_CHUNK = 1000
+
+# How POS sync values the purchase cost of a sold unit (see load_purchase_costs)
+COST_VALUATIONS = ('average', 'moving_average')
+COST_VALUATION = os.getenv('COST_VALUATION', 'average')
+
+# Cash sales converted to consumption per set-based chunk (and per commit)
+CONVERT_BATCH_SIZE = int(os.getenv('CONVERT_BATCH_SIZE', '1000'))
+
+# 'full' imports write every row of a workbook; 'delta' imports skip rows already stored and replace edited ones
+IMPORT_MODES = ('full', 'delta')
+IMPORT_MODE = os.getenv('IMPORT_MODE', 'full')
+
+# Products whose stock ledger balances are recomputed (or backfilled) per round trip
+LEDGER_RECOMPUTE_CHUNK = int(os.getenv('LEDGER_RECOMPUTE_CHUNK', '500'))
+
+# Products compared per reconciliation chunk, and the difference still treated as a match
+RECONCILE_CHUNK = int(os.getenv('RECONCILE_CHUNK', '5000'))
+RECONCILE_TOLERANCE = 0.01
+
+# MySQL rejects statements with more than 65535 placeholders
+MAX_STATEMENT_PARAMS = 65535
+
+# MySQL error number for a duplicate key (ER_DUP_ENTRY)
+DUPLICATE_ENTRY_ERRNO = 1062
+
+# Bump whenever parse_stock_workbook() output changes so stale cache entries are ignored
+PARSER_VERSION = '2'
+
+parse_cache = ParseCache(
+    max_entries=int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '32')),
+    max_bytes=int(os.getenv('PARSE_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+    cache_dir=os.getenv('PARSE_CACHE_DIR') or None,
+    disk_max_bytes=int(os.getenv('PARSE_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024))),
+)
+
+# Background import jobs: state lives in SQLite so it survives restarts
+IMPORT_JOB_DB = os.getenv('IMPORT_JOB_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_jobs.db'))
+IMPORT_JOB_SPOOL_DIR = os.getenv('IMPORT_JOB_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'salon-import-jobs'))
+
+# Jobs are owned by the process that accepted them; other processes sharing the store
+# only fail a job once its owner has exited or its heartbeat is older than the limit
+import_job_store = JobStore(IMPORT_JOB_DB, stale_after=int(os.getenv('IMPORT_JOB_STALE_AFTER', '120')))
+import_job_store.fail_interrupted()
+import_job_runner = JobRunner(
+    import_job_store,
+    workers=int(os.getenv('IMPORT_JOB_WORKERS', '2')),
+    max_pending=int(os.getenv('IMPORT_JOB_MAX_PENDING', '8')),
+    heartbeat_interval=int(os.getenv('IMPORT_JOB_HEARTBEAT_INTERVAL', '15')),
+)
+
+# Per-request statement statistics: X-DB-* response headers and a warning when one
+# statement shape runs more than QUERY_REPEAT_WARN_THRESHOLD times in a request
+QUERY_STATS_ENABLED = os.getenv('QUERY_STATS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+QUERY_REPEAT_WARN_THRESHOLD = int(os.getenv('QUERY_REPEAT_WARN_THRESHOLD', '20'))
+# Allows ?debug_queries=1 to add the statistics (with statement texts) to JSON responses
+QUERY_STATS_DEBUG = os.getenv('QUERY_STATS_DEBUG', '0').lower() in ('1', 'true', 'yes')
+
+# Latency and size histograms per endpoint and per pipeline stage, scraped from /metrics.
+# While disabled no timings are taken.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+metrics = MetricsRegistry(enabled=METRICS_ENABLED)
+REQUEST_SECONDS = metrics.histogram(
+    'salon_http_request_duration_seconds', 'Time to build each response (streamed bodies excluded).',
+    ('method', 'endpoint', 'status')
+)
+REQUEST_BYTES = metrics.histogram(
+    'salon_http_request_size_bytes', 'Request body size.', ('method', 'endpoint'), buckets=SIZE_BUCKETS
+)
+RESPONSE_BYTES = metrics.histogram(
+    'salon_http_response_size_bytes', 'Response body size.', ('method', 'endpoint'), buckets=SIZE_BUCKETS
+)
+STAGE_SECONDS = metrics.histogram(
+    'salon_stage_duration_seconds', 'Time spent in each stage of the import, parse and export pipelines.',
+    ('pipeline', 'stage')
+)
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(DB_CONFIG, **DB_POOL_CONFIG)
+    return _db_pool
+
 def get_db_connection():
-    """Create a connection to the MySQL database."""
+    """Check out a pooled connection to the MySQL database. close() returns it to the pool."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
+        conn = get_db_pool().acquire()
     except Error as e:
         print(f"Error connecting to MySQL Database: {e}")
         return None
+    if QUERY_STATS_ENABLED:
+        return InstrumentedConnection(conn, current_query_stats)
+    return conn
+
+def current_query_stats():
+    """Return the QueryStats of the request being handled, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+def stage_timer(pipeline):
+    """Return an ImportProgress on_stage callback that feeds the stage histogram of `pipeline`."""
+    return lambda stage, seconds: STAGE_SECONDS.observe(seconds, pipeline, stage)
+
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        g.metrics_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe the request's latency and body sizes under its route pattern."""
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, endpoint, str(response.status_code))
+    REQUEST_BYTES.observe(request.content_length or 0, request.method, endpoint)
+    # Streamed bodies are only sized by their Content-Length header, when they set one
+    if response.is_streamed:
+        size = response.content_length
+    else:
+        size = response.calculate_content_length()
+    if size is not None:
+        RESPONSE_BYTES.observe(size, request.method, endpoint)
+    return response
+
+@app.before_request
+def start_query_stats():
+    if QUERY_STATS_ENABLED:
+        g.query_stats = QueryStats()
+
+@app.after_request
+def report_query_stats(response):
+    """Add the request's statement statistics to the response and warn about repeated statements."""
+    stats = g.pop('query_stats', None)
+    # Streamed bodies run their queries after the headers are sent, so they are not reported
+    if stats is None or response.is_streamed:
+        return response
+    
+    response.headers['X-DB-Query-Count'] = str(stats.statements)
+    response.headers['X-DB-Time-Ms'] = f"{stats.seconds * 1000:.1f}"
+    response.headers['X-DB-Rows'] = str(stats.rows)
+    
+    for statement, count in stats.repeated(QUERY_REPEAT_WARN_THRESHOLD):
+        print(f"Warning: {request.method} {request.path} ran the same statement {count} times: {statement[:300]}")
+    
+    if QUERY_STATS_DEBUG and request.args.get('debug_queries') and response.is_json and not response.is_streamed:
+        payload = response.get_json()
+        if isinstance(payload, dict):
+            payload['_query_stats'] = stats.summary()
+            response.set_data(app.json.dumps(payload))
+    return response
+
+UNIT_MAPPINGS = {
+    'BTL-BOTTLES': 'BTL',
+    'PCS-PIECES': 'PCS',
+    'BOX-BOXES': 'BOX',
+    'JAR-JARS': 'JAR',
+    'PKT-PACKETS': 'PKT'
+}
+
+UNIT_PATTERN = '(' + '|'.join(re.escape(key) for key in UNIT_MAPPINGS) + ')'
 
 def standardize_unit(unit_str):
     """Convert unit strings to standardized format."""
-    unit_mappings = {
-        'BTL-BOTTLES': 'BTL',
-        'PCS-PIECES': 'PCS',
-        'BOX-BOXES': 'BOX',
-        'JAR-JARS': 'JAR',
-        'PKT-PACKETS': 'PKT'
-    }
-    
-    for key, value in unit_mappings.items():
+    for key, value in UNIT_MAPPINGS.items():
         if key in unit_str:
             return value
     return unit_str
 
-def extract_and_standardize_headers(df):
-    """Extract and standardize column headers from Excel files with complex headers."""
-    header_mappings = {
-        # Purchase section
-        r'Unnamed: \d+': 'Purchase_Date',
-        'Invoice No.': 'Purchase_Invoice_No',
-        'Qty.': 'Purchase_Qty',
-        'Incl. GST': 'Purchase_Incl_GST',
-        'Ex. GST': 'Purchase_Ex_GST',
-        'Taxable Value': 'Purchase_Taxable_Value',
-        'IGST': 'Purchase_IGST',
-        'CGST': 'Purchase_CGST',
-        'SGST': 'Purchase_SGST',
-        'Invoice Value': 'Purchase_Invoice_Value',
-        
-        # Sales section
-        r'Unnamed: \d+': 'Sales_Date',
-        'Invoice No.': 'Sales_Invoice_No',
-        'Qty.': 'Sales_Qty',
-        'Incl. GST': 'Sales_Incl_GST',
-        'Ex. GST': 'Sales_Ex_GST',
-        'Taxable Value': 'Sales_Taxable_Value',
-        'IGST': 'Sales_IGST',
-        'CGST': 'Sales_CGST',
-        'SGST': 'Sales_SGST',
-        'Invoice Value': 'Sales_Invoice_Value',
-        
-        # Consumption section
-        r'Unnamed: \d+': 'Consumption_Date',
-        'Invoice No.': 'Consumption_Invoice_No',
-        'Qty.': 'Consumption_Qty',
-        'Incl. GST': 'Consumption_Incl_GST',
-        'Ex. GST': 'Consumption_Ex_GST',
-        'Taxable Value': 'Consumption_Taxable_Value',
-        'IGST': 'Consumption_IGST',
-        'CGST': 'Consumption_CGST',
-        'SGST': 'Consumption_SGST',
-        'Invoice Value': 'Consumption_Invoice_Value',
-        
-        # Balance section
-        r'Unnamed: \d+': 'Balance_Qty',
-    }
-    
-    standardized_columns = []
-    for col in df.columns:
-        matched = False
-        for pattern, replacement in header_mappings.items():
-            if re.match(pattern, col) or col == pattern:
-                standardized_columns.append(replacement)
-                matched = True
-                break
-        if not matched:
-            standardized_columns.append(col)
-    
-    return standardized_columns
+def standardize_units(units):
+    """Vectorized standardize_unit() for a whole column of unit strings."""
+    units = units.fillna('').astype(str)
+    matched = units.str.extract(UNIT_PATTERN, expand=False).map(UNIT_MAPPINGS)
+    return matched.fillna(units)
 
 def fix_floating_point_errors(value):
     """Fix floating point errors in numeric values."""
@@ -114,10 +259,33 @@ def fix_floating_point_errors(value):
         return round(value, 2)
     return value
 
+def fix_floating_point_series(values):
+    """Vectorized fix_floating_point_errors(): coerce to numbers, round to 2 places and clamp near-zero values."""
+    numbers = pd.to_numeric(values, errors='coerce').fillna(0.0).astype(float).to_numpy()
+    return pd.Series(np.where(np.abs(numbers) < 1e-10, 0.0, np.round(numbers, 2)), index=values.index)
+
+UUID_HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+def generate_uuids(count):
+    """Generate `count` random version-4 UUID strings from one os.urandom() call."""
+    if count == 0:
+        return []
+    raw = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40  # version 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80  # RFC 4122 variant
+    
+    hex_digits = np.frombuffer(raw.tobytes().hex().encode('ascii'), dtype='S1').reshape(count, 32)
+    formatted = np.full((count, 36), b'-', dtype='S1')
+    formatted[:, UUID_HEX_POSITIONS] = hex_digits
+    return formatted.view('S36').ravel().astype(str).tolist()
+
 @app.route('/api/extract-stock', methods=['POST'])
 def extract_stock():
     """
     Extract stock data from uploaded Excel file and store in database.
+    With async=1 the import runs as a background job and a job id is returned;
+    mode=delta imports only rows not stored by an earlier upload and replaces
+    rows edited since.
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
@@ -130,239 +298,1281 @@ def extract_stock():
         return jsonify({'error': 'File must be an Excel spreadsheet'}), 400
     
     try:
-        # Read the Excel file
-        df = pd.read_excel(file, sheet_name="STOCK DETAILS")
-        
-        # Clean and transform the data
-        df.columns = extract_and_standardize_headers(df)
-        
-        # Process each section of the Excel file
-        purchases = process_purchase_section(df)
-        sales = process_sales_section(df)
-        consumption = process_consumption_section(df)
-        balance = process_balance_section(df)
-        
-        # Store data in the database
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
-        cursor = conn.cursor()
-        
-        # Insert products
-        for product in extract_unique_products(purchases + sales + consumption + balance):
-            insert_product(cursor, product)
-        
-        # Insert purchases
-        for purchase in purchases:
-            insert_purchase(cursor, purchase)
-        
-        # Insert sales
-        for sale in sales:
-            insert_sale(cursor, sale)
-        
-        # Insert consumption
-        for cons in consumption:
-            insert_consumption(cursor, cons)
+        mode = import_mode(request.values.get('mode'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        streamed = use_streaming_import(file, request.values.get('stream'))
         
-        # Update balance stock
-        for bal in balance:
-            update_balance_stock(cursor, bal)
+        if request.values.get('async', '').lower() in ('1', 'true', 'yes'):
+            return submit_import_job(file, streamed, mode)
         
-        conn.commit()
-        conn.close()
+        stats = run_stock_import(file, streamed, mode)
         
         return jsonify({
             'success': True,
             'message': 'Stock data extracted and stored successfully',
-            'stats': {
-                'products': len(extract_unique_products(purchases + sales + consumption + balance)),
-                'purchases': len(purchases),
-                'sales': len(sales),
-                'consumption': len(consumption)
-            }
+            'streamed': streamed,
+            'mode': mode,
+            'stats': stats
         })
     
+    except DuplicateImportError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def process_purchase_section(df):
-    """Process the PURCHASE - STOCK IN section of the Excel file."""
-    purchase_section = df[df.iloc[:, 0] == "PURCHASE - STOCK IN"]
-    if purchase_section.empty:
-        return []
+def run_stock_import(source, streamed, mode=None, progress=None):
+    """
+    Parse a STOCK DETAILS workbook and write it to the database in one
+    transaction, reporting section row counts and stage timings to `progress`.
+    In 'delta' mode rows already imported are skipped and edited rows replace
+    their stored version. Returns the import stats.
+    """
+    mode = import_mode(mode)
+    progress = progress or ImportProgress()
+    if METRICS_ENABLED:
+        progress.on_stage = stage_timer('import_stream' if streamed else 'import')
+    replaced = {}
+    converted = []
+    conn = None
+    try:
+        if streamed:
+            # Parse and write batch by batch so memory stays bounded for large workbooks
+            conn = get_db_connection()
+            if not conn:
+                raise RuntimeError('Database connection failed')
+            
+            cursor = conn.cursor()
+            product_ids, counts, skipped = import_stock_stream(
+                cursor, source, mode=mode, progress=progress, replaced=replaced, converted=converted
+            )
+            
+            with progress.stage('commit'):
+                conn.commit()
+            
+            return import_stats(len(product_ids), counts, skipped, replaced, converted)
+        
+        # Read the Excel file; each section carries its own header row
+        with progress.stage('read'):
+            df = pd.read_excel(source, sheet_name="STOCK DETAILS", header=None)
+        
+        # Locate all sections in one pass
+        with progress.stage('index'):
+            spans = index_sections(df)
+        
+        # Label each section from its own header row, then parse it into a columnar batch
+        with progress.stage('headers'):
+            section_rows = {section: section_data(df, spans, section) for section in SECTION_TITLES}
+        with progress.stage('parse'):
+            sections = {section: SECTION_PARSERS[section](rows) for section, rows in section_rows.items()}
+        for section, batch in sections.items():
+            progress.parsed(section, len(batch))
+        
+        # Store data in the database
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        
+        cursor = conn.cursor()
+        
+        # Register all products in one set-based upsert and resolve their ids
+        with progress.stage('products'):
+            products = extract_unique_products(list(sections.values()))
+            product_ids = upsert_products(cursor, products)
+        
+        # Write each section with multi-row statements; delta imports skip or replace stored rows first
+        ledger_starts = {}
+        counts = dict.fromkeys(SECTION_TITLES, 0)
+        skipped = dict.fromkeys(SECTION_TITLES, 0)
+        for section, batch in sections.items():
+            with progress.stage('fingerprint'):
+                rows = prepare_import_batch(cursor, section, batch, mode, replaced=replaced, converted=converted)
+            with progress.stage('write'):
+                SECTION_WRITERS[section](cursor, rows, product_ids, ledger_starts=ledger_starts)
+            progress.written(section, len(rows))
+            counts[section] = len(rows)
+            skipped[section] = len(batch) - len(rows)
+        
+        # Bring ledger opening/closing balances up to date once for all sections
+        with progress.stage('ledger'):
+            rebuild_replaced_products(cursor, replaced, ledger_starts)
+            recompute_ledger(cursor, ledger_starts)
+        
+        with progress.stage('commit'):
+            conn.commit()
+        
+        return import_stats(len(products), counts, skipped, replaced, converted)
+    except mysql.connector.IntegrityError as e:
+        if e.errno != DUPLICATE_ENTRY_ERRNO:
+            raise
+        # Only a concurrent import can store a fingerprint between the lookup and the insert
+        raise DuplicateImportError(
+            'Rows of this workbook were stored by another import at the same time; retry the upload'
+        ) from e
+    finally:
+        if conn:
+            conn.close()
+
+def import_stats(products, counts, skipped, replaced=None, converted=None):
+    """
+    Build the import stats: rows written per section, rows skipped as already
+    imported, of the rows written those that replaced an edited row and, of
+    the sales skipped, the edited ones kept because they were converted.
+    """
+    replaced = replaced or {}
+    return {
+        'products': products,
+        'purchases': counts['PURCHASE'],
+        'sales': counts['SALES'],
+        'consumption': counts['CONSUMPTION'],
+        'skipped': {
+            'purchases': skipped['PURCHASE'],
+            'sales': skipped['SALES'],
+            'consumption': skipped['CONSUMPTION']
+        },
+        'replaced': {
+            'purchases': len(replaced.get('PURCHASE', [])),
+            'sales': len(replaced.get('SALES', [])),
+            'consumption': len(replaced.get('CONSUMPTION', []))
+        },
+        'converted_kept': len(converted or [])
+    }
+
+def submit_import_job(file, streamed, mode):
+    """Spool the upload to disk and queue it as a background import job."""
+    os.makedirs(IMPORT_JOB_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename)[1]
+    fd, spool_path = tempfile.mkstemp(dir=IMPORT_JOB_SPOOL_DIR, suffix=suffix)
+    with os.fdopen(fd, 'wb') as spool:
+        file.save(spool)
     
-    # Find the section start and end indices
-    start_idx = purchase_section.index[0] + 1  # +1 to skip the header row
-    end_idx = None
-    
-    for idx in range(start_idx + 1, len(df)):
-        if df.iloc[idx, 0] in ["SALES TO CUSTOMER - STOCK OUT", "SALON CONSUMPTION - STOCK OUT", "BALANCE STOCK"]:
-            end_idx = idx - 1
-            break
-    
-    if end_idx is None:
-        end_idx = len(df) - 1
-    
-    # Extract the purchase data
-    purchase_data = df.iloc[start_idx:end_idx+1]
-    
-    # Filter out rows without any product name
-    purchase_data = purchase_data[purchase_data['Product Name'].notna()]
-    
-    purchases = []
-    for _, row in purchase_data.iterrows():
-        purchases.append({
-            'id': str(uuid.uuid4()),
-            'date': row.get('Purchase_Date', None),
-            'product_name': row.get('Product Name', ''),
-            'hsn_code': row.get('HSN Code', ''),
-            'unit': standardize_unit(str(row.get('UNITS', ''))),
-            'invoice_no': row.get('Purchase_Invoice_No', ''),
-            'qty': fix_floating_point_errors(row.get('Purchase_Qty', 0)),
-            'incl_gst': fix_floating_point_errors(row.get('Purchase_Incl_GST', 0)),
-            'ex_gst': fix_floating_point_errors(row.get('Purchase_Ex_GST', 0)),
-            'taxable_value': fix_floating_point_errors(row.get('Purchase_Taxable_Value', 0)),
-            'igst': fix_floating_point_errors(row.get('Purchase_IGST', 0)),
-            'cgst': fix_floating_point_errors(row.get('Purchase_CGST', 0)),
-            'sgst': fix_floating_point_errors(row.get('Purchase_SGST', 0)),
-            'invoice_value': fix_floating_point_errors(row.get('Purchase_Invoice_Value', 0)),
-            'transaction_type': 'purchase',
-            'supplier': row.get('Supplier', '') if 'Supplier' in row else ''
-        })
+    try:
+        job_id = import_job_runner.submit(
+            'extract-stock', file.filename, run_stock_import, spool_path, streamed, mode,
+            cleanup_path=spool_path
+        )
+    except JobQueueFull as e:
+        os.remove(spool_path)
+        return jsonify({'error': str(e)}), 503
     
-    return purchases
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/api/import-jobs/{job_id}',
+        'streamed': streamed,
+        'mode': mode
+    }), 202
 
-def process_sales_section(df):
-    """Process the SALES TO CUSTOMER - STOCK OUT section of the Excel file."""
-    sales_section = df[df.iloc[:, 0] == "SALES TO CUSTOMER - STOCK OUT"]
-    if sales_section.empty:
-        return []
+@app.route('/api/import-jobs/<job_id>', methods=['GET'])
+def get_import_job(job_id):
+    """Return the status, per-section progress, stage timings and final stats of an import job."""
+    # Jobs of a process that died since start-up are failed here rather than left running forever
+    import_job_store.fail_interrupted()
+    job = import_job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Import job not found'}), 404
     
-    # Find the section start and end indices
-    start_idx = sales_section.index[0] + 1  # +1 to skip the header row
-    end_idx = None
-    
-    for idx in range(start_idx + 1, len(df)):
-        if df.iloc[idx, 0] in ["SALON CONSUMPTION - STOCK OUT", "BALANCE STOCK"]:
-            end_idx = idx - 1
-            break
-    
-    if end_idx is None:
-        end_idx = len(df) - 1
-    
-    # Extract the sales data
-    sales_data = df.iloc[start_idx:end_idx+1]
-    
-    # Filter out rows without any product name
-    sales_data = sales_data[sales_data['Product Name'].notna()]
-    
-    sales = []
-    for _, row in sales_data.iterrows():
-        # Determine payment method if available
-        payment_method = row.get('Payment Method', 'cash') if 'Payment Method' in row else 'cash'
-        
-        sales.append({
-            'id': str(uuid.uuid4()),
-            'date': row.get('Sales_Date', None),
-            'product_name': row.get('Product Name', ''),
-            'hsn_code': row.get('HSN Code', ''),
-            'unit': standardize_unit(str(row.get('UNITS', ''))),
-            'invoice_no': row.get('Sales_Invoice_No', ''),
-            'qty': fix_floating_point_errors(row.get('Sales_Qty', 0)),
-            'incl_gst': fix_floating_point_errors(row.get('Sales_Incl_GST', 0)),
-            'ex_gst': fix_floating_point_errors(row.get('Sales_Ex_GST', 0)),
-            'taxable_value': fix_floating_point_errors(row.get('Sales_Taxable_Value', 0)),
-            'igst': fix_floating_point_errors(row.get('Sales_IGST', 0)),
-            'cgst': fix_floating_point_errors(row.get('Sales_CGST', 0)),
-            'sgst': fix_floating_point_errors(row.get('Sales_SGST', 0)),
-            'invoice_value': fix_floating_point_errors(row.get('Sales_Invoice_Value', 0)),
-            'transaction_type': 'sale',
-            'payment_method': payment_method,
-            'customer': row.get('Customer', '') if 'Customer' in row else ''
-        })
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+def use_streaming_import(file, requested=None):
+    """
+    Decide whether an upload should go through the streaming reader: explicitly
+    via the `stream` parameter, or automatically for large .xlsx files.
+    """
+    if not file.filename.endswith('.xlsx'):
+        # The read-only reader only understands the OOXML format
+        return False
     
-    return sales
+    if requested is not None:
+        return requested.lower() in ('1', 'true', 'yes')
+    
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size >= STREAM_IMPORT_MIN_BYTES
 
-def process_consumption_section(df):
-    """Process the SALON CONSUMPTION - STOCK OUT section of the Excel file."""
-    consumption_section = df[df.iloc[:, 0] == "SALON CONSUMPTION - STOCK OUT"]
-    if consumption_section.empty:
-        return []
+SECTION_TITLES = {
+    'PURCHASE': 'PURCHASE - STOCK IN',
+    'SALES': 'SALES TO CUSTOMER - STOCK OUT',
+    'CONSUMPTION': 'SALON CONSUMPTION - STOCK OUT',
+    'BALANCE': 'BALANCE STOCK',
+}
+TITLE_SECTIONS = {title: section for section, title in SECTION_TITLES.items()}
+SECTION_TITLE_PATTERN = '|'.join(re.escape(title) for title in SECTION_TITLES.values())
+
+# Column layout of each section, used when a header cell is blank
+SECTION_HEADERS = {
+    'PURCHASE': [
+        'Date', 'Product Name', 'HSN Code', 'UNITS', 'Invoice No.', 'Qty.',
+        'Price Incl. GST', 'Price Ex. GST', 'Discount %', 'Purchase Cost Per Unit Ex. GST',
+        'GST %', 'Taxable Value', 'IGST', 'CGST', 'SGST', 'Invoice Value'
+    ],
+    'SALES': [
+        'Date', 'Product Name', 'HSN Code', 'UNITS', 'Invoice No.', 'Qty.',
+        'Purchase Cost Per Unit Ex. GST', 'Purchase GST %', 'Purchase Taxable Value',
+        'Purchase IGST', 'Purchase CGST', 'Purchase SGST', 'Total Purchase Cost',
+        'MRP Incl. GST', 'MRP Ex. GST', 'Discount %', 'Discounted Sales Rate Ex. GST',
+        'Sales GST %', 'Sales Taxable Value', 'Sales IGST', 'Sales CGST', 'Sales SGST',
+        'Invoice Value'
+    ],
+    'CONSUMPTION': [
+        'Date', 'Product Name', 'HSN Code', 'UNITS', 'Requisition Voucher No.', 'Qty.',
+        'Purchase Cost Per Unit Ex. GST', 'Purchase GST %', 'Taxable Value',
+        'IGST', 'CGST', 'SGST', 'Total Purchase Cost'
+    ],
+    'BALANCE': [
+        'Product Name', 'HSN Code', 'UNITS', 'Qty.', 'Taxable Value',
+        'IGST', 'CGST', 'SGST', 'Invoice Value'
+    ],
+}
+
+SectionSpan = namedtuple('SectionSpan', ['section', 'header_row', 'start', 'end'])
+
+def section_for_title(value):
+    """
+    Return the section whose title a first-column cell holds, or None. Both
+    import paths use this: an exact title matches, and so does a cell that
+    contains one (e.g. a title with a period appended).
+    """
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    if text in TITLE_SECTIONS:
+        return TITLE_SECTIONS[text]
+    match = re.search(SECTION_TITLE_PATTERN, text)
+    return TITLE_SECTIONS[match.group(0)] if match else None
+
+def index_sections(df):
+    """
+    Scan the first column of a raw (header=None) STOCK DETAILS sheet once and
+    return a {section: SectionSpan} map. Each span gives the column header row
+    and the [start, end) data rows up to the next section title.
+    """
+    first_column = df.iloc[:, 0]
     
-    # Find the section start and end indices
-    start_idx = consumption_section.index[0] + 1  # +1 to skip the header row
-    end_idx = None
-    
-    for idx in range(start_idx + 1, len(df)):
-        if df.iloc[idx, 0] in ["BALANCE STOCK"]:
-            end_idx = idx - 1
-            break
-    
-    if end_idx is None:
-        end_idx = len(df) - 1
-    
-    # Extract the consumption data
-    consumption_data = df.iloc[start_idx:end_idx+1]
-    
-    # Filter out rows without any product name
-    consumption_data = consumption_data[consumption_data['Product Name'].notna()]
-    
-    consumption = []
-    for _, row in consumption_data.iterrows():
-        consumption.append({
-            'id': str(uuid.uuid4()),
-            'date': row.get('Consumption_Date', None),
-            'product_name': row.get('Product Name', ''),
-            'hsn_code': row.get('HSN Code', ''),
-            'unit': standardize_unit(str(row.get('UNITS', ''))),
-            'qty': fix_floating_point_errors(row.get('Consumption_Qty', 0)),
-            'transaction_type': 'consumption',
-            'purpose': row.get('Purpose', '') if 'Purpose' in row else ''
-        })
+    # Exact matches are a hash lookup; only scan for titles inside longer cells if needed
+    hits = np.flatnonzero(first_column.isin(TITLE_SECTIONS).to_numpy())
+    found = {TITLE_SECTIONS[first_column.iat[row]]: int(row) for row in hits[::-1]}
     
-    return consumption
+    missing = [section for section in SECTION_TITLES if section not in found]
+    if missing and first_column.dtype == object:
+        candidates = first_column[first_column.str.contains(SECTION_TITLE_PATTERN, na=False)]
+        for label, value in candidates[::-1].items():
+            section = section_for_title(value)
+            if section in missing:
+                found[section] = df.index.get_loc(label)
+    
+    title_rows = sorted(found.items(), key=lambda item: item[1])
+    spans = {}
+    for position, (section, row) in enumerate(title_rows):
+        end = title_rows[position + 1][1] if position + 1 < len(title_rows) else len(df)
+        spans[section] = SectionSpan(section, row + 1, min(row + 2, end), end)
+    
+    return spans
 
-def process_balance_section(df):
-    """Process the BALANCE STOCK section of the Excel file."""
-    balance_section = df[df.iloc[:, 0] == "BALANCE STOCK"]
-    if balance_section.empty:
-        return []
+def section_columns(section, headers):
+    """
+    Label a section's columns from its header row, using the standard layout for
+    blank cells. Repeated labels get a '.1', '.2', ... suffix (as pandas' readers
+    do), so the first occurrence keeps the name and every label is unique.
+    """
+    layout = SECTION_HEADERS[section]
+    labels = [
+        str(caption) if pd.notna(caption) else (layout[i] if i < len(layout) else f"Unnamed_{i}")
+        for i, caption in enumerate(headers)
+    ]
     
-    # Find the section start index
-    start_idx = balance_section.index[0] + 1  # +1 to skip the header row
+    seen = set(labels)
+    if len(seen) == len(labels):
+        return labels
+    unique = []
+    counts = {}
+    for label in labels:
+        name = label
+        if label in counts:
+            while name in seen:
+                counts[label] += 1
+                name = f"{label}.{counts[label]}"
+            seen.add(name)
+        else:
+            counts[label] = 0
+        unique.append(name)
+    return unique
+
+def drop_blank_products(data):
+    """Drop rows without a product name."""
+    if 'Product Name' not in data.columns:
+        return data.iloc[0:0]
+    return data[data['Product Name'].notna()]
+
+def section_frame(df, span):
+    """Slice one section out of a raw sheet, label its columns and drop rows without a product name."""
+    headers = df.iloc[span.header_row].to_list() if span.header_row < len(df) else [None] * df.shape[1]
     
-    # Extract the balance data
-    balance_data = df.iloc[start_idx:]
+    data = df.iloc[span.start:span.end].copy()
+    data.columns = section_columns(span.section, headers)
+    return drop_blank_products(data)
+
+def section_data(df, spans, section):
+    """Return the labelled rows for `section`, or an empty frame if the sheet has no such section."""
+    span = spans.get(section)
+    if span is None:
+        return pd.DataFrame(columns=SECTION_HEADERS[section])
+    return section_frame(df, span)
+
+def section_column(data, name, default=None):
+    """Return a column of a section as a Series, or a Series filled with `default` if it is missing."""
+    if name not in data.columns:
+        return pd.Series(default, index=data.index, dtype=object)
+    return data[name]
+
+def normalize_codes(values):
+    """
+    Render a code column (e.g. HSN) as strings. Float columns, which pandas
+    produces when a batch contains blanks, lose the '.0' on integral codes.
+    """
+    text = values.astype(str)
+    if values.dtype.kind == 'f':
+        integral = values.notna() & (values % 1 == 0)
+        text[integral] = values[integral].astype('int64').astype(str)
+    return text.where(values.notna(), '').str.strip()
+
+def build_section_frame(data, fields, amount_fields, text_fields, transaction_type=None, with_ids=True):
+    """
+    Build a columnar batch for one section: product identity, standardized
+    units, parsed dates, rounded amounts and defaulted text columns.
+    """
+    frame = pd.DataFrame(index=data.index)
+    frame['product_name'] = section_column(data, 'Product Name', '')
+    frame['hsn_code'] = normalize_codes(section_column(data, 'HSN Code', ''))
+    frame['unit'] = standardize_units(section_column(data, 'UNITS', ''))
+    
+    if 'date' in fields:
+        frame['date'] = pd.to_datetime(section_column(data, fields['date']), errors='coerce')
+    for field, (column, default) in text_fields.items():
+        frame[field] = section_column(data, column, default).fillna(default)
+    for field in amount_fields:
+        frame[field] = fix_floating_point_series(section_column(data, fields[field], 0))
+    if transaction_type:
+        frame['transaction_type'] = transaction_type
     
-    # Filter out rows without any product name
-    balance_data = balance_data[balance_data['Product Name'].notna()]
+    if with_ids:
+        frame.insert(0, 'id', generate_uuids(len(frame)))
+    return frame.reset_index(drop=True)
+
+PURCHASE_FIELDS = {
+    'date': 'Date',
+    'qty': 'Qty.',
+    'incl_gst': 'Price Incl. GST',
+    'ex_gst': 'Price Ex. GST',
+    'taxable_value': 'Taxable Value',
+    'igst': 'IGST',
+    'cgst': 'CGST',
+    'sgst': 'SGST',
+    'invoice_value': 'Invoice Value',
+}
+
+SALES_FIELDS = {
+    'date': 'Date',
+    'qty': 'Qty.',
+    'incl_gst': 'MRP Incl. GST',
+    'ex_gst': 'MRP Ex. GST',
+    'taxable_value': 'Sales Taxable Value',
+    'igst': 'Sales IGST',
+    'cgst': 'Sales CGST',
+    'sgst': 'Sales SGST',
+    'invoice_value': 'Invoice Value',
+}
+
+CONSUMPTION_FIELDS = {
+    'date': 'Date',
+    'qty': 'Qty.',
+}
+
+BALANCE_FIELDS = {
+    'qty': 'Qty.',
+}
+
+AMOUNT_FIELDS = (
+    'qty', 'incl_gst', 'ex_gst', 'taxable_value', 'igst', 'cgst', 'sgst', 'invoice_value'
+)
+
+def parse_purchase_rows(data):
+    """Turn labelled PURCHASE - STOCK IN rows into a columnar purchase batch."""
+    return build_section_frame(
+        data,
+        PURCHASE_FIELDS,
+        AMOUNT_FIELDS,
+        {
+            'invoice_no': ('Invoice No.', ''),
+            'supplier': ('Supplier', ''),
+        },
+        transaction_type='purchase'
+    )
+
+def parse_sales_rows(data):
+    """Turn labelled SALES TO CUSTOMER - STOCK OUT rows into a columnar sales batch."""
+    return build_section_frame(
+        data,
+        SALES_FIELDS,
+        AMOUNT_FIELDS,
+        {
+            'invoice_no': ('Invoice No.', ''),
+            'payment_method': ('Payment Method', 'cash'),
+            'customer': ('Customer', ''),
+        },
+        transaction_type='sale'
+    )
+
+def parse_consumption_rows(data):
+    """Turn labelled SALON CONSUMPTION - STOCK OUT rows into a columnar consumption batch."""
+    return build_section_frame(
+        data,
+        CONSUMPTION_FIELDS,
+        ('qty',),
+        {
+            'purpose': ('Purpose', ''),
+        },
+        transaction_type='consumption'
+    )
+
+def parse_balance_rows(data):
+    """Turn labelled BALANCE STOCK rows into a columnar balance batch."""
+    return build_section_frame(data, BALANCE_FIELDS, ('qty',), {}, with_ids=False)
+
+SECTION_PARSERS = {
+    'PURCHASE': parse_purchase_rows,
+    'SALES': parse_sales_rows,
+    'CONSUMPTION': parse_consumption_rows,
+    'BALANCE': parse_balance_rows,
+}
+
+def process_purchase_section(df, spans=None):
+    """Process the PURCHASE - STOCK IN section of the Excel file into a columnar batch."""
+    spans = index_sections(df) if spans is None else spans
+    return parse_purchase_rows(section_data(df, spans, 'PURCHASE'))
+
+def process_sales_section(df, spans=None):
+    """Process the SALES TO CUSTOMER - STOCK OUT section of the Excel file into a columnar batch."""
+    spans = index_sections(df) if spans is None else spans
+    return parse_sales_rows(section_data(df, spans, 'SALES'))
+
+def process_consumption_section(df, spans=None):
+    """Process the SALON CONSUMPTION - STOCK OUT section of the Excel file into a columnar batch."""
+    spans = index_sections(df) if spans is None else spans
+    return parse_consumption_rows(section_data(df, spans, 'CONSUMPTION'))
+
+def process_balance_section(df, spans=None):
+    """Process the BALANCE STOCK section of the Excel file into a columnar batch."""
+    spans = index_sections(df) if spans is None else spans
+    return parse_balance_rows(section_data(df, spans, 'BALANCE'))
+
+def iter_stock_batches(file, batch_size=None):
+    """
+    Stream the STOCK DETAILS sheet of an .xlsx workbook in read-only mode and
+    yield (section, rows) batches of at most batch_size labelled rows.
+    Section titles and header rows are detected on the fly, so only one
+    batch is held in memory at a time.
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook['STOCK DETAILS']
+        section = None
+        columns = None
+        awaiting_header = False
+        rows = []
+        
+        def flush():
+            data = pd.DataFrame(rows, columns=columns)
+            rows.clear()
+            return drop_blank_products(data)
+        
+        seen = set()
+        for values in sheet.iter_rows(values_only=True):
+            # Like index_sections(), the first title row of each section starts it
+            title_section = section_for_title(values[0]) if values else None
+            if title_section is not None and title_section not in seen:
+                if rows:
+                    yield section, flush()
+                section = title_section
+                seen.add(section)
+                awaiting_header = True
+                continue
+            
+            if section is None:
+                continue
+            
+            if awaiting_header:
+                columns = section_columns(section, values)
+                awaiting_header = False
+                continue
+            
+            # Rows of a read-only sheet can be ragged; align them with the header
+            rows.append(values[:len(columns)] + (None,) * (len(columns) - len(values)))
+            if len(rows) >= batch_size:
+                yield section, flush()
+        
+        if rows:
+            yield section, flush()
+    finally:
+        workbook.close()
+
+def extract_unique_products(sections):
+    """Extract unique products from the columnar section batches."""
+    frames = [section[['product_name', 'hsn_code', 'unit']] for section in sections if len(section)]
+    if not frames:
+        return pd.DataFrame(columns=['id', 'name', 'hsn_code', 'unit'])
+    
+    products = pd.concat(frames, ignore_index=True)
+    keys = products['product_name'].astype(str).str.rstrip().str.lower() + '\x00' + \
+        products['hsn_code'].astype(str).str.rstrip().str.lower()
+    products = products[~keys.duplicated()].rename(columns={'product_name': 'name'})
+    products.insert(0, 'id', generate_uuids(len(products)))
+    return products.reset_index(drop=True)
+
+def product_key(name, hsn_code):
+    """Build the in-memory lookup key for a product, matching MySQL's case-insensitive collation."""
+    return (str(name).rstrip().lower(), str(hsn_code).rstrip().lower())
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def bulk_insert(cursor, table, columns, rows, batch_size=None, on_duplicate=None):
+    """Insert rows with multi-row INSERT statements of at most batch_size rows each."""
+    if not rows:
+        return 0
+    
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    batch_size = max(1, min(batch_size, MAX_STATEMENT_PARAMS // len(columns)))
+    row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    
+    statements = 0
+    for chunk in chunked(rows, batch_size):
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ', '.join([row_placeholder] * len(chunk))
+        )
+        if on_duplicate:
+            sql += f" ON DUPLICATE KEY UPDATE {on_duplicate}"
+        cursor.execute(sql, [value for row in chunk for value in row])
+        statements += 1
+    
+    return statements
+
+def products_by_key_query(keys):
+    """Build the lookup of product ids by (name, hsn_code) pairs."""
+    placeholders = ', '.join(['(%s, %s)'] * len(keys))
+    return (
+        f"SELECT id, name, hsn_code FROM products WHERE (name, hsn_code) IN ({placeholders})",
+        [value for key in keys for value in key]
+    )
+
+def resolve_product_ids(cursor, keys, batch_size=None):
+    """Look up product ids for (name, hsn_code) pairs in chunked queries and return a key -> id map."""
+    unique_keys = list(dict.fromkeys((name, hsn_code) for name, hsn_code in keys))
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    
+    product_ids = {}
+    for chunk in chunked(unique_keys, batch_size):
+        cursor.execute(*products_by_key_query(chunk))
+        for product_id, name, hsn_code in cursor.fetchall():
+            product_ids[product_key(name, hsn_code)] = product_id
+    
+    return product_ids
+
+PRODUCT_COLUMNS = ('id', 'name', 'hsn_code', 'unit', 'created_at')
+
+PURCHASE_COLUMNS = (
+    'id', 'product_id', 'date', 'invoice_no', 'qty', 'incl_gst', 'ex_gst',
+    'taxable_value', 'igst', 'cgst', 'sgst', 'invoice_value', 'supplier',
+    'transaction_type', 'created_at', 'row_fingerprint'
+)
+
+SALES_COLUMNS = (
+    'id', 'product_id', 'date', 'invoice_no', 'qty', 'incl_gst', 'ex_gst',
+    'taxable_value', 'igst', 'cgst', 'sgst', 'invoice_value', 'customer',
+    'payment_method', 'transaction_type', 'created_at', 'row_fingerprint'
+)
+
+CONSUMPTION_COLUMNS = (
+    'id', 'product_id', 'date', 'qty', 'purpose', 'transaction_type', 'created_at', 'row_fingerprint'
+)
+
+BALANCE_COLUMNS = ('id', 'product_id', 'qty', 'created_at', 'updated_at')
+
+def frame_rows(frame, columns):
+    """Convert the given columns of a DataFrame into a list of DB-ready row lists (NaN/NaT -> None)."""
+    values = frame.loc[:, list(columns)]
     
-    balance = []
-    for _, row in balance_data.iterrows():
-        balance.append({
-            'product_name': row.get('Product Name', ''),
-            'hsn_code': row.get('HSN Code', ''),
-            'unit': standardize_unit(str(row.get('UNITS', ''))),
-            'qty': fix_floating_point_errors(row.get('Balance_Qty', 0))
+    # The MySQL connector cannot bind pandas Timestamps, so send datetimes as strings
+    datetime_columns = values.select_dtypes(include=['datetime64', 'datetimetz']).columns
+    if len(datetime_columns):
+        values = values.assign(**{
+            column: values[column].dt.strftime('%Y-%m-%d %H:%M:%S') for column in datetime_columns
         })
     
-    return balance
+    values = values.astype(object)
+    return values.where(pd.notna(values), None).to_numpy().tolist()
 
-def extract_unique_products(transactions):
-    """Extract unique products from all transactions."""
-    products = {}
-    for transaction in transactions:
-        key = (transaction['product_name'], transaction['hsn_code'])
-        if key not in products:
-            products[key] = {
-                'id': str(uuid.uuid4()),
-                'name': transaction['product_name'],
-                'hsn_code': transaction['hsn_code'],
-                'unit': transaction['unit'] if 'unit' in transaction else ''
-            }
+def upsert_products(cursor, products, batch_size=None):
+    """
+    Insert or update products with chunked INSERT ... ON DUPLICATE KEY UPDATE on the
+    name_hsn_unique key and return the resolved (name, hsn_code) -> id map.
+    """
+    rows = frame_rows(products.assign(created_at=datetime.now()), PRODUCT_COLUMNS)
+    bulk_insert(
+        cursor,
+        'products',
+        PRODUCT_COLUMNS,
+        rows,
+        batch_size,
+        on_duplicate='unit = VALUES(unit)'
+    )
+    
+    # Existing rows keep their original ids, so read the ids back in bulk
+    return resolve_product_ids(
+        cursor, zip(products['name'].tolist(), products['hsn_code'].tolist()), batch_size
+    )
+
+def map_product_ids(product_ids, section):
+    """Map a section's (product_name, hsn_code) columns to resolved product ids, raising on unknown products."""
+    keys = zip(
+        section['product_name'].astype(str).str.rstrip().str.lower(),
+        section['hsn_code'].astype(str).str.rstrip().str.lower()
+    )
+    ids = pd.Series([product_ids.get(key) for key in keys], index=section.index, dtype=object)
+    
+    missing = ids.isna()
+    if missing.any():
+        raise ValueError(f"Product not found: {section['product_name'][missing].iloc[0]}")
+    return ids
+
+def prepare_section_frame(section, product_ids):
+    """Attach product ids (unless already mapped) and timestamps to a section batch; missing dates become today."""
+    now = datetime.now()
+    if 'product_id' not in section.columns:
+        section = section.assign(product_id=map_product_ids(product_ids, section))
+    prepared = section.assign(created_at=now)
+    if 'date' in prepared.columns:
+        prepared['date'] = prepared['date'].fillna(pd.Timestamp(now))
+    return prepared
+
+def prepare_section_rows(section, product_ids, columns):
+    """Prepare a section batch with prepare_section_frame() and return its rows for `columns`."""
+    return frame_rows(prepare_section_frame(section, product_ids), columns)
+
+def write_purchases(cursor, purchases, product_ids, batch_size=None, ledger_starts=None):
+    """Insert a purchase batch with multi-row statements and add it to product_cost_stats and the stock ledger."""
+    purchases = prepare_section_frame(purchases, product_ids)
+    rows = frame_rows(purchases, PURCHASE_COLUMNS)
+    statements = bulk_insert(cursor, 'purchases', PURCHASE_COLUMNS, rows, batch_size)
+    
+    # Keep the per-product cost aggregates in step with the purchases table
+    accumulate_cost_stats(cursor, purchases, batch_size)
+    apply_ledger_movements(cursor, ledger_movements(
+        purchases['product_id'], purchases['date'], in_qty=purchases['qty'], in_value=purchases['taxable_value']
+    ), ledger_starts)
+    return statements
+
+def write_sales(cursor, sales, product_ids, batch_size=None, ledger_starts=None):
+    """Insert a sales batch with multi-row statements and add it to the stock ledger."""
+    sales = prepare_section_frame(sales, product_ids)
+    rows = frame_rows(sales, SALES_COLUMNS)
+    statements = bulk_insert(cursor, 'sales', SALES_COLUMNS, rows, batch_size)
+    apply_ledger_movements(cursor, ledger_movements(
+        sales['product_id'], sales['date'], out_qty=sales['qty'], out_value=sales['taxable_value']
+    ), ledger_starts)
+    return statements
+
+def write_consumption(cursor, consumption, product_ids, batch_size=None, ledger_starts=None):
+    """Insert a consumption batch with multi-row statements and add it to the stock ledger."""
+    consumption = prepare_section_frame(consumption, product_ids)
+    rows = frame_rows(consumption, CONSUMPTION_COLUMNS)
+    statements = bulk_insert(cursor, 'consumption', CONSUMPTION_COLUMNS, rows, batch_size)
+    apply_ledger_movements(cursor, ledger_movements(
+        consumption['product_id'], consumption['date'], consumed_qty=consumption['qty']
+    ), ledger_starts)
+    return statements
+
+def write_balance_stock(cursor, balance, product_ids, batch_size=None, ledger_starts=None):
+    """
+    Upsert a balance stock batch keyed on the product_id_unique index. Balance rows
+    are a snapshot rather than a movement, so the stock ledger is not touched.
+    """
+    balance = balance.assign(id=generate_uuids(len(balance)), updated_at=datetime.now())
+    rows = prepare_section_rows(balance, product_ids, BALANCE_COLUMNS)
+    return bulk_insert(
+        cursor,
+        'balance_stock',
+        BALANCE_COLUMNS,
+        rows,
+        batch_size,
+        on_duplicate='qty = VALUES(qty), updated_at = VALUES(updated_at)'
+    )
+
+COST_STATS_COLUMNS = (
+    'product_id', 'purchase_count', 'ex_gst_count', 'sum_ex_gst', 'gst_rate_count',
+    'sum_gst_rate', 'total_qty', 'total_taxable_value', 'total_igst'
+)
+
+def purchase_cost_deltas(purchases):
+    """
+    Aggregate a purchase batch (with a product_id column) into per-product
+    additions to the product_cost_stats running sums. NULL prices and rows
+    without a taxable value are left out of the counts, as AVG() would.
+    """
+    ex_gst = pd.to_numeric(purchases['ex_gst'], errors='coerce')
+    taxable_value = pd.to_numeric(purchases['taxable_value'], errors='coerce')
+    igst = pd.to_numeric(purchases['igst'], errors='coerce')
+    gst_rate = igst / taxable_value.where(taxable_value != 0)
+    
+    deltas = pd.DataFrame({
+        'product_id': purchases['product_id'].to_numpy(),
+        'purchase_count': 1,
+        'ex_gst_count': ex_gst.notna().astype(int).to_numpy(),
+        'sum_ex_gst': ex_gst.fillna(0).to_numpy(),
+        'gst_rate_count': gst_rate.notna().astype(int).to_numpy(),
+        'sum_gst_rate': gst_rate.fillna(0).to_numpy(),
+        'total_qty': pd.to_numeric(purchases['qty'], errors='coerce').fillna(0).to_numpy(),
+        'total_taxable_value': taxable_value.fillna(0).to_numpy(),
+        'total_igst': igst.fillna(0).to_numpy(),
+    })
+    return deltas.groupby('product_id', sort=False).sum().reset_index()
+
+def accumulate_cost_stats(cursor, purchases, batch_size=None):
+    """Add a purchase batch to product_cost_stats in the caller's transaction."""
+    if purchases.empty:
+        return 0
+    
+    rows = frame_rows(purchase_cost_deltas(purchases), COST_STATS_COLUMNS)
+    return bulk_insert(
+        cursor,
+        'product_cost_stats',
+        COST_STATS_COLUMNS,
+        rows,
+        batch_size,
+        on_duplicate=', '.join(f"{column} = {column} + VALUES({column})" for column in COST_STATS_COLUMNS[1:])
+    )
+
+def fetch_by_ids(cursor, sql, ids, batch_size=None):
+    """
+    Run `sql` (containing an `{ids}` placeholder list) for chunks of `ids` and
+    return all rows, keeping each IN list within the statement limits.
+    """
+    rows = []
+    for chunk in chunked(list(ids), batch_size or IMPORT_BATCH_SIZE):
+        cursor.execute(sql.format(ids=', '.join(['%s'] * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+# Lookups by id lists, run through fetch_by_ids() (the {ids} placeholder list is filled per chunk)
+PRODUCTS_BY_ID_SQL = "SELECT id FROM products WHERE id IN ({ids})"
+SALES_BY_IDEMPOTENCY_KEY_SQL = "SELECT idempotency_key, id FROM sales WHERE idempotency_key IN ({ids})"
+COST_STATS_SQL = """
+    SELECT product_id, ex_gst_count, sum_ex_gst, gst_rate_count, sum_gst_rate,
+           total_qty, total_taxable_value, total_igst
+    FROM product_cost_stats
+    WHERE product_id IN ({ids})
+"""
+
+def load_purchase_costs(cursor, product_ids, valuation=None):
+    """
+    Return product_id -> (cost_ex_gst, gst_percentage) from the product_cost_stats
+    running sums (None when there is no value).
+    
+    The 'average' valuation matches AVG(ex_gst) and AVG(igst / taxable_value)
+    over the product's purchases; 'moving_average' weights every purchase by
+    its quantity and value (sum of taxable value / sum of qty).
+    """
+    valuation = valuation or COST_VALUATION
+    if valuation not in COST_VALUATIONS:
+        raise ValueError(f"Unknown cost valuation: {valuation}")
     
-    return list(products.values())
+    rows = fetch_by_ids(cursor, COST_STATS_SQL, product_ids)
+    
+    costs = {}
+    for (product_id, ex_gst_count, sum_ex_gst, gst_rate_count, sum_gst_rate,
+         total_qty, total_taxable_value, total_igst) in rows:
+        if valuation == 'moving_average':
+            costs[product_id] = (
+                float(total_taxable_value) / float(total_qty) if total_qty else None,
+                float(total_igst) / float(total_taxable_value) if total_taxable_value else None
+            )
+        else:
+            costs[product_id] = (
+                float(sum_ex_gst) / ex_gst_count if ex_gst_count else None,
+                float(sum_gst_rate) / gst_rate_count if gst_rate_count else None
+            )
+    return costs
+
+def rebuild_cost_stats(cursor, product_ids=None):
+    """
+    Recompute product_cost_stats from the purchases table, for every product or
+    only `product_ids`, in the caller's transaction. Returns the rows written.
+    """
+    where = ''
+    params = []
+    if product_ids:
+        where = f"WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})"
+        params = list(product_ids)
+    
+    cursor.execute(f"DELETE FROM product_cost_stats {where}", params)
+    
+    # NULLIF keeps zero taxable values out of the rate average, like the incremental path
+    cursor.execute(
+        f"""
+        INSERT INTO product_cost_stats ({', '.join(COST_STATS_COLUMNS)})
+        SELECT
+            product_id,
+            COUNT(*),
+            COUNT(ex_gst),
+            COALESCE(SUM(ex_gst), 0),
+            COUNT(igst / NULLIF(taxable_value, 0)),
+            COALESCE(SUM(igst / NULLIF(taxable_value, 0)), 0),
+            COALESCE(SUM(qty), 0),
+            COALESCE(SUM(taxable_value), 0),
+            COALESCE(SUM(igst), 0)
+        FROM purchases
+        {where}
+        GROUP BY product_id
+        """,
+        params
+    )
+    return cursor.rowcount
+
+@app.cli.command('rebuild-cost-stats')
+@click.option('--product-id', 'product_ids', multiple=True, help='Only rebuild these products (repeatable).')
+def rebuild_cost_stats_command(product_ids):
+    """Rebuild product_cost_stats from the purchases table."""
+    conn = get_db_connection()
+    if not conn:
+        raise click.ClickException('Database connection failed')
+    
+    try:
+        cursor = conn.cursor()
+        rows = rebuild_cost_stats(cursor, product_ids)
+        conn.commit()
+        cursor.close()
+        click.echo(f"Rebuilt cost stats for {rows} products")
+    finally:
+        conn.close()
+
+LEDGER_MOVEMENT_COLUMNS = ('in_qty', 'out_qty', 'consumed_qty', 'in_value', 'out_value')
+
+def ledger_movements(product_ids, dates, **movements):
+    """
+    Build stock ledger movement rows (product_id, date and LEDGER_MOVEMENT_COLUMNS)
+    from aligned sequences; movement columns that are not given are zero.
+    """
+    frame = pd.DataFrame({
+        'product_id': np.asarray(product_ids, dtype=object),
+        'date': pd.to_datetime(pd.Series(np.asarray(dates, dtype=object))).dt.strftime('%Y-%m-%d').to_numpy(),
+    })
+    for column in LEDGER_MOVEMENT_COLUMNS:
+        values = movements.get(column, 0)
+        if not np.isscalar(values):
+            values = pd.to_numeric(pd.Series(np.asarray(values, dtype=object)), errors='coerce').fillna(0).to_numpy()
+        frame[column] = values
+    return frame
+
+def apply_ledger_movements(cursor, movements, ledger_starts=None):
+    """
+    Add movement rows to stock_ledger, summed per (product, day) and applied as
+    atomic increments. Opening/closing balances from the earliest touched day
+    onwards are then recomputed, or, when `ledger_starts` is given, that day is
+    recorded there so the caller can recompute once after several batches.
+    """
+    if movements.empty:
+        return 0
+    
+    # Rows are upserted in (product_id, date) order, the same order recompute_ledger() writes
+    # them in, so concurrent syncs take their row locks in one order instead of deadlocking
+    movements = movements.groupby(['product_id', 'date'])[list(LEDGER_MOVEMENT_COLUMNS)].sum().reset_index()
+    columns = ('product_id', 'date', *LEDGER_MOVEMENT_COLUMNS)
+    statements = bulk_insert(
+        cursor,
+        'stock_ledger',
+        columns,
+        frame_rows(movements, columns),
+        on_duplicate=', '.join(f"{column} = {column} + VALUES({column})" for column in LEDGER_MOVEMENT_COLUMNS)
+    )
+    
+    starts = movements.groupby('product_id')['date'].min().to_dict()
+    if ledger_starts is None:
+        recompute_ledger(cursor, starts)
+    else:
+        for product_id, start in starts.items():
+            ledger_starts[product_id] = min(start, ledger_starts.get(product_id, start))
+    return statements
+
+def ledger_previous_days_query(starts):
+    """
+    Build the locked read of each product's last ledger day before its start day
+    (product_id -> 'YYYY-MM-DD'), whose closing balance carries into the recompute.
+    """
+    params = [value for product_id in starts for value in (product_id, str(starts[product_id]))]
+    before = ' OR '.join(['(product_id = %s AND date < %s)'] * len(starts))
+    return (
+        f"SELECT product_id, MAX(date) FROM stock_ledger WHERE {before} GROUP BY product_id FOR UPDATE",
+        params
+    )
+
+def ledger_range_query(starts):
+    """Build the locked read of each product's ledger rows from its given day (product_id -> day) onwards."""
+    params = [value for product_id in starts for value in (product_id, str(starts[product_id]))]
+    after = ' OR '.join(['(product_id = %s AND date >= %s)'] * len(starts))
+    return (
+        f"""
+        SELECT product_id, date, in_qty, out_qty, consumed_qty, closing_qty
+        FROM stock_ledger
+        WHERE {after}
+        ORDER BY product_id, date
+        FOR UPDATE
+        """,
+        params
+    )
+
+def recompute_ledger(cursor, starts, batch_size=None):
+    """
+    Recompute opening/closing quantities for each product from its start day
+    (product_id -> 'YYYY-MM-DD') onwards: one locked read finding the day
+    before the start day, one locked range read from that day on and one upsert
+    per chunk of products.
+    """
+    batch_size = batch_size or LEDGER_RECOMPUTE_CHUNK
+    for chunk in chunked(sorted(starts), batch_size):
+        chunk_starts = {product_id: str(starts[product_id]) for product_id in chunk}
+        
+        # Both reads lock, so they see the latest committed rows rather than this transaction's
+        # snapshot: the carried-in balance cannot come from before a concurrent backdated write
+        cursor.execute(*ledger_previous_days_query(chunk_starts))
+        previous = {product_id: str(date) for product_id, date in cursor.fetchall()}
+        
+        # FOR UPDATE keeps concurrent writers from interleaving with the recompute
+        cursor.execute(*ledger_range_query({
+            product_id: previous.get(product_id, start) for product_id, start in chunk_starts.items()
+        }))
+        rows = cursor.fetchall()
+        if not rows:
+            continue
+        
+        ledger = pd.DataFrame(rows, columns=['product_id', 'date', 'in_qty', 'out_qty', 'consumed_qty', 'closing_qty'])
+        # The day before the start day only supplies the balance carried into it
+        is_carried = ledger['date'].astype(str) < ledger['product_id'].map(chunk_starts)
+        carried = dict(zip(ledger.loc[is_carried, 'product_id'], ledger.loc[is_carried, 'closing_qty'].astype(float)))
+        ledger = ledger[~is_carried].drop(columns='closing_qty')
+        if ledger.empty:
+            continue
+        
+        # Sorted here as well: the database collation may order product ids differently from Python
+        ledger = ledger.sort_values(['product_id', 'date'], kind='stable', ignore_index=True)
+        net = (
+            ledger['in_qty'].astype(float) - ledger['out_qty'].astype(float) - ledger['consumed_qty'].astype(float)
+        )
+        closing = net.groupby(ledger['product_id'], sort=False).cumsum() + ledger['product_id'].map(carried).fillna(0.0)
+        ledger['closing_qty'] = closing.round(2)
+        ledger['opening_qty'] = (closing - net).round(2)
+        
+        columns = ('product_id', 'date', 'opening_qty', 'closing_qty')
+        bulk_insert(
+            cursor,
+            'stock_ledger',
+            columns,
+            frame_rows(ledger, columns),
+            on_duplicate='opening_qty = VALUES(opening_qty), closing_qty = VALUES(closing_qty)'
+        )
+
+def backfill_stock_ledger(cursor, product_ids):
+    """
+    Rebuild the stock ledger of `product_ids` from purchases, sales and consumption
+    with set-based statements. Converted cash sales count only as consumption.
+    """
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"DELETE FROM stock_ledger WHERE product_id IN ({placeholders})", product_ids)
+    
+    cursor.execute(
+        f"""
+        INSERT INTO stock_ledger (product_id, date, {', '.join(LEDGER_MOVEMENT_COLUMNS)})
+        SELECT product_id, date, SUM(in_qty), SUM(out_qty), SUM(consumed_qty), SUM(in_value), SUM(out_value)
+        FROM (
+            SELECT product_id, date, qty AS in_qty, 0 AS out_qty, 0 AS consumed_qty,
+                   COALESCE(taxable_value, 0) AS in_value, 0 AS out_value
+            FROM purchases WHERE product_id IN ({placeholders})
+            UNION ALL
+            SELECT product_id, date, 0, qty, 0, 0, COALESCE(taxable_value, 0)
+            FROM sales
+            WHERE product_id IN ({placeholders})
+              AND converted_to_consumption = 0
+            UNION ALL
+            SELECT product_id, date, 0, 0, qty, 0, 0
+            FROM consumption WHERE product_id IN ({placeholders})
+        ) movements
+        GROUP BY product_id, date
+        """,
+        list(product_ids) * 3
+    )
+    
+    recompute_ledger(cursor, {product_id: '0001-01-01' for product_id in product_ids})
+
+@app.cli.command('backfill-stock-ledger')
+@click.option('--product-id', 'product_ids', multiple=True, help='Only backfill these products (repeatable).')
+def backfill_stock_ledger_command(product_ids):
+    """Rebuild stock_ledger from the transaction tables, one committed chunk of products at a time."""
+    conn = get_db_connection()
+    if not conn:
+        raise click.ClickException('Database connection failed')
+    
+    try:
+        cursor = conn.cursor()
+        if not product_ids:
+            cursor.execute("SELECT id FROM products ORDER BY id")
+            product_ids = [row[0] for row in cursor.fetchall()]
+        
+        done = 0
+        for chunk in chunked(list(product_ids), LEDGER_RECOMPUTE_CHUNK):
+            backfill_stock_ledger(cursor, chunk)
+            conn.commit()
+            done += len(chunk)
+            click.echo(f"Backfilled {done}/{len(product_ids)} products")
+        cursor.close()
+    finally:
+        conn.close()
+
+# Parsed fields that identify a transaction row (besides its section and product) for delta imports.
+# Quantities and amounts are left out so that a row edited in the sheet keeps its identity.
+FINGERPRINT_FIELDS = {
+    'PURCHASE': ('date', 'invoice_no', 'supplier'),
+    'SALES': ('date', 'invoice_no', 'customer', 'payment_method'),
+    'CONSUMPTION': ('date', 'purpose'),
+}
+
+# Editable values compared against the stored row to tell an edited row from an unchanged one
+FINGERPRINT_VALUE_FIELDS = {
+    'PURCHASE': AMOUNT_FIELDS,
+    'SALES': AMOUNT_FIELDS,
+    'CONSUMPTION': ('qty',),
+}
+
+FINGERPRINT_TABLES = {
+    'PURCHASE': 'purchases',
+    'SALES': 'sales',
+    'CONSUMPTION': 'consumption',
+}
+
+class DuplicateImportError(ValueError):
+    """Raised when a concurrent delta import stored the same rows first."""
+
+def fingerprint_text(batch, field):
+    """Render one fingerprint field of a parsed batch as canonical strings."""
+    values = batch[field]
+    if field == 'date':
+        return values.dt.strftime('%Y-%m-%d').fillna('')
+    if field in AMOUNT_FIELDS:
+        return pd.to_numeric(values, errors='coerce').round(2).map('{:.2f}'.format, na_action='ignore').fillna('')
+    return values.astype(str).str.strip()
+
+def value_text(section, frame):
+    """Join the FINGERPRINT_VALUE_FIELDS of a batch (or of stored rows) into one comparable string per row."""
+    parts = [fingerprint_text(frame, field) for field in FINGERPRINT_VALUE_FIELDS[section]]
+    return parts[0].str.cat(parts[1:], sep='\x1f') if len(parts) > 1 else parts[0]
+
+def fingerprint_rows(section, batch, occurrences=None):
+    """
+    Give every row of a parsed transaction batch a stable identity fingerprint
+    (SHA-1 over its section, product and FINGERPRINT_FIELDS) and an id derived
+    from it. Quantities and amounts are not part of it, so an edited row keeps
+    its fingerprint.
+    
+    Rows with the same identity are numbered in order of appearance and the
+    number is part of the fingerprint, so genuine repeats stay distinct rows.
+    `occurrences` carries the counts across the batches of one workbook.
+    """
+    if section not in FINGERPRINT_FIELDS or batch.empty:
+        return batch
+    occurrences = {} if occurrences is None else occurrences
+    
+    parts = [
+        batch['product_name'].astype(str).str.rstrip().str.lower(),
+        batch['hsn_code'].astype(str).str.rstrip().str.lower(),
+    ]
+    parts.extend(fingerprint_text(batch, field) for field in FINGERPRINT_FIELDS[section])
+    content = parts[0].str.cat(parts[1:], sep='\x1f')
+    
+    digests = pd.Series(
+        [hashlib.sha1(f'{section}\x1f{text}'.encode('utf-8')).digest() for text in content], index=batch.index
+    )
+    numbers = digests.groupby(digests, sort=False).cumcount() + digests.map(occurrences).fillna(0).astype(int)
+    for digest, count in digests.value_counts(sort=False).items():
+        occurrences[digest] = occurrences.get(digest, 0) + count
+    
+    fingerprints = [
+        hashlib.sha1(digest + str(number).encode()).hexdigest() for digest, number in zip(digests, numbers)
+    ]
+    ids = [f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}' for h in fingerprints]
+    return batch.assign(id=ids, row_fingerprint=fingerprints)
+
+def stored_row_columns(section):
+    columns = ['row_fingerprint', 'product_id', *FINGERPRINT_VALUE_FIELDS[section]]
+    if section == 'SALES':
+        # Converted sales are referenced by their consumption row and are never replaced
+        columns.append('converted_to_consumption')
+    return columns
+
+def stored_rows_sql(section):
+    """Build the fetch_by_ids() lookup of a section's stored rows by fingerprint."""
+    columns = stored_row_columns(section)
+    return f"SELECT {', '.join(columns)} FROM {FINGERPRINT_TABLES[section]} WHERE row_fingerprint IN ({{ids}})"
+
+def load_stored_rows(cursor, section, fingerprints):
+    """Return the stored rows of `fingerprints` (row_fingerprint, product_id and value fields) as a frame."""
+    rows = fetch_by_ids(cursor, stored_rows_sql(section), fingerprints)
+    return pd.DataFrame(rows, columns=stored_row_columns(section))
+
+def delete_stored_rows(cursor, section, fingerprints, batch_size=None):
+    """Delete stored rows by fingerprint with chunked IN lists."""
+    for chunk in chunked(list(fingerprints), batch_size or IMPORT_BATCH_SIZE):
+        cursor.execute(
+            f"DELETE FROM {FINGERPRINT_TABLES[section]} WHERE row_fingerprint IN ({', '.join(['%s'] * len(chunk))})",
+            chunk
+        )
+
+def prepare_import_batch(cursor, section, batch, mode, occurrences=None, replaced=None, converted=None):
+    """
+    Fingerprint a parsed section batch against the rows already stored.
+    
+    A 'full' import writes every row: rows whose fingerprint is already stored
+    are written as plain rows without one. A 'delta' import drops unchanged
+    rows and deletes the stored version of edited rows so that the batch
+    replaces them; the product ids of replaced rows are added to
+    `replaced[section]` for rebuild_replaced_products(). Edited sales that were
+    converted to consumption keep their stored version and are dropped from the
+    batch; their fingerprints are added to `converted`.
+    """
+    if section not in FINGERPRINT_TABLES:
+        return batch
+    batch = fingerprint_rows(section, batch, occurrences)
+    if batch.empty:
+        return batch
+    
+    stored = load_stored_rows(cursor, section, batch['row_fingerprint'].tolist())
+    if stored.empty:
+        return batch
+    is_stored = batch['row_fingerprint'].isin(stored['row_fingerprint'])
+    
+    if mode != 'delta':
+        # Repeats of stored rows are not tracked, so a later delta import still matches the originals
+        batch = batch.copy()
+        batch.loc[is_stored, 'row_fingerprint'] = None
+        batch.loc[is_stored, 'id'] = generate_uuids(int(is_stored.sum()))
+        return batch
+    
+    stored_values = pd.Series(value_text(section, stored).to_numpy(), index=stored['row_fingerprint'])
+    unchanged = is_stored & (batch['row_fingerprint'].map(stored_values) == value_text(section, batch))
+    edited = stored[stored['row_fingerprint'].isin(batch.loc[is_stored & ~unchanged, 'row_fingerprint'])]
+    if section == 'SALES':
+        # Replacing a converted sale would leave its consumption row pointing at an unconverted sale
+        kept = edited['converted_to_consumption'].astype(bool)
+        unchanged |= batch['row_fingerprint'].isin(edited.loc[kept, 'row_fingerprint'])
+        if converted is not None:
+            converted.extend(edited.loc[kept, 'row_fingerprint'].tolist())
+        edited = edited[~kept]
+    if not edited.empty:
+        delete_stored_rows(cursor, section, edited['row_fingerprint'].tolist())
+        if replaced is not None:
+            replaced.setdefault(section, []).extend(edited['product_id'].tolist())
+    return batch[~unchanged]
+
+def rebuild_replaced_products(cursor, replaced, ledger_starts=None):
+    """
+    Rebuild the cost stats and stock ledger of products whose rows a delta
+    import replaced: the increments added for the new rows do not take the
+    deleted versions out again. Their products are dropped from `ledger_starts`.
+    """
+    product_ids = sorted({product_id for ids in replaced.values() for product_id in ids})
+    if not product_ids:
+        return
+    if replaced.get('PURCHASE'):
+        rebuild_cost_stats(cursor, sorted(set(replaced['PURCHASE'])))
+    for chunk in chunked(product_ids, LEDGER_RECOMPUTE_CHUNK):
+        backfill_stock_ledger(cursor, chunk)
+    if ledger_starts is not None:
+        for product_id in product_ids:
+            ledger_starts.pop(product_id, None)
+
+def import_mode(value):
+    """Validate an import mode (defaults to IMPORT_MODE). Raises ValueError for unknown modes."""
+    mode = (value or IMPORT_MODE).lower()
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(IMPORT_MODES)}")
+    return mode
+
+SECTION_WRITERS = {
+    'PURCHASE': write_purchases,
+    'SALES': write_sales,
+    'CONSUMPTION': write_consumption,
+    'BALANCE': write_balance_stock,
+}
+
+def store_section_batch(cursor, section, batch, product_ids, ledger_starts=None):
+    """Upsert products not yet seen in this import, then write one parsed section batch."""
+    products = extract_unique_products([batch])
+    unseen = [
+        product_key(name, hsn_code) not in product_ids
+        for name, hsn_code in zip(products['name'], products['hsn_code'])
+    ]
+    if any(unseen):
+        product_ids.update(upsert_products(cursor, products[unseen]))
+    
+    SECTION_WRITERS[section](cursor, batch, product_ids, ledger_starts=ledger_starts)
+
+def import_stock_stream(cursor, file, batch_size=None, mode='full', progress=None, replaced=None, converted=None):
+    """
+    Import a workbook through iter_stock_batches(), parsing and writing one batch
+    at a time. Returns the resolved product id map and per-section counts of rows
+    written and rows skipped (delta mode) as already imported. Product ids of
+    rows replaced in delta mode are collected in `replaced`, fingerprints of
+    edited sales kept because they were converted in `converted`.
+    """
+    progress = progress or ImportProgress()
+    replaced = {} if replaced is None else replaced
+    product_ids = {}
+    counts = dict.fromkeys(SECTION_TITLES, 0)
+    skipped = dict.fromkeys(SECTION_TITLES, 0)
+    occurrences = {}
+    # Ledger balances are recomputed once at the end rather than after every batch
+    ledger_starts = {}
+    
+    batches = iter_stock_batches(file, batch_size)
+    while True:
+        with progress.stage('parse'):
+            section, rows = next(batches, (None, None))
+            if section is None:
+                break
+            batch = SECTION_PARSERS[section](rows)
+        progress.parsed(section, len(batch))
+        
+        with progress.stage('fingerprint'):
+            rows = prepare_import_batch(cursor, section, batch, mode, occurrences, replaced, converted)
+        with progress.stage('write'):
+            store_section_batch(cursor, section, rows, product_ids, ledger_starts)
+        progress.written(section, len(rows))
+        counts[section] += len(rows)
+        skipped[section] += len(batch) - len(rows)
+    
+    with progress.stage('ledger'):
+        rebuild_replaced_products(cursor, replaced, ledger_starts)
+        recompute_ledger(cursor, ledger_starts)
+    
+    return product_ids, counts, skipped
 
 def insert_product(cursor, product):
     """Insert a product into the database."""
@@ -446,6 +1656,19 @@ def insert_purchase(cursor, purchase):
                 datetime.now()
             )
         )
+        
+        # Keep the per-product cost aggregates and the stock ledger in step, in the same transaction
+        accumulate_cost_stats(cursor, pd.DataFrame([{
+            'product_id': product_id,
+            'qty': purchase['qty'],
+            'ex_gst': purchase['ex_gst'],
+            'taxable_value': purchase['taxable_value'],
+            'igst': purchase['igst'],
+        }]))
+        apply_ledger_movements(cursor, ledger_movements(
+            [product_id], [purchase['date'] or datetime.now()],
+            in_qty=[purchase['qty']], in_value=[purchase['taxable_value']]
+        ))
     except Error as e:
         print(f"Error inserting purchase: {e}")
         raise
@@ -494,6 +1717,11 @@ def insert_sale(cursor, sale):
                 datetime.now()
             )
         )
+        
+        apply_ledger_movements(cursor, ledger_movements(
+            [product_id], [sale['date'] or datetime.now()],
+            out_qty=[sale['qty']], out_value=[sale['taxable_value']]
+        ))
     except Error as e:
         print(f"Error inserting sale: {e}")
         raise
@@ -531,6 +1759,10 @@ def insert_consumption(cursor, consumption):
                 datetime.now()
             )
         )
+        
+        apply_ledger_movements(cursor, ledger_movements(
+            [product_id], [consumption['date'] or datetime.now()], consumed_qty=[consumption['qty']]
+        ))
     except Error as e:
         print(f"Error inserting consumption: {e}")
         raise
@@ -588,573 +1820,1296 @@ def update_balance_stock(cursor, balance):
         print(f"Error updating balance stock: {e}")
         raise
 
-@app.route('/api/convert-transaction', methods=['POST'])
-def convert_transaction():
+# Consumption rows created from a cash sale get an id derived from the sale id, so a
+# repeated or resumed conversion can never create a second row for the same sale
+CONVERSION_ID_PREFIX = 'consumption:'
+
+def md5_uuid_sql(expression):
+    """SQL that formats MD5(expression) as a 36-character UUID string."""
+    digest = f"MD5({expression})"
+    return (
+        f"CONCAT_WS('-', SUBSTRING({digest}, 1, 8), SUBSTRING({digest}, 9, 4), "
+        f"SUBSTRING({digest}, 13, 4), SUBSTRING({digest}, 17, 4), SUBSTRING({digest}, 21, 12))"
+    )
+
+CONVERSION_ID_SQL = md5_uuid_sql(f"CONCAT('{CONVERSION_ID_PREFIX}', s.id)")
+
+def conversion_consumption_id(sale_id):
+    """Python counterpart of CONVERSION_ID_SQL: the consumption id for a converted sale."""
+    digest = hashlib.md5(f"{CONVERSION_ID_PREFIX}{sale_id}".encode()).hexdigest()
+    return f"{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:]}"
+
+UNCONVERTED_CASH_SALE = (
+    "s.payment_method = 'cash' AND s.converted_to_consumption = 0"
+)
+
+CONVERSION_FILTER_KEYS = ('from', 'to', 'product_id', 'product_ids')
+
+def validate_conversion_filter(filters):
+    """
+    Check a conversion filter before it selects sales. Raises ValueError unless
+    it is an object with at least one of CONVERSION_FILTER_KEYS set, so an empty
+    filter cannot convert every cash sale.
+    """
+    if not isinstance(filters, dict):
+        raise ValueError('filter must be an object')
+    if not any(filters.get(key) for key in CONVERSION_FILTER_KEYS):
+        raise ValueError(f"filter needs at least one of: {', '.join(CONVERSION_FILTER_KEYS)}")
+    if filters.get('product_ids') and not isinstance(filters['product_ids'], list):
+        raise ValueError('filter.product_ids must be a list')
+
+def conversion_candidates_query(filters):
+    """Build the query selecting unconverted cash sales for a date range / product filter."""
+    conditions = [UNCONVERTED_CASH_SALE]
+    params = []
+    if filters.get('from'):
+        conditions.append('s.date >= %s')
+        params.append(filters['from'])
+    if filters.get('to'):
+        conditions.append('s.date <= %s')
+        params.append(filters['to'])
+    product_ids = filters.get('product_ids') or ([filters['product_id']] if filters.get('product_id') else [])
+    if product_ids:
+        conditions.append(f"s.product_id IN ({', '.join(['%s'] * len(product_ids))})")
+        params.extend(product_ids)
+    
+    return f"SELECT s.id FROM sales s WHERE {' AND '.join(conditions)} ORDER BY s.date, s.id", params
+
+def conversion_candidates(cursor, filters):
+    """Return the ids of unconverted cash sales matching a date range / product filter."""
+    cursor.execute(*conversion_candidates_query(filters))
+    return [row[0] for row in cursor.fetchall()]
+
+def conversion_queries(sale_ids, now):
+    """
+    Build the statements converting one chunk of cash sales: the locked read of
+    the sales (for the stock ledger), the INSERT ... SELECT of their consumption
+    rows and the joined UPDATE marking them converted.
+    """
+    placeholders = ', '.join(['%s'] * len(sale_ids))
+    lock = (
+        f"""
+        SELECT s.product_id, s.date, s.qty, s.taxable_value
+        FROM sales s
+        WHERE s.id IN ({placeholders}) AND {UNCONVERTED_CASH_SALE}
+        FOR UPDATE
+        """,
+        list(sale_ids)
+    )
+    insert = (
+        f"""
+        INSERT INTO consumption (
+            id, product_id, date, qty, purpose, transaction_type,
+            original_sale_id, created_at
+        )
+        SELECT {CONVERSION_ID_SQL}, s.product_id, s.date, s.qty, 'Converted from cash sale', 'consumption', s.id, %s
+        FROM sales s
+        WHERE s.id IN ({placeholders}) AND {UNCONVERTED_CASH_SALE}
+        """,
+        [now, *sale_ids]
+    )
+    update = (
+        f"""
+        UPDATE sales s
+        JOIN consumption c ON c.id = {CONVERSION_ID_SQL}
+        SET s.converted_to_consumption = 1,
+            s.converted_at = %s,
+            s.consumption_id = c.id
+        WHERE s.id IN ({placeholders}) AND {UNCONVERTED_CASH_SALE}
+        """,
+        [now, *sale_ids]
+    )
+    return lock, insert, update
+
+def convert_sales_chunk(cursor, sale_ids, now):
+    """
+    Convert one chunk of cash sales with two set-based statements: INSERT ... SELECT
+    the consumption rows, then mark the sales converted with a joined UPDATE.
+    Sales that are not unconverted cash sales are skipped. Returns the number converted.
+    """
+    lock, insert, update = conversion_queries(sale_ids, now)
+    
+    # Lock the sales being converted and keep their quantities for the stock ledger
+    cursor.execute(*lock)
+    converted = cursor.fetchall()
+    if not converted:
+        return 0
+    cursor.execute(*insert)
+    cursor.execute(*update)
+    converted_count = cursor.rowcount
+    
+    # The stock leaves as consumption instead of as a sale, so closing balances stay the same
+    product_ids, dates, qtys, values = zip(*converted)
+    apply_ledger_movements(cursor, ledger_movements(
+        product_ids, dates,
+        out_qty=[-float(qty or 0) for qty in qtys],
+        out_value=[-float(value or 0) for value in values],
+        consumed_qty=[float(qty or 0) for qty in qtys]
+    ))
+    return converted_count
+
+@app.route('/api/convert-transaction', methods=['POST'])
+def convert_transaction():
+    """
+    Convert cash sales transactions to salon consumption.
+    
+    Takes either explicit `transactionIds` or a `filter` ({from, to, product_id
+    or product_ids}) selecting unconverted cash sales. Sales are converted in
+    chunks of CONVERT_BATCH_SIZE with set-based statements, each chunk committed
+    on its own so locks are held briefly. Consumption ids are derived from the
+    sale ids, so an interrupted conversion can simply be run again.
+    """
+    data = request.json
+    # A null transactionIds or filter counts as missing
+    transaction_ids = data.get('transactionIds') if isinstance(data, dict) else None
+    filters = data.get('filter') if isinstance(data, dict) else None
+    if transaction_ids is None and filters is None:
+        return jsonify({'error': 'No transaction IDs or filter provided'}), 400
+    
+    if transaction_ids is not None and not transaction_ids:
+        return jsonify({'error': 'Empty transaction IDs list'}), 400
+    if transaction_ids is None:
+        try:
+            validate_conversion_filter(filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+        
+        cursor = conn.cursor()
+        
+        if transaction_ids:
+            sale_ids = list(dict.fromkeys(transaction_ids))
+        else:
+            sale_ids = conversion_candidates(cursor, filters)
+            conn.commit()
+        
+        converted_count = 0
+        now = datetime.now()
+        for chunk in chunked(sale_ids, CONVERT_BATCH_SIZE):
+            converted_count += convert_sales_chunk(cursor, chunk, now)
+            conn.commit()
+        
+        cursor.close()
+        
+        if not converted_count:
+            return jsonify({'error': 'No valid cash transactions found with the provided IDs'}), 404
+        
+        return jsonify({
+            'success': True,
+            'message': f'Successfully converted {converted_count} transactions',
+            'convertedCount': converted_count
+        })
+    
+    except Exception as e:
+        # Rollback in case of error
+        if conn and conn.is_connected():
+            conn.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# Columns /api/cash-sales can return; the JSON provider writes dates and times as ISO 8601
+CASH_SALE_FIELDS = {
+    'id': 's.id',
+    'date': 's.date',
+    'product_id': 's.product_id',
+    'product_name': 'p.name',
+    'hsn_code': 'p.hsn_code',
+    'unit': 'p.unit',
+    'qty': 's.qty',
+    'invoice_no': 's.invoice_no',
+    'customer': 's.customer',
+    'incl_gst': 's.incl_gst',
+    'ex_gst': 's.ex_gst',
+    'taxable_value': 's.taxable_value',
+    'igst': 's.igst',
+    'cgst': 's.cgst',
+    'sgst': 's.sgst',
+    'invoice_value': 's.invoice_value',
+    'payment_method': 's.payment_method',
+    'created_at': 's.created_at',
+}
+
+def encode_page_cursor(date, row_id):
+    """Build the opaque keyset cursor for the page after the row (date, id)."""
+    return base64.urlsafe_b64encode(f"{date}|{row_id}".encode()).decode()
+
+def decode_page_cursor(token):
+    """Return the (date, id) keyset position of a cursor. Raises ValueError if it is malformed."""
+    try:
+        date, row_id = base64.urlsafe_b64decode(token.encode()).decode().split('|', 1)
+        datetime.strptime(date, '%Y-%m-%d')
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    return date, row_id
+
+def cash_sales_query(fields, after=None, limit=None, keyset=True):
+    """
+    Build the keyset-paginated cash sales query, newest first. The (date, id)
+    ordering is served by idx_sales_cash_keyset: both filter columns are matched
+    by equality (converted_to_consumption is NOT NULL since migration 0005), so
+    rows come off one index range already in order and LIMIT stops the read.
+    With `keyset` the id and date are selected even if not in `fields`, so the
+    next cursor can be built.
+    """
+    columns = dict.fromkeys(['id', 'date', *fields] if keyset else fields)
+    select = ', '.join(f"{CASH_SALE_FIELDS[name]} AS {name}" for name in columns)
+    
+    sql = f"""
+        SELECT {select}
+        FROM sales s
+        JOIN products p ON s.product_id = p.id
+        WHERE s.payment_method = 'cash' AND s.converted_to_consumption = 0
+    """
+    params = []
+    if after:
+        sql += " AND (s.date < %s OR (s.date = %s AND s.id < %s))"
+        params.extend([after[0], after[0], after[1]])
+    sql += " ORDER BY s.date DESC, s.id DESC"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+def cash_sales_ndjson(conn, sql, params):
+    """Stream query rows as newline-delimited JSON and release the connection when done."""
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute(sql, params)
+            chunks = iter(lambda: cursor.fetchmany(CASH_SALES_STREAM_CHUNK), [])
+            rows = (row for chunk in chunks for row in chunk)
+            yield from app.json.stream(rows, ndjson=True, chunk_size=CASH_SALES_STREAM_CHUNK)
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+@app.route('/api/cash-sales', methods=['GET'])
+def get_cash_sales():
+    """
+    Get cash sales transactions that haven't been converted to consumption, newest first.
+    
+    Pages are keyset-paginated on (date, id): pass the returned `next_cursor` as
+    `cursor` to fetch the next page. `fields` selects columns and `format=ndjson`
+    streams the rows as newline-delimited JSON instead.
+    """
+    fields = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    fields = fields or list(CASH_SALE_FIELDS)
+    unknown = [name for name in fields if name not in CASH_SALE_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    
+    ndjson = request.args.get('format') == 'ndjson'
+    try:
+        limit = request.args.get('limit', type=int)
+        after = decode_page_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if limit is None and not ndjson:
+        limit = CASH_SALES_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, CASH_SALES_MAX_PAGE_SIZE))
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+        
+        if ndjson:
+            sql, params = cash_sales_query(fields, after, limit, keyset=False)
+            stream = cash_sales_ndjson(conn, sql, params)
+            # The generator now owns the connection and releases it when the stream ends
+            conn = None
+            return Response(stream, mimetype='application/x-ndjson')
+        
+        cursor = conn.cursor(dictionary=True)
+        
+        # Fetch one extra row to know whether another page follows
+        sql, params = cash_sales_query(fields, after, limit + 1)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1]['date'], rows[-1]['id']) if has_more else None
+        
+        # Rows go out as fetched unless keyset columns were added that the caller did not ask for
+        if not {'id', 'date'}.issubset(fields):
+            rows = [{name: row[name] for name in fields} for row in rows]
+        
+        return jsonify({
+            'success': True,
+            'cash_sales': rows,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+def parse_stock_workbook(file):
+    """
+    Parse a STOCK DETAILS workbook into labelled section frames plus the
+    unique product list. Raises ValueError if a required section is missing.
+    """
+    # Read the Excel file, specifying header rows
+    # For a multi-header Excel, we'll read with header=None first and then process
+    with STAGE_SECONDS.time('parse_excel', 'read'):
+        df = pd.read_excel(file, sheet_name="STOCK DETAILS", header=None)
+    
+    # Find the title row, column header row and data rows of every section in one pass
+    with STAGE_SECONDS.time('parse_excel', 'index'):
+        spans = index_sections(df)
+    
+    if not all(section in spans for section in ('PURCHASE', 'SALES', 'CONSUMPTION')):
+        raise ValueError('Invalid Excel format: Missing required sections')
+    
+    # Each section is labelled from its own header row, falling back to the
+    # standard STOCK DETAILS layout for blank header cells
+    with STAGE_SECONDS.time('parse_excel', 'headers'):
+        purchase_data = section_frame(df, spans['PURCHASE'])
+        sales_data = section_frame(df, spans['SALES'])
+        consumption_data = section_frame(df, spans['CONSUMPTION'])
+        balance_data = section_frame(df, spans['BALANCE']) if 'BALANCE' in spans else None
+    
+    # Extract unique products from all sections
+    with STAGE_SECONDS.time('parse_excel', 'products'):
+        products = pd.concat(
+            [
+                pd.DataFrame({
+                    'product_name': section_column(data, 'Product Name'),
+                    'hsn_code': section_column(data, 'HSN Code'),
+                    'units': section_column(data, 'UNITS'),
+                })
+                for data in (purchase_data, sales_data, consumption_data)
+            ],
+            ignore_index=True
+        )
+        products = products.where(pd.notna(products), '').astype(str).drop_duplicates()
+    
+    return {
+        'purchases': purchase_data,
+        'sales': sales_data,
+        'consumption': consumption_data,
+        'balance': balance_data,
+        'products': products,
+    }
+
+PARSE_SECTIONS = ('purchases', 'sales', 'consumption', 'balance', 'products')
+
+def parse_excel_response(parsed, media_type, section=None):
+    """
+    Encode the parsed sections (or just `section`) as `media_type`: JSON records,
+    column-oriented JSON or MessagePack, or an Arrow IPC stream of one section.
+    Columnar forms are built column by column, without a dict per row.
+    """
+    names = [section] if section else PARSE_SECTIONS
+    frames = {name: parsed[name] for name in names if parsed[name] is not None}
+    
+    if media_type == ARROW:
+        return Response(arrow_body(frames[section]), mimetype=ARROW)
+    
+    if media_type in (COLUMNAR_JSON, MSGPACK):
+        payload = {name: frame_columns(frame) for name, frame in frames.items()}
+        if media_type == MSGPACK:
+            return Response(msgpack_body(payload), mimetype=MSGPACK)
+        response = jsonify(payload)
+        response.mimetype = COLUMNAR_JSON
+        return response
+    
+    # The JSON provider encodes each frame as a list of row objects
+    return jsonify(frames)
+
+@app.route('/api/inventory/parse-excel', methods=['POST'])
+def parse_inventory_excel():
+    """
+    Parse the STOCK DETAILS Excel file and organize data according to requirements.
+    The Accept header (or `format`) selects JSON records or a columnar format;
+    `section` limits the response to one section.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+        
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+        
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        return jsonify({'error': 'File must be an Excel file (.xlsx or .xls)'}), 400
+    
+    section = request.args.get('section')
+    if section is not None and section not in PARSE_SECTIONS:
+        return jsonify({'error': f"section must be one of: {', '.join(PARSE_SECTIONS)}"}), 400
+    
+    try:
+        media_type = negotiate(request.accept_mimetypes, request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if media_type is None:
+        return jsonify({'error': 'The requested format is not available on this server'}), 406
+    if media_type == ARROW and section is None:
+        return jsonify({'error': 'Arrow responses hold a single section; pass section'}), 400
+    
+    try:
+        # Re-uploads of the same workbook are served from the parse cache
+        content = file.read()
+        cache_key = ParseCache.make_key(content, PARSER_VERSION)
+        parsed = parse_cache.get(cache_key)
+        cache_status = 'hit' if parsed is not None else 'miss'
+        
+        if parsed is None:
+            try:
+                parsed = parse_stock_workbook(io.BytesIO(content))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            parse_cache.put(cache_key, parsed)
+        
+        if section == 'balance' and parsed['balance'] is None:
+            return jsonify({'error': 'The workbook has no BALANCE STOCK section'}), 404
+        
+        with STAGE_SECONDS.time('parse_excel', 'encode'):
+            response = parse_excel_response(parsed, media_type, section)
+        response.headers['X-Parse-Cache'] = cache_status
+        response.vary.add('Accept')
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/inventory/parse-cache/stats', methods=['GET'])
+def get_parse_cache_stats():
+    """Expose parse cache hit/miss counters and memory usage."""
+    return jsonify({
+        'success': True,
+        'cache': parse_cache.stats()
+    })
+
+# JSON field feeding each column of SECTION_HEADERS, and the value used when it is missing
+EXPORT_FIELDS = {
+    'PURCHASE': [
+        ('date', ''), ('product_name', ''), ('hsn_code', ''), ('units', ''), ('invoice_no', ''),
+        ('qty', 0), ('price_incl_gst', 0), ('price_ex_gst', 0), ('discount_percentage', 0),
+        ('purchase_cost_per_unit_ex_gst', 0), ('gst_percentage', 0), ('taxable_value', 0),
+        ('igst', 0), ('cgst', 0), ('sgst', 0), ('invoice_value', 0)
+    ],
+    'SALES': [
+        ('date', ''), ('product_name', ''), ('hsn_code', ''), ('units', ''), ('invoice_no', ''),
+        ('qty', 0), ('purchase_cost_per_unit_ex_gst', 0), ('purchase_gst_percentage', 0),
+        ('purchase_taxable_value', 0), ('purchase_igst', 0), ('purchase_cgst', 0),
+        ('purchase_sgst', 0), ('total_purchase_cost', 0), ('mrp_incl_gst', 0), ('mrp_ex_gst', 0),
+        ('discount_percentage', 0), ('discounted_sales_rate_ex_gst', 0), ('sales_gst_percentage', 0),
+        ('sales_taxable_value', 0), ('sales_igst', 0), ('sales_cgst', 0), ('sales_sgst', 0),
+        ('invoice_value', 0)
+    ],
+    'CONSUMPTION': [
+        ('date', ''), ('product_name', ''), ('hsn_code', ''), ('units', ''),
+        ('requisition_voucher_no', ''), ('qty', 0), ('purchase_cost_per_unit_ex_gst', 0),
+        ('purchase_gst_percentage', 0), ('taxable_value', 0), ('igst', 0), ('cgst', 0),
+        ('sgst', 0), ('total_purchase_cost', 0)
+    ],
+    'BALANCE': [
+        ('product_name', ''), ('hsn_code', ''), ('units', ''), ('qty', 0), ('taxable_value', 0),
+        ('igst', 0), ('cgst', 0), ('sgst', 0), ('invoice_value', 0)
+    ],
+}
+
+# Request body key holding each section's rows
+EXPORT_SOURCES = {
+    'PURCHASE': 'purchases',
+    'SALES': 'sales',
+    'CONSUMPTION': 'consumption',
+    'BALANCE': 'balance_stock',
+}
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def export_rows(frame, section):
+    """Yield the STOCK DETAILS rows of a section from a DataFrame's column arrays."""
+    columns = []
+    for field, default in EXPORT_FIELDS[section]:
+        if field in frame.columns:
+            column = frame[field]
+            columns.append(column.astype(object).where(column.notna(), None).tolist())
+        else:
+            columns.append([default] * len(frame))
+    return zip(*columns)
+
+def records_export_rows(records, section, chunk_size=None):
+    """Yield export rows for a list of JSON records, converting at most chunk_size records at a time."""
+    chunk_size = chunk_size or EXPORT_CHUNK_ROWS
+    for chunk in chunked(records, chunk_size):
+        yield from export_rows(pd.DataFrame(chunk), section)
+
+def write_stock_details(path, section_rows):
+    """
+    Write a STOCK DETAILS workbook with a write-only (constant memory) openpyxl
+    workbook. `section_rows(section)` returns an iterable of rows for a section.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('STOCK DETAILS')
+    
+    # Add title row
+    sheet.append(['STOCK DETAILS'])
+    sheet.append([])  # Empty row
+    
+    for position, section in enumerate(SECTION_TITLES):
+        if position:
+            sheet.append([])  # Empty row between sections
+        sheet.append([SECTION_TITLES[section]])
+        sheet.append(SECTION_HEADERS[section])
+        for row in section_rows(section):
+            sheet.append(row)
+    
+    workbook.save(path)
+
+def stream_file(path, download_name, mimetype, chunk_size=64 * 1024):
+    """Stream a file to the client in chunks and delete it once the response is done."""
+    def generate():
+        try:
+            with open(path, 'rb') as handle:
+                while True:
+                    chunk = handle.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(path)
+    
+    return Response(
+        generate(),
+        mimetype=mimetype,
+        direct_passthrough=True,
+        headers={
+            'Content-Disposition': f'attachment; filename={download_name}',
+            'Content-Length': str(os.path.getsize(path)),
+        }
+    )
+
+def export_workbook_response(section_rows, download_name='STOCK_DETAILS_export.xlsx'):
+    """Build a STOCK DETAILS workbook in a temp file and stream it back, cleaning up on every path."""
+    fd, temp_filename = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        with STAGE_SECONDS.time('export', 'workbook'):
+            write_stock_details(temp_filename, section_rows)
+        return stream_file(temp_filename, download_name, XLSX_MIMETYPE)
+    except Exception:
+        os.remove(temp_filename)
+        raise
+
+@app.route('/api/inventory/export-excel', methods=['POST'])
+def export_inventory_excel():
+    """Generate an Excel file with inventory data in the same format as the original STOCK DETAILS file."""
+    try:
+        # Get data from request
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+            
+        # Check if required keys exist
+        required_keys = ['products', 'purchases', 'sales', 'consumption', 'balance_stock']
+        for key in required_keys:
+            if key not in data:
+                return jsonify({'error': f'Missing data section: {key}'}), 400
+        
+        return export_workbook_response(
+            lambda section: records_export_rows(data[EXPORT_SOURCES[section]], section)
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# SQL expression for each EXPORT_FIELDS entry when exporting straight from the database;
+# fields without a column in their table (purchase discount and GST rate, consumption cost)
+# are written with their default
+EXPORT_COLUMNS = {
+    'PURCHASE': {
+        'date': 't.date', 'product_name': 'p.name', 'hsn_code': 'p.hsn_code', 'units': 'p.unit',
+        'invoice_no': 't.invoice_no', 'qty': 't.qty', 'price_incl_gst': 't.incl_gst',
+        'price_ex_gst': 't.ex_gst', 'taxable_value': 't.taxable_value', 'igst': 't.igst',
+        'cgst': 't.cgst', 'sgst': 't.sgst', 'invoice_value': 't.invoice_value',
+    },
+    'SALES': {
+        'date': 't.date', 'product_name': 'p.name', 'hsn_code': 'p.hsn_code', 'units': 'p.unit',
+        'invoice_no': 't.invoice_no', 'qty': 't.qty', 'mrp_incl_gst': 't.incl_gst',
+        'mrp_ex_gst': 't.ex_gst', 'sales_taxable_value': 't.taxable_value', 'sales_igst': 't.igst',
+        'sales_cgst': 't.cgst', 'sales_sgst': 't.sgst', 'invoice_value': 't.invoice_value',
+        'purchase_cost_per_unit_ex_gst': 't.purchase_cost_per_unit_ex_gst',
+        'purchase_gst_percentage': 't.purchase_gst_percentage',
+        'purchase_taxable_value': 't.purchase_taxable_value', 'purchase_igst': 't.purchase_igst',
+        'purchase_cgst': 't.purchase_cgst', 'purchase_sgst': 't.purchase_sgst',
+        'total_purchase_cost': 't.total_purchase_cost', 'discount_percentage': 't.discount_percentage',
+        'discounted_sales_rate_ex_gst': 't.discounted_sales_rate_ex_gst',
+        'sales_gst_percentage': 't.sales_gst_percentage',
+    },
+    'CONSUMPTION': {
+        'date': 't.date', 'product_name': 'p.name', 'hsn_code': 'p.hsn_code', 'units': 'p.unit',
+        'requisition_voucher_no': 't.purpose', 'qty': 't.qty',
+    },
+    'BALANCE': {
+        'product_name': 'p.name', 'hsn_code': 'p.hsn_code', 'units': 'p.unit', 'qty': 't.qty',
+        'taxable_value': 't.taxable_value', 'igst': 't.igst', 'cgst': 't.cgst', 'sgst': 't.sgst',
+        'invoice_value': 't.invoice_value',
+    },
+}
+
+EXPORT_TABLES = {
+    'PURCHASE': 'purchases',
+    'SALES': 'sales',
+    'CONSUMPTION': 'consumption',
+    'BALANCE': 'balance_stock',
+}
+
+def export_filters(args):
+    """Parse the date range and product filters of a database export request."""
+    filters = {'product_ids': args.getlist('product_id'), 'hsn_codes': args.getlist('hsn_code')}
+    for name in ('from', 'to'):
+        value = args.get(name)
+        filters[name] = datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    return filters
+
+def export_query(section, filters):
+    """Build the SELECT that reads one STOCK DETAILS section from its table."""
+    columns = EXPORT_COLUMNS[section]
+    select = ', '.join(
+        columns.get(field) or ("''" if default == '' else str(default))
+        for field, default in EXPORT_FIELDS[section]
+    )
+    
+    conditions = []
+    params = []
+    if section != 'BALANCE':
+        # Balance stock is a current snapshot, so the date range does not apply to it
+        if filters['from']:
+            conditions.append('t.date >= %s')
+            params.append(filters['from'])
+        if filters['to']:
+            conditions.append('t.date <= %s')
+            params.append(filters['to'])
+    if section == 'SALES':
+        # Converted cash sales are exported as consumption
+        conditions.append('t.converted_to_consumption = 0')
+    if filters['product_ids']:
+        conditions.append(f"t.product_id IN ({', '.join(['%s'] * len(filters['product_ids']))})")
+        params.extend(filters['product_ids'])
+    if filters['hsn_codes']:
+        conditions.append(f"p.hsn_code IN ({', '.join(['%s'] * len(filters['hsn_codes']))})")
+        params.extend(filters['hsn_codes'])
+    
+    sql = f"SELECT {select} FROM {EXPORT_TABLES[section]} t JOIN products p ON t.product_id = p.id"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY p.name, t.product_id' if section == 'BALANCE' else ' ORDER BY t.date, t.id'
+    return sql, params
+
+def db_export_rows(conn, section, filters, chunk_size=None):
+    """Yield export rows for a section from an unbuffered (server-side) cursor."""
+    chunk_size = chunk_size or EXPORT_CHUNK_ROWS
+    sql, params = export_query(section, filters)
+    
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+@app.route('/api/inventory/export-excel', methods=['GET'])
+def export_inventory_excel_from_db():
     """
-    Convert selected cash sales transactions to salon consumption.
+    Generate a STOCK DETAILS workbook straight from the database for an optional
+    date range (`from`, `to`) and product filters (`product_id`, `hsn_code`).
     """
-    data = request.json
-    if not data or 'transactionIds' not in data:
-        return jsonify({'error': 'No transaction IDs provided'}), 400
-    
-    transaction_ids = data['transactionIds']
-    if not transaction_ids:
-        return jsonify({'error': 'Empty transaction IDs list'}), 400
+    try:
+        filters = export_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
     
+    conn = None
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
         
-        cursor = conn.cursor(dictionary=True)
-        
-        # Fetch the sales transactions
-        placeholders = ', '.join(['%s'] * len(transaction_ids))
-        cursor.execute(
-            f"""
-            SELECT s.*, p.name as product_name, p.hsn_code, p.unit 
-            FROM sales s
-            JOIN products p ON s.product_id = p.id
-            WHERE s.id IN ({placeholders}) AND s.payment_method = 'cash'
-            """,
-            transaction_ids
-        )
-        
-        sales_to_convert = cursor.fetchall()
+        return export_workbook_response(lambda section: db_export_rows(conn, section, filters))
         
-        if not sales_to_convert:
-            return jsonify({'error': 'No valid cash transactions found with the provided IDs'}), 404
-        
-        # Begin transaction
-        conn.start_transaction()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+def ledger_product_filter(args, alias='l'):
+    """SQL condition and params for the repeatable `product_id` filter of the stock endpoints."""
+    product_ids = args.getlist('product_id')
+    if not product_ids:
+        return '', []
+    return f" AND {alias}.product_id IN ({', '.join(['%s'] * len(product_ids))})", product_ids
+
+def ledger_closing_query(day, product_filter='', params=(), inclusive=True):
+    """Return (sql, params) selecting each product's last ledger row on (or, if not `inclusive`, before) `day`."""
+    operator = '<=' if inclusive else '<'
+    sql = f"""
+        SELECT l.product_id, l.date, l.closing_qty
+        FROM stock_ledger l
+        JOIN (
+            SELECT l.product_id, MAX(l.date) AS date
+            FROM stock_ledger l
+            WHERE l.date {operator} %s{product_filter}
+            GROUP BY l.product_id
+        ) latest ON l.product_id = latest.product_id AND l.date = latest.date
+        """
+    return sql, [day, *params]
+
+def ledger_closing(cursor, day, product_filter, params, inclusive=True):
+    """Return product_id -> (ledger day, closing qty) as of `day`; see ledger_closing_query."""
+    cursor.execute(*ledger_closing_query(day, product_filter, params, inclusive))
+    return {product_id: (last_date, qty) for product_id, last_date, qty in cursor.fetchall()}
+
+def product_details(cursor, product_ids):
+    """Return product_id -> (name, hsn_code, unit) for the given ids."""
+    rows = fetch_by_ids(cursor, "SELECT id, name, hsn_code, unit FROM products WHERE id IN ({ids})", product_ids)
+    return {row[0]: row[1:] for row in rows}
+
+def parse_day(value, name):
+    """Parse a required YYYY-MM-DD query parameter. Raises ValueError with a client-facing message."""
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+@app.route('/api/stock/as-of', methods=['GET'])
+def get_stock_as_of():
+    """
+    Stock on hand per product at the end of `date`, read from the stock ledger
+    (optionally filtered by repeatable `product_id`).
+    """
+    try:
+        day = parse_day(request.args.get('date'), 'date')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
         
-        converted_count = 0
-        for sale in sales_to_convert:
-            # Insert into consumption table
-            consumption_id = str(uuid.uuid4())
-            cursor.execute(
-                """
-                INSERT INTO consumption (
-                    id, product_id, date, qty, purpose, transaction_type, 
-                    original_sale_id, created_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    consumption_id,
-                    sale['product_id'],
-                    sale['date'],
-                    sale['qty'],
-                    'Converted from cash sale',
-                    'consumption',
-                    sale['id'],
-                    datetime.now()
-                )
-            )
-            
-            # Mark the original sale as converted
-            cursor.execute(
-                """
-                UPDATE sales
-                SET converted_to_consumption = 1, 
-                    converted_at = %s,
-                    consumption_id = %s
-                WHERE id = %s
-                """,
-                (datetime.now(), consumption_id, sale['id'])
-            )
-            
-            converted_count += 1
+        cursor = conn.cursor()
+        product_filter, params = ledger_product_filter(request.args)
+        closing = ledger_closing(cursor, day, product_filter, params)
+        details = product_details(cursor, closing)
+        cursor.close()
         
-        # Commit the transaction
-        conn.commit()
-        conn.close()
+        stock = []
+        for product_id, (last_date, qty) in closing.items():
+            name, hsn_code, unit = details.get(product_id, ('', '', ''))
+            stock.append({
+                'product_id': product_id,
+                'product_name': name,
+                'hsn_code': hsn_code,
+                'unit': unit,
+                'qty': float(qty),
+                'last_movement': last_date.strftime('%Y-%m-%d')
+            })
         
         return jsonify({
             'success': True,
-            'message': f'Successfully converted {converted_count} transactions',
-            'convertedCount': converted_count
+            'date': day.strftime('%Y-%m-%d'),
+            'stock': stock
         })
-    
+        
     except Exception as e:
-        # Rollback in case of error
-        if conn and conn.is_connected():
-            conn.rollback()
-            conn.close()
         return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
 
-@app.route('/api/cash-sales', methods=['GET'])
-def get_cash_sales():
+@app.route('/api/stock/period', methods=['GET'])
+def get_stock_period():
     """
-    Get all cash sales transactions that haven't been converted to consumption.
+    Opening stock, movements (in, out, consumed with values) and closing stock per
+    product between `from` and `to` (inclusive), read as ranges of the stock ledger.
     """
+    try:
+        start = parse_day(request.args.get('from'), 'from')
+        end = parse_day(request.args.get('to'), 'to')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start > end:
+        return jsonify({'error': 'from must not be after to'}), 400
+    
+    conn = None
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Database connection failed'}), 500
         
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor()
+        product_filter, params = ledger_product_filter(request.args)
         
+        opening = ledger_closing(cursor, start, product_filter, params, inclusive=False)
+        closing = ledger_closing(cursor, end, product_filter, params)
         cursor.execute(
-            """
-            SELECT s.*, p.name as product_name, p.hsn_code, p.unit 
-            FROM sales s
-            JOIN products p ON s.product_id = p.id
-            WHERE s.payment_method = 'cash' AND (s.converted_to_consumption = 0 OR s.converted_to_consumption IS NULL)
-            ORDER BY s.date DESC
-            """
+            f"""
+            SELECT l.product_id, SUM(l.in_qty), SUM(l.out_qty), SUM(l.consumed_qty), SUM(l.in_value), SUM(l.out_value)
+            FROM stock_ledger l
+            WHERE l.date BETWEEN %s AND %s{product_filter}
+            GROUP BY l.product_id
+            """,
+            [start, end, *params]
         )
+        movements = {row[0]: [float(value or 0) for value in row[1:]] for row in cursor.fetchall()}
+        details = product_details(cursor, closing)
+        cursor.close()
         
-        cash_sales = cursor.fetchall()
-        conn.close()
-        
-        # Convert datetime objects to strings for JSON serialization
-        for sale in cash_sales:
-            if isinstance(sale['date'], datetime):
-                sale['date'] = sale['date'].strftime('%Y-%m-%d')
-            if isinstance(sale['created_at'], datetime):
-                sale['created_at'] = sale['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        report = []
+        for product_id in closing:
+            name, hsn_code, unit = details.get(product_id, ('', '', ''))
+            in_qty, out_qty, consumed_qty, in_value, out_value = movements.get(product_id, [0.0] * 5)
+            report.append({
+                'product_id': product_id,
+                'product_name': name,
+                'hsn_code': hsn_code,
+                'unit': unit,
+                'opening_qty': float(opening[product_id][1]) if product_id in opening else 0.0,
+                'in_qty': in_qty,
+                'out_qty': out_qty,
+                'consumed_qty': consumed_qty,
+                'in_value': in_value,
+                'out_value': out_value,
+                'closing_qty': float(closing[product_id][1])
+            })
         
         return jsonify({
             'success': True,
-            'cash_sales': cash_sales
+            'from': start.strftime('%Y-%m-%d'),
+            'to': end.strftime('%Y-%m-%d'),
+            'products': report
         })
-    
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
 
-@app.route('/api/inventory/parse-excel', methods=['POST'])
-def parse_inventory_excel():
-    """Parse the STOCK DETAILS Excel file and organize data according to requirements."""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-        
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-        
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        return jsonify({'error': 'File must be an Excel file (.xlsx or .xls)'}), 400
+# Quantity sources summed per product by the reconciliation, one grouped query each.
+# Converted cash sales are counted through their consumption rows only.
+RECONCILE_SOURCES = {
+    'purchased_qty': "SELECT product_id, SUM(qty) FROM purchases WHERE {products} GROUP BY product_id",
+    'sold_qty': (
+        "SELECT product_id, SUM(qty) FROM sales WHERE {products} "
+        "AND converted_to_consumption = 0 GROUP BY product_id"
+    ),
+    'consumed_qty': "SELECT product_id, SUM(qty) FROM consumption WHERE {products} GROUP BY product_id",
+    'stored_qty': "SELECT product_id, SUM(qty) FROM balance_stock WHERE {products} GROUP BY product_id",
+}
+
+RECONCILE_COLUMNS = (
+    'product_id', 'product_name', 'hsn_code', 'unit',
+    'purchased_qty', 'sold_qty', 'consumed_qty', 'expected_qty',
+    'stored_qty', 'stored_diff', 'sheet_qty', 'sheet_diff'
+)
+
+def reconcile_product_chunks(cursor, product_ids=None, chunk_size=None):
+    """
+    Yield (products, condition, params) per chunk of products: a frame of product
+    details and the SQL condition selecting the chunk's rows in the other tables.
+    All products are walked in id order with keyset pagination and matched by id
+    range; explicit `product_ids` are matched with IN lists.
+    """
+    chunk_size = chunk_size or RECONCILE_CHUNK
+    columns = ['product_id', 'product_name', 'hsn_code', 'unit']
+    
+    if product_ids:
+        for chunk in chunked(sorted(set(product_ids)), chunk_size):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"SELECT id, name, hsn_code, unit FROM products WHERE id IN ({placeholders})", chunk)
+            rows = cursor.fetchall()
+            if rows:
+                yield pd.DataFrame(rows, columns=columns), f"product_id IN ({placeholders})", chunk
+        return
+    
+    last_id = ''
+    while True:
+        cursor.execute(
+            "SELECT id, name, hsn_code, unit FROM products WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, chunk_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield pd.DataFrame(rows, columns=columns), "product_id BETWEEN %s AND %s", [rows[0][0], last_id]
+        if len(rows) < chunk_size:
+            return
+
+def reconcile_chunk(cursor, products, condition, params, sheet_qty=None):
+    """
+    Compare one chunk of products: expected closing stock (purchased - sold -
+    consumed) against the stored balance and, when given, the uploaded sheet's
+    balance (a product_id -> qty Series). Returns the full comparison frame.
+    """
+    frame = products.set_index('product_id')
+    for column, sql in RECONCILE_SOURCES.items():
+        cursor.execute(sql.format(products=condition), params)
+        sums = dict(cursor.fetchall())
+        frame[column] = pd.to_numeric(frame.index.to_series().map(sums), errors='coerce')
+    
+    movements = frame[['purchased_qty', 'sold_qty', 'consumed_qty']].fillna(0.0)
+    frame[list(movements.columns)] = movements
+    frame['expected_qty'] = (movements['purchased_qty'] - movements['sold_qty'] - movements['consumed_qty']).round(2)
+    frame['stored_diff'] = (frame['stored_qty'].fillna(0.0) - frame['expected_qty']).round(2)
+    
+    if sheet_qty is not None:
+        frame['sheet_qty'] = sheet_qty.reindex(frame.index)
+        frame['sheet_diff'] = (frame['sheet_qty'] - frame['expected_qty']).round(2)
+    else:
+        frame['sheet_qty'] = np.nan
+        frame['sheet_diff'] = np.nan
+    return frame.reset_index()
+
+def reconcile_mismatches(frame, tolerance=None):
+    """Return the rows of a reconcile_chunk() frame whose stored or sheet balance differs from the expected one."""
+    tolerance = RECONCILE_TOLERANCE if tolerance is None else tolerance
+    mismatched = (frame['stored_diff'].abs() > tolerance) | (frame['sheet_diff'].abs() > tolerance)
+    return frame[mismatched.to_numpy()]
+
+def sheet_balance_qty(cursor, file):
+    """
+    Read the BALANCE STOCK section of an uploaded workbook and return
+    (product_id -> qty Series, names of sheet products not in the database).
+    """
+    df = pd.read_excel(file, sheet_name="STOCK DETAILS", header=None)
+    balance = process_balance_section(df)
+    if balance.empty:
+        return pd.Series(dtype=float), []
     
+    names = balance['product_name'].astype(str)
+    keys = list(zip(names.str.rstrip().str.lower(), balance['hsn_code'].astype(str).str.rstrip().str.lower()))
+    product_ids = resolve_product_ids(cursor, zip(names, balance['hsn_code']))
+    ids = pd.Series([product_ids.get(key) for key in keys], index=balance.index, dtype=object)
+    
+    unknown = names[ids.isna()].drop_duplicates().tolist()
+    known = ids.notna()
+    qty = pd.to_numeric(balance['qty'][known], errors='coerce').fillna(0.0)
+    return qty.groupby(ids[known].to_numpy()).sum(), unknown
+
+def reconcile_stock(cursor, product_ids=None, sheet_qty=None, chunk_size=None):
+    """Yield reconcile_chunk() frames for every chunk of products (see reconcile_product_chunks)."""
+    for products, condition, params in reconcile_product_chunks(cursor, product_ids, chunk_size):
+        yield reconcile_chunk(cursor, products, condition, params, sheet_qty)
+
+def reconcile_records(frame):
+    """Turn reconciliation rows into JSON-ready dicts (missing values become None)."""
+    frame = frame[list(RECONCILE_COLUMNS)]
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient='records')
+
+@app.route('/api/inventory/reconcile', methods=['GET', 'POST'])
+def reconcile_inventory():
+    """
+    Recompute every product's expected closing stock from purchases, sales and
+    consumption and report where balance_stock (and, if a workbook is uploaded
+    as `file`, its BALANCE STOCK section) disagrees.
+    """
     try:
-        # Read the Excel file, specifying header rows
-        # For a multi-header Excel, we'll read with header=None first and then process
-        df = pd.read_excel(file, sheet_name="STOCK DETAILS", header=None)
-        
-        # Determine the structure of the file
-        # Find header rows that contain our key section titles
-        purchase_header_row = None
-        sales_header_row = None
-        consumption_header_row = None
-        balance_header_row = None
-        
-        for idx, row in enumerate(df.values):
-            row_str = ' '.join(str(cell) for cell in row if pd.notna(cell))
-            if 'PURCHASE - STOCK IN' in row_str:
-                purchase_header_row = idx
-            elif 'SALES TO CUSTOMER - STOCK OUT' in row_str:
-                sales_header_row = idx
-            elif 'SALON CONSUMPTION - STOCK OUT' in row_str:
-                consumption_header_row = idx
-            elif 'BALANCE STOCK' in row_str:
-                balance_header_row = idx
-        
-        if purchase_header_row is None or sales_header_row is None or consumption_header_row is None:
-            return jsonify({'error': 'Invalid Excel format: Missing required sections'}), 400
-        
-        # Extract data from each section
-        # For each section, we need to:
-        # 1. Find the actual column headers (typically one row after the section title)
-        # 2. Map the unnamed columns to proper names
-        # 3. Extract the data rows until the next section
-        
-        # Process Purchase section
-        purchase_cols_row = purchase_header_row + 1
-        purchase_data_start = purchase_header_row + 2
-        purchase_data_end = sales_header_row - 1 if sales_header_row else len(df)
-        
-        purchase_headers = df.iloc[purchase_cols_row].to_list()
-        purchase_headers = [str(col) if pd.notna(col) else f"Unnamed_{i}" for i, col in enumerate(purchase_headers)]
-        
-        # Map unnamed columns to meaningful names for purchases
-        purchase_col_mapping = {
-            'Unnamed_0': 'Date',
-            'Unnamed_1': 'Product Name',
-            'Unnamed_2': 'HSN Code',
-            'Unnamed_3': 'UNITS',
-            'Unnamed_4': 'Invoice No.',
-            'Unnamed_5': 'Qty.',
-            'Unnamed_6': 'Price Incl. GST',
-            'Unnamed_7': 'Price Ex. GST',
-            'Unnamed_8': 'Discount %',
-            'Unnamed_9': 'Purchase Cost Per Unit Ex. GST',
-            'Unnamed_10': 'GST %',
-            'Unnamed_11': 'Taxable Value',
-            'Unnamed_12': 'IGST',
-            'Unnamed_13': 'CGST',
-            'Unnamed_14': 'SGST',
-            'Unnamed_15': 'Invoice Value'
-        }
-        
-        # Apply the column mapping
-        mapped_purchase_headers = [purchase_col_mapping.get(col, col) for col in purchase_headers]
-        
-        # Extract purchase data
-        purchase_data = df.iloc[purchase_data_start:purchase_data_end].copy()
-        purchase_data.columns = purchase_headers
-        # Rename columns using the mapping
-        purchase_data = purchase_data.rename(columns=purchase_col_mapping)
-        
-        # Process Sales section
-        sales_cols_row = sales_header_row + 1
-        sales_data_start = sales_header_row + 2
-        sales_data_end = consumption_header_row - 1 if consumption_header_row else len(df)
-        
-        sales_headers = df.iloc[sales_cols_row].to_list()
-        sales_headers = [str(col) if pd.notna(col) else f"Unnamed_{i}" for i, col in enumerate(sales_headers)]
-        
-        # Map unnamed columns to meaningful names for sales
-        sales_col_mapping = {
-            'Unnamed_0': 'Date',
-            'Unnamed_1': 'Product Name',
-            'Unnamed_2': 'HSN Code',
-            'Unnamed_3': 'UNITS',
-            'Unnamed_4': 'Invoice No.',
-            'Unnamed_5': 'Qty.',
-            'Unnamed_6': 'Purchase Cost Per Unit Ex. GST',
-            'Unnamed_7': 'Purchase GST %',
-            'Unnamed_8': 'Purchase Taxable Value',
-            'Unnamed_9': 'Purchase IGST',
-            'Unnamed_10': 'Purchase CGST',
-            'Unnamed_11': 'Purchase SGST',
-            'Unnamed_12': 'Total Purchase Cost',
-            'Unnamed_13': 'MRP Incl. GST',
-            'Unnamed_14': 'MRP Ex. GST',
-            'Unnamed_15': 'Discount %',
-            'Unnamed_16': 'Discounted Sales Rate Ex. GST',
-            'Unnamed_17': 'Sales GST %',
-            'Unnamed_18': 'Sales Taxable Value',
-            'Unnamed_19': 'Sales IGST',
-            'Unnamed_20': 'Sales CGST',
-            'Unnamed_21': 'Sales SGST',
-            'Unnamed_22': 'Invoice Value'
-        }
-        
-        # Apply the column mapping
-        mapped_sales_headers = [sales_col_mapping.get(col, col) for col in sales_headers]
-        
-        # Extract sales data
-        sales_data = df.iloc[sales_data_start:sales_data_end].copy()
-        sales_data.columns = sales_headers
-        # Rename columns using the mapping
-        sales_data = sales_data.rename(columns=sales_col_mapping)
-        
-        # Process Consumption section
-        consumption_cols_row = consumption_header_row + 1
-        consumption_data_start = consumption_header_row + 2
-        consumption_data_end = balance_header_row - 1 if balance_header_row else len(df)
-        
-        consumption_headers = df.iloc[consumption_cols_row].to_list()
-        consumption_headers = [str(col) if pd.notna(col) else f"Unnamed_{i}" for i, col in enumerate(consumption_headers)]
-        
-        # Map unnamed columns to meaningful names for consumption
-        consumption_col_mapping = {
-            'Unnamed_0': 'Date',
-            'Unnamed_1': 'Product Name',
-            'Unnamed_2': 'HSN Code',
-            'Unnamed_3': 'UNITS',
-            'Unnamed_4': 'Requisition Voucher No.',
-            'Unnamed_5': 'Qty.',
-            'Unnamed_6': 'Purchase Cost Per Unit Ex. GST',
-            'Unnamed_7': 'Purchase GST %',
-            'Unnamed_8': 'Taxable Value',
-            'Unnamed_9': 'IGST',
-            'Unnamed_10': 'CGST',
-            'Unnamed_11': 'SGST',
-            'Unnamed_12': 'Total Purchase Cost',
-        }
-        
-        # Apply the column mapping
-        mapped_consumption_headers = [consumption_col_mapping.get(col, col) for col in consumption_headers]
-        
-        # Extract consumption data
-        consumption_data = df.iloc[consumption_data_start:consumption_data_end].copy()
-        consumption_data.columns = consumption_headers
-        # Rename columns using the mapping
-        consumption_data = consumption_data.rename(columns=consumption_col_mapping)
-        
-        # Process Balance Stock if available
-        balance_data = None
-        if balance_header_row is not None:
-            balance_cols_row = balance_header_row + 1
-            balance_data_start = balance_header_row + 2
-            
-            balance_headers = df.iloc[balance_cols_row].to_list()
-            balance_headers = [str(col) if pd.notna(col) else f"Unnamed_{i}" for i, col in enumerate(balance_headers)]
-            
-            # Map unnamed columns to meaningful names for balance
-            balance_col_mapping = {
-                'Unnamed_0': 'Product Name',
-                'Unnamed_1': 'HSN Code',
-                'Unnamed_2': 'UNITS',
-                'Unnamed_3': 'Qty.',
-                'Unnamed_4': 'Taxable Value',
-                'Unnamed_5': 'IGST',
-                'Unnamed_6': 'CGST',
-                'Unnamed_7': 'SGST',
-                'Unnamed_8': 'Invoice Value',
-            }
-            
-            # Extract balance data
-            balance_data = df.iloc[balance_data_start:].copy()
-            if not balance_data.empty:
-                balance_data.columns = balance_headers
-                # Rename columns using the mapping
-                balance_data = balance_data.rename(columns=balance_col_mapping)
-        
-        # Clean data by removing rows with no product name
-        purchase_data = purchase_data[purchase_data['Product Name'].notna()]
-        sales_data = sales_data[sales_data['Product Name'].notna()]
-        consumption_data = consumption_data[consumption_data['Product Name'].notna()]
-        if balance_data is not None:
-            balance_data = balance_data[balance_data['Product Name'].notna()]
-        
-        # Create a response dictionary with all data sections
-        response_data = {
-            'purchases': purchase_data.where(pd.notna(purchase_data), None).to_dict(orient='records'),
-            'sales': sales_data.where(pd.notna(sales_data), None).to_dict(orient='records'),
-            'consumption': consumption_data.where(pd.notna(consumption_data), None).to_dict(orient='records')
-        }
-        
-        if balance_data is not None:
-            response_data['balance'] = balance_data.where(pd.notna(balance_data), None).to_dict(orient='records')
-            
-        # Extract unique products from all sections
-        unique_products = set()
-        
-        # Add products from purchases
-        for row in purchase_data.itertuples():
-            if pd.notna(row._2):  # Product Name
-                product_key = (str(row._2), str(row._3) if pd.notna(row._3) else '', str(row._4) if pd.notna(row._4) else '')
-                unique_products.add(product_key)
-        
-        # Add products from sales
-        for row in sales_data.itertuples():
-            if pd.notna(row._2):  # Product Name
-                product_key = (str(row._2), str(row._3) if pd.notna(row._3) else '', str(row._4) if pd.notna(row._4) else '')
-                unique_products.add(product_key)
-        
-        # Add products from consumption
-        for row in consumption_data.itertuples():
-            if pd.notna(row._2):  # Product Name
-                product_key = (str(row._2), str(row._3) if pd.notna(row._3) else '', str(row._4) if pd.notna(row._4) else '')
-                unique_products.add(product_key)
-        
-        # Convert unique products to list of dictionaries
-        products_list = []
-        for product in unique_products:
-            products_list.append({
-                'product_name': product[0],
-                'hsn_code': product[1],
-                'units': product[2]
-            })
+        tolerance = float(request.values.get('tolerance', RECONCILE_TOLERANCE))
+    except ValueError:
+        return jsonify({'error': 'tolerance must be a number'}), 400
+    include_all = request.values.get('all', '').lower() in ('1', 'true', 'yes')
+    file = request.files.get('file')
+    if file is not None and not file.filename.endswith(('.xlsx', '.xls')):
+        return jsonify({'error': 'File must be an Excel spreadsheet'}), 400
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
         
-        response_data['products'] = products_list
+        cursor = conn.cursor()
+        sheet_qty, unknown = sheet_balance_qty(cursor, file) if file is not None else (None, [])
+        
+        checked = 0
+        discrepancies = 0
+        products = []
+        for frame in reconcile_stock(cursor, request.values.getlist('product_id'), sheet_qty):
+            mismatches = reconcile_mismatches(frame, tolerance)
+            checked += len(frame)
+            discrepancies += len(mismatches)
+            products.extend(reconcile_records(frame if include_all else mismatches))
+        cursor.close()
         
-        return jsonify(response_data), 200
+        return jsonify({
+            'success': True,
+            'summary': {
+                'products_checked': checked,
+                'discrepancies': discrepancies,
+                'sheet_products_not_found': unknown
+            },
+            'products': products
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
 
-@app.route('/api/inventory/export-excel', methods=['POST'])
-def export_inventory_excel():
-    """Generate an Excel file with inventory data in the same format as the original STOCK DETAILS file."""
+@app.cli.command('reconcile')
+@click.option('--product-id', 'product_ids', multiple=True, help='Only reconcile these products (repeatable).')
+@click.option('--sheet', type=click.Path(exists=True, dir_okay=False), help='Also compare with this workbook\'s BALANCE STOCK.')
+@click.option('--tolerance', type=float, default=RECONCILE_TOLERANCE, show_default=True)
+@click.option('--csv', 'csv_path', type=click.Path(dir_okay=False), help='Write the discrepancies to this CSV file.')
+def reconcile_command(product_ids, sheet, tolerance, csv_path):
+    """Report products whose stored (or sheet) balance differs from purchases - sales - consumption."""
+    conn = get_db_connection()
+    if not conn:
+        raise click.ClickException('Database connection failed')
+    
+    csv_file = None
     try:
-        # Get data from request
-        data = request.json
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-            
-        # Check if required keys exist
-        required_keys = ['products', 'purchases', 'sales', 'consumption', 'balance_stock']
-        for key in required_keys:
-            if key not in data:
-                return jsonify({'error': f'Missing data section: {key}'}), 400
-        
-        # Create a pandas ExcelWriter object
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
-            temp_filename = tmp.name
-            
-        writer = pd.ExcelWriter(temp_filename, engine='openpyxl')
-        
-        # Create the main sheet
-        sheet_name = 'STOCK DETAILS'
-        
-        # Convert data sections to DataFrames
-        products_df = pd.DataFrame(data['products'])
-        purchases_df = pd.DataFrame(data['purchases'])
-        sales_df = pd.DataFrame(data['sales'])
-        consumption_df = pd.DataFrame(data['consumption'])
-        balance_df = pd.DataFrame(data['balance_stock'])
-        
-        # Create a new DataFrame for the Excel structure
-        excel_data = []
-        
-        # Add title row
-        excel_data.append(['STOCK DETAILS'])
-        excel_data.append([])  # Empty row
-        
-        # Add purchase section
-        excel_data.append(['PURCHASE - STOCK IN'])
-        
-        # Add purchase header
-        purchase_header = [
-            'Date', 'Product Name', 'HSN Code', 'UNITS', 'Invoice No.', 'Qty.',
-            'Price Incl. GST', 'Price Ex. GST', 'Discount %', 'Purchase Cost Per Unit Ex. GST', 
-            'GST %', 'Taxable Value', 'IGST', 'CGST', 'SGST', 'Invoice Value'
-        ]
-        excel_data.append(purchase_header)
-        
-        # Add purchase data
-        for _, row in purchases_df.iterrows():
-            excel_data.append([
-                row.get('date', ''),
-                row.get('product_name', ''),
-                row.get('hsn_code', ''),
-                row.get('units', ''),
-                row.get('invoice_no', ''),
-                row.get('qty', 0),
-                row.get('price_incl_gst', 0),
-                row.get('price_ex_gst', 0),
-                row.get('discount_percentage', 0),
-                row.get('purchase_cost_per_unit_ex_gst', 0),
-                row.get('gst_percentage', 0),
-                row.get('taxable_value', 0),
-                row.get('igst', 0),
-                row.get('cgst', 0),
-                row.get('sgst', 0),
-                row.get('invoice_value', 0)
-            ])
-        
-        excel_data.append([])  # Empty row
-        
-        # Add sales section
-        excel_data.append(['SALES TO CUSTOMER - STOCK OUT'])
-        
-        # Add sales header
-        sales_header = [
-            'Date', 'Product Name', 'HSN Code', 'UNITS', 'Invoice No.', 'Qty.',
-            'Purchase Cost Per Unit Ex. GST', 'Purchase GST %', 'Purchase Taxable Value',
-            'Purchase IGST', 'Purchase CGST', 'Purchase SGST', 'Total Purchase Cost',
-            'MRP Incl. GST', 'MRP Ex. GST', 'Discount %', 'Discounted Sales Rate Ex. GST',
-            'Sales GST %', 'Sales Taxable Value', 'Sales IGST', 'Sales CGST', 'Sales SGST',
-            'Invoice Value'
-        ]
-        excel_data.append(sales_header)
-        
-        # Add sales data
-        for _, row in sales_df.iterrows():
-            excel_data.append([
-                row.get('date', ''),
-                row.get('product_name', ''),
-                row.get('hsn_code', ''),
-                row.get('units', ''),
-                row.get('invoice_no', ''),
-                row.get('qty', 0),
-                row.get('purchase_cost_per_unit_ex_gst', 0),
-                row.get('purchase_gst_percentage', 0),
-                row.get('purchase_taxable_value', 0),
-                row.get('purchase_igst', 0),
-                row.get('purchase_cgst', 0),
-                row.get('purchase_sgst', 0),
-                row.get('total_purchase_cost', 0),
-                row.get('mrp_incl_gst', 0),
-                row.get('mrp_ex_gst', 0),
-                row.get('discount_percentage', 0),
-                row.get('discounted_sales_rate_ex_gst', 0),
-                row.get('sales_gst_percentage', 0),
-                row.get('sales_taxable_value', 0),
-                row.get('sales_igst', 0),
-                row.get('sales_cgst', 0),
-                row.get('sales_sgst', 0),
-                row.get('invoice_value', 0)
-            ])
-        
-        excel_data.append([])  # Empty row
-        
-        # Add consumption section
-        excel_data.append(['SALON CONSUMPTION - STOCK OUT'])
-        
-        # Add consumption header
-        consumption_header = [
-            'Date', 'Product Name', 'HSN Code', 'UNITS', 'Requisition Voucher No.', 'Qty.',
-            'Purchase Cost Per Unit Ex. GST', 'Purchase GST %', 'Taxable Value',
-            'IGST', 'CGST', 'SGST', 'Total Purchase Cost'
-        ]
-        excel_data.append(consumption_header)
-        
-        # Add consumption data
-        for _, row in consumption_df.iterrows():
-            excel_data.append([
-                row.get('date', ''),
-                row.get('product_name', ''),
-                row.get('hsn_code', ''),
-                row.get('units', ''),
-                row.get('requisition_voucher_no', ''),
-                row.get('qty', 0),
-                row.get('purchase_cost_per_unit_ex_gst', 0),
-                row.get('purchase_gst_percentage', 0),
-                row.get('taxable_value', 0),
-                row.get('igst', 0),
-                row.get('cgst', 0),
-                row.get('sgst', 0),
-                row.get('total_purchase_cost', 0)
-            ])
-        
-        excel_data.append([])  # Empty row
-        
-        # Add balance section
-        excel_data.append(['BALANCE STOCK'])
-        
-        # Add balance header
-        balance_header = [
-            'Product Name', 'HSN Code', 'UNITS', 'Qty.', 'Taxable Value',
-            'IGST', 'CGST', 'SGST', 'Invoice Value'
-        ]
-        excel_data.append(balance_header)
-        
-        # Add balance data
-        for _, row in balance_df.iterrows():
-            excel_data.append([
-                row.get('product_name', ''),
-                row.get('hsn_code', ''),
-                row.get('units', ''),
-                row.get('qty', 0),
-                row.get('taxable_value', 0),
-                row.get('igst', 0),
-                row.get('cgst', 0),
-                row.get('sgst', 0),
-                row.get('invoice_value', 0)
-            ])
-        
-        # Create a DataFrame from the excel_data list
-        df = pd.DataFrame(excel_data)
-        
-        # Write to Excel
-        df.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
-        
-        # Save the Excel file
-        writer.close()
-        
-        # Return the file
-        return send_file(temp_filename, as_attachment=True, download_name='STOCK_DETAILS_export.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        cursor = conn.cursor()
+        sheet_qty = None
+        if sheet:
+            sheet_qty, unknown = sheet_balance_qty(cursor, sheet)
+            for name in unknown:
+                click.echo(f"Sheet product not in database: {name}")
+        
+        if csv_path:
+            # Truncated once and headed up front, so a clean run still leaves a header-only file
+            csv_file = open(csv_path, 'w', newline='')
+            pd.DataFrame(columns=list(RECONCILE_COLUMNS)).to_csv(csv_file, index=False)
+        
+        checked = 0
+        found = 0
+        for frame in reconcile_stock(cursor, product_ids, sheet_qty):
+            mismatches = reconcile_mismatches(frame, tolerance)[list(RECONCILE_COLUMNS)]
+            checked += len(frame)
+            if csv_file:
+                mismatches.to_csv(csv_file, header=False, index=False)
+            else:
+                for row in mismatches.itertuples(index=False):
+                    stored = f"{row.stored_qty:g}" if pd.notna(row.stored_qty) else 'none'
+                    click.echo(
+                        f"{row.product_id} {row.product_name}: expected {row.expected_qty:g}, "
+                        f"stored {stored} ({row.stored_diff:+g})"
+                        + (f", sheet {row.sheet_qty:g} ({row.sheet_diff:+g})" if pd.notna(row.sheet_qty) else '')
+                    )
+            found += len(mismatches)
+        cursor.close()
+        click.echo(f"{found} of {checked} products differ")
+    finally:
+        if csv_file:
+            csv_file.close()
+        conn.close()
+
+POS_SALE_COLUMNS = (
+    'id', 'product_id', 'date', 'invoice_no', 'qty',
+    'incl_gst', 'ex_gst', 'taxable_value', 'igst', 'cgst', 'sgst',
+    'invoice_value', 'customer', 'payment_method',
+    'transaction_type', 'converted_to_consumption', 'created_at',
+    'purchase_cost_per_unit_ex_gst', 'purchase_gst_percentage',
+    'purchase_taxable_value', 'purchase_igst', 'purchase_cgst',
+    'purchase_sgst', 'total_purchase_cost', 'mrp_incl_gst',
+    'mrp_ex_gst', 'discount_percentage', 'discounted_sales_rate_ex_gst',
+    'sales_gst_percentage', 'sales_taxable_value', 'sales_igst',
+    'sales_cgst', 'sales_sgst', 'idempotency_key'
+)
+
+# Longest client-supplied idempotency key (sales.idempotency_key)
+MAX_IDEMPOTENCY_KEY_LENGTH = 100
+
+# Limits of the sales columns a POS line is written to, checked per line before the batch insert
+POS_PAYMENT_METHODS = ('cash', 'card', 'online', 'other')
+POS_TEXT_LIMITS = {'invoice_no': 100, 'customer': 255}
+POS_DECIMAL_LIMITS = {'discount_percentage': 1000, 'purchase_gst_percentage': 10 ** 6, 'sales_gst_percentage': 10 ** 6}
+POS_DECIMAL_LIMIT = 10 ** 8
+POS_NUMBER_FIELDS = ('quantity', 'price', 'gst_percentage', 'discount_percentage')
+
+# Balance stock columns reduced by the purchase value of every synced sale
+BALANCE_VALUE_COLUMNS = ('qty', 'taxable_value', 'igst', 'cgst', 'sgst', 'invoice_value')
+
+def validate_pos_sale(sale):
+    """Check the caller-supplied fields of a POS line. Raises ValueError naming the first bad field."""
+    for field in POS_NUMBER_FIELDS:
+        value = sale.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{field} must be a number")
+    if sale.get('date') is not None:
+        try:
+            datetime.strptime(str(sale['date']), '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f"date must be YYYY-MM-DD: {sale['date']}")
+    if sale.get('payment_method', 'cash') not in POS_PAYMENT_METHODS:
+        raise ValueError(f"payment_method must be one of: {', '.join(POS_PAYMENT_METHODS)}")
+
+def validate_pos_line(line):
+    """Check a computed POS sales row against the column limits. Raises ValueError naming the first bad column."""
+    for column, limit in POS_TEXT_LIMITS.items():
+        if len(str(line[column])) > limit:
+            raise ValueError(f"{column} longer than {limit} characters")
+    for column in POS_SALE_COLUMNS:
+        value = line[column]
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"{column} is not a finite number")
+        if isinstance(value, (int, float)) and abs(value) >= POS_DECIMAL_LIMITS.get(column, POS_DECIMAL_LIMIT):
+            raise ValueError(f"{column} out of range: {value}")
+
+def pos_sale_line(sale, product_id, purchase_cost, now, invoice_no):
+    """
+    Compute the sales row for one POS line item from its product's average
+    purchase cost. `invoice_no` is used when the line does not carry its own.
+    """
+    avg_cost_ex_gst, avg_gst_percentage = purchase_cost or (None, None)
+    
+    # Default values if no purchase info is found
+    purchase_cost_per_unit_ex_gst = avg_cost_ex_gst or 0
+    purchase_gst_percentage = avg_gst_percentage or 0.18
+    
+    # Calculate values for the sale
+    qty = sale.get('quantity', 1)
+    mrp_incl_gst = sale.get('price', 0)
+    sales_gst_percentage = sale.get('gst_percentage', 0.18)
+    
+    # Calculate ex GST price (formula: price_incl_gst / (1 + gst_rate))
+    mrp_ex_gst = mrp_incl_gst / (1 + sales_gst_percentage)
+    
+    # Calculate discounted values if discount is provided
+    discount_percentage = sale.get('discount_percentage', 0)
+    discounted_sales_rate_ex_gst = mrp_ex_gst * (1 - discount_percentage / 100)
+    
+    # Calculate taxable values
+    purchase_taxable_value = purchase_cost_per_unit_ex_gst * qty
+    sales_taxable_value = discounted_sales_rate_ex_gst * qty
+    
+    # Calculate GST values
+    purchase_igst = purchase_taxable_value * purchase_gst_percentage
+    sales_igst = sales_taxable_value * sales_gst_percentage
+    
+    # Split IGST into CGST and SGST (assuming equal split)
+    purchase_cgst = purchase_igst / 2
+    purchase_sgst = purchase_igst / 2
+    sales_cgst = sales_igst / 2
+    sales_sgst = sales_igst / 2
+    
+    # Calculate totals
+    total_purchase_cost = purchase_taxable_value + purchase_igst
+    invoice_value = sales_taxable_value + sales_igst
+    
+    return {
+        'id': str(uuid.uuid4()),
+        'product_id': product_id,
+        'date': sale.get('date', now.strftime('%Y-%m-%d')),
+        'invoice_no': sale.get('invoice_no', invoice_no),
+        'qty': qty,
+        'incl_gst': mrp_incl_gst,
+        'ex_gst': mrp_ex_gst,
+        'taxable_value': sales_taxable_value,
+        'igst': sales_igst,
+        'cgst': sales_cgst,
+        'sgst': sales_sgst,
+        'invoice_value': invoice_value,
+        'customer': sale.get('customer_name', 'Walk-in'),
+        'payment_method': sale.get('payment_method', 'cash'),
+        'transaction_type': 'sale',
+        'converted_to_consumption': False,
+        'created_at': now,
+        'purchase_cost_per_unit_ex_gst': purchase_cost_per_unit_ex_gst,
+        'purchase_gst_percentage': purchase_gst_percentage,
+        'purchase_taxable_value': purchase_taxable_value,
+        'purchase_igst': purchase_igst,
+        'purchase_cgst': purchase_cgst,
+        'purchase_sgst': purchase_sgst,
+        'total_purchase_cost': total_purchase_cost,
+        'mrp_incl_gst': mrp_incl_gst,
+        'mrp_ex_gst': mrp_ex_gst,
+        'discount_percentage': discount_percentage,
+        'discounted_sales_rate_ex_gst': discounted_sales_rate_ex_gst,
+        'sales_gst_percentage': sales_gst_percentage,
+        'sales_taxable_value': sales_taxable_value,
+        'sales_igst': sales_igst,
+        'sales_cgst': sales_cgst,
+        'sales_sgst': sales_sgst,
+        'idempotency_key': sale.get('idempotency_key'),
+    }
+
+def sale_balance_delta(line):
+    """Return the balance stock change (per BALANCE_VALUE_COLUMNS) caused by one sales row."""
+    return (
+        -line['qty'],
+        -line['purchase_taxable_value'],
+        -line['purchase_igst'],
+        -line['purchase_cgst'],
+        -line['purchase_sgst'],
+        -line['total_purchase_cost']
+    )
+
+def apply_balance_deltas(cursor, deltas, now=None):
+    """
+    Apply summed per-product balance changes as atomic in-database increments
+    (`qty = qty + VALUES(qty)`), creating missing balance rows. Nothing is read
+    first, so concurrent syncs for the same product cannot lose updates.
+    """
+    if not deltas:
+        return 0
+    now = now or datetime.now()
+    
+    # Touch rows in a fixed order so concurrent batches lock them consistently instead of deadlocking
+    product_ids = sorted(deltas)
+    ids = generate_uuids(len(product_ids))
+    rows = [
+        [balance_id, product_id, *deltas[product_id], now, now]
+        for balance_id, product_id in zip(ids, product_ids)
+    ]
+    
+    columns = ('id', 'product_id', *BALANCE_VALUE_COLUMNS, 'created_at', 'updated_at')
+    return bulk_insert(
+        cursor,
+        'balance_stock',
+        columns,
+        rows,
+        on_duplicate=', '.join(
+            [f"{column} = {column} + VALUES({column})" for column in BALANCE_VALUE_COLUMNS]
+            + ['updated_at = VALUES(updated_at)']
+        )
+    )
 
 @app.route('/api/inventory/sync-pos', methods=['POST'])
 def sync_pos_with_inventory():
-    """Sync POS sales data with inventory system."""
+    """
+    Sync POS sales data with inventory system.
+    
+    Products and purchase costs for the whole batch are resolved with chunked IN
+    queries, sales are inserted with multi-row statements and each product's
+    balance is changed once, by an atomic increment of the summed quantities.
+    
+    Lines may carry an `idempotency_key`. A line whose key is already stored
+    (or repeated within the batch) is reported as replayed and changes nothing,
+    so clients can safely retry a batch after a timeout.
+    
+    Every line is validated against the sales columns before the insert, and
+    rejected lines are reported in `errors` while the rest are stored. Should
+    the database still refuse the batch, nothing is stored and 500 is returned.
+    """
+    conn = None
     try:
         # Get data from request
         data = request.json
@@ -1168,172 +3123,140 @@ def sync_pos_with_inventory():
         if not conn:
             return jsonify({'error': 'Could not connect to database'}), 500
             
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor()
+        
+        # Services are not tracked in inventory
+        product_sales = [sale for sale in pos_sales if sale.get('type') == 'product']
+        requested_ids = list(dict.fromkeys(sale['product_id'] for sale in product_sales if sale.get('product_id')))
         
-        # Process each POS sale
-        processed_sales = []
+        known_ids = {
+            row[0] for row in fetch_by_ids(cursor, PRODUCTS_BY_ID_SQL, requested_ids)
+        }
+        purchase_costs = load_purchase_costs(cursor, known_ids)
+        
+        # One indexed lookup per chunk of keys finds lines that were already synced
+        keys = list(dict.fromkeys(str(sale['idempotency_key']) for sale in product_sales if sale.get('idempotency_key')))
+        stored_sales = dict(fetch_by_ids(cursor, SALES_BY_IDEMPOTENCY_KEY_SQL, keys))
+        
+        now = datetime.now()
+        # Unique per batch; a timestamp alone collides when two batches land in the same second
+        invoice_no = f"POS-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
         errors = []
+        lines = []
+        replayed_sales = []
+        batch_keys = set()
         
-        for sale in pos_sales:
+        for sale in product_sales:
             try:
-                # Check if this is a product (not a service)
-                if sale.get('type') != 'product':
-                    continue
-                    
-                # Get product details
                 product_id = sale.get('product_id')
                 if not product_id:
                     errors.append(f"Missing product_id for sale: {sale}")
                     continue
                     
-                # Query to get product details
-                cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-                product = cursor.fetchone()
-                
-                if not product:
+                if product_id not in known_ids:
                     errors.append(f"Product not found for id: {product_id}")
                     continue
-                    
-                # Query to get purchase cost information
-                cursor.execute("""
-                    SELECT 
-                        AVG(ex_gst) as avg_cost_ex_gst,
-                        AVG(igst / taxable_value) as avg_gst_percentage
-                    FROM purchases 
-                    WHERE product_id = %s
-                """, (product_id,))
-                purchase_info = cursor.fetchone()
-                
-                # Default values if no purchase info is found
-                purchase_cost_per_unit_ex_gst = purchase_info['avg_cost_ex_gst'] if purchase_info and purchase_info['avg_cost_ex_gst'] else 0
-                purchase_gst_percentage = purchase_info['avg_gst_percentage'] if purchase_info and purchase_info['avg_gst_percentage'] else 0.18
-                
-                # Calculate values for the sale
-                qty = sale.get('quantity', 1)
-                mrp_incl_gst = sale.get('price', 0)
-                sales_gst_percentage = sale.get('gst_percentage', 0.18)
-                
-                # Calculate ex GST price (formula: price_incl_gst / (1 + gst_rate))
-                mrp_ex_gst = mrp_incl_gst / (1 + sales_gst_percentage)
-                
-                # Calculate discounted values if discount is provided
-                discount_percentage = sale.get('discount_percentage', 0)
-                discounted_sales_rate_ex_gst = mrp_ex_gst * (1 - discount_percentage / 100)
-                
-                # Calculate taxable values
-                purchase_taxable_value = purchase_cost_per_unit_ex_gst * qty
-                sales_taxable_value = discounted_sales_rate_ex_gst * qty
                 
-                # Calculate GST values
-                purchase_igst = purchase_taxable_value * purchase_gst_percentage
-                sales_igst = sales_taxable_value * sales_gst_percentage
+                key = str(sale['idempotency_key']) if sale.get('idempotency_key') else None
+                if key:
+                    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+                        errors.append(f"idempotency_key longer than {MAX_IDEMPOTENCY_KEY_LENGTH} characters: {key}")
+                        continue
+                    if key in stored_sales or key in batch_keys:
+                        replayed_sales.append({'idempotency_key': key, 'id': stored_sales.get(key)})
+                        continue
                 
-                # Split IGST into CGST and SGST (assuming equal split)
-                purchase_cgst = purchase_igst / 2
-                purchase_sgst = purchase_igst / 2
-                sales_cgst = sales_igst / 2
-                sales_sgst = sales_igst / 2
-                
-                # Calculate totals
-                total_purchase_cost = purchase_taxable_value + purchase_igst
-                invoice_value = sales_taxable_value + sales_igst
-                
-                # Create a sale record
-                sale_id = str(uuid.uuid4())
-                sale_date = sale.get('date', datetime.now().strftime('%Y-%m-%d'))
-                invoice_no = sale.get('invoice_no', f"POS-{datetime.now().strftime('%Y%m%d%H%M%S')}")
-                
-                # Insert sale record
-                cursor.execute("""
-                    INSERT INTO sales (
-                        id, product_id, date, invoice_no, qty, 
-                        incl_gst, ex_gst, taxable_value, igst, cgst, sgst, 
-                        invoice_value, customer, payment_method, 
-                        transaction_type, converted_to_consumption, created_at,
-                        purchase_cost_per_unit_ex_gst, purchase_gst_percentage,
-                        purchase_taxable_value, purchase_igst, purchase_cgst,
-                        purchase_sgst, total_purchase_cost, mrp_incl_gst,
-                        mrp_ex_gst, discount_percentage, discounted_sales_rate_ex_gst,
-                        sales_gst_percentage, sales_taxable_value, sales_igst,
-                        sales_cgst, sales_sgst
-                    ) VALUES (
-                        %s, %s, %s, %s, %s, 
-                        %s, %s, %s, %s, %s, %s, 
-                        %s, %s, %s, 
-                        %s, %s, %s,
-                        %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s
-                    )
-                """, (
-                    sale_id, product_id, sale_date, invoice_no, qty,
-                    mrp_incl_gst, mrp_ex_gst, sales_taxable_value, sales_igst, sales_cgst, sales_sgst,
-                    invoice_value, sale.get('customer_name', 'Walk-in'), sale.get('payment_method', 'cash'),
-                    'sale', False, datetime.now(),
-                    purchase_cost_per_unit_ex_gst, purchase_gst_percentage,
-                    purchase_taxable_value, purchase_igst, purchase_cgst,
-                    purchase_sgst, total_purchase_cost, mrp_incl_gst,
-                    mrp_ex_gst, discount_percentage, discounted_sales_rate_ex_gst,
-                    sales_gst_percentage, sales_taxable_value, sales_igst,
-                    sales_cgst, sales_sgst
-                ))
-                
-                # Update balance stock
-                cursor.execute("""
-                    SELECT * FROM balance_stock WHERE product_id = %s
-                """, (product_id,))
-                balance = cursor.fetchone()
-                
-                if balance:
-                    # Update existing balance
-                    new_qty = balance['qty'] - qty
-                    new_taxable_value = balance['taxable_value'] - purchase_taxable_value
-                    new_igst = balance['igst'] - purchase_igst
-                    new_cgst = balance['cgst'] - purchase_cgst
-                    new_sgst = balance['sgst'] - purchase_sgst
-                    new_invoice_value = balance['invoice_value'] - total_purchase_cost
-                    
-                    cursor.execute("""
-                        UPDATE balance_stock
-                        SET qty = %s, taxable_value = %s, igst = %s, cgst = %s, sgst = %s, invoice_value = %s, updated_at = %s
-                        WHERE id = %s
-                    """, (
-                        new_qty, new_taxable_value, new_igst, new_cgst, new_sgst, new_invoice_value, datetime.now(), balance['id']
-                    ))
-                else:
-                    # Create new balance record
-                    balance_id = str(uuid.uuid4())
-                    cursor.execute("""
-                        INSERT INTO balance_stock (id, product_id, qty, taxable_value, igst, cgst, sgst, invoice_value, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        balance_id, product_id, -qty, -purchase_taxable_value, -purchase_igst, -purchase_cgst, -purchase_sgst, -total_purchase_cost, datetime.now()
-                    ))
-                
-                processed_sales.append({
-                    'id': sale_id,
-                    'product_id': product_id,
-                    'qty': qty,
-                    'invoice_value': invoice_value
-                })
+                # Lines are checked one by one so a bad line is reported on its own
+                # instead of failing the multi-row insert for the whole batch
+                validate_pos_sale(sale)
+                line = pos_sale_line(sale, product_id, purchase_costs.get(product_id), now, invoice_no)
+                validate_pos_line(line)
+                line['idempotency_key'] = key
+                lines.append(line)
+                if key:
+                    batch_keys.add(key)
                 
+            except ValueError as e:
+                errors.append(f"Rejected sale for product {sale.get('product_id')}: {e}")
+                continue
             except Exception as e:
                 errors.append(str(e))
                 continue
         
+        # A concurrent request may have stored the same key since the lookup; the
+        # no-op update skips those rows, and only rows that are ours count as new
+        bulk_insert(
+            cursor, 'sales', POS_SALE_COLUMNS,
+            [[line[column] for column in POS_SALE_COLUMNS] for line in lines],
+            on_duplicate='id = id'
+        )
+        if batch_keys:
+            owners = dict(fetch_by_ids(cursor, SALES_BY_IDEMPOTENCY_KEY_SQL, batch_keys))
+            raced = [line for line in lines if line['idempotency_key'] and owners.get(line['idempotency_key']) != line['id']]
+            if raced:
+                replayed_sales.extend({'idempotency_key': line['idempotency_key'], 'id': None} for line in raced)
+                raced_ids = {line['id'] for line in raced}
+                lines = [line for line in lines if line['id'] not in raced_ids]
+            for replay in replayed_sales:
+                if replay['id'] is None:
+                    replay['id'] = owners.get(replay['idempotency_key'])
+        
+        balance_deltas = {}
+        for line in lines:
+            delta = sale_balance_delta(line)
+            totals = balance_deltas.get(line['product_id'])
+            balance_deltas[line['product_id']] = tuple(map(sum, zip(totals, delta))) if totals else delta
+        apply_balance_deltas(cursor, balance_deltas, now)
+        apply_ledger_movements(cursor, ledger_movements(
+            [line['product_id'] for line in lines],
+            [line['date'] for line in lines],
+            out_qty=[line['qty'] for line in lines],
+            out_value=[line['taxable_value'] for line in lines]
+        ))
+        
         # Commit changes
         conn.commit()
         cursor.close()
-        conn.close()
         
         return jsonify({
             'success': True,
-            'processed_sales': processed_sales,
+            'processed_sales': [
+                {
+                    'id': line['id'],
+                    'product_id': line['product_id'],
+                    'qty': line['qty'],
+                    'invoice_value': line['invoice_value'],
+                    'idempotency_key': line['idempotency_key'],
+                    'status': 'new'
+                }
+                for line in lines
+            ],
+            'replayed_sales': [dict(replay, status='replayed') for replay in replayed_sales],
+            'new_count': len(lines),
+            'replayed_count': len(replayed_sales),
             'errors': errors
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/db/pool-stats', methods=['GET'])
+def get_pool_stats():
+    """Expose connection pool metrics (checkouts, waits, time-to-acquire) for sizing."""
+    return jsonify({
+        'success': True,
+        'pool': get_db_pool().stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint: request and pipeline stage histograms in the text format."""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled; set METRICS_ENABLED=1'}), 404
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
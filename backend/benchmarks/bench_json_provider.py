@@ -0,0 +1,127 @@
+"""
+Benchmark JSON encoding of the cash-sales and parse-excel payloads.
+
+Compares the app's FastJSONProvider (orjson when installed, then the standard
+library fallback) with Flask's default provider fed the way the endpoints used
+to prepare their data: parse-excel frames converted with
+.where(pd.notna(...), None).to_dict(orient='records'), cash-sales rows with
+their dates pre-formatted as strings.
+
+Usage:
+    python benchmarks/bench_json_provider.py [--rows 100000] [--sales 50000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import app  # noqa: E402
+import json_provider  # noqa: E402
+from stock_workbook import build_sheet  # noqa: E402
+
+def cash_sales_rows(count, seed=0):
+    """Rows shaped like the dictionary cursor returns them for /api/cash-sales (DECIMAL columns as Decimal)."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 9, 0, 0)
+    rows = []
+    for index in range(count):
+        created = start + timedelta(minutes=index)
+        taxable = Decimal(rng.randint(10000, 500000)) / 100
+        igst = (taxable * Decimal('0.18')).quantize(Decimal('0.01'))
+        rows.append({
+            'id': f'00000000-0000-0000-0000-{index:012d}',
+            'date': created.date(),
+            'product_id': f'10000000-0000-0000-0000-{index % 500:012d}',
+            'product_name': f'Product {index % 500:05d}',
+            'hsn_code': '3305',
+            'unit': 'BTL',
+            'qty': Decimal(rng.randint(1, 5)),
+            'invoice_no': f'INV-{index}',
+            'customer': None,
+            'incl_gst': taxable + igst,
+            'ex_gst': taxable,
+            'taxable_value': taxable,
+            'igst': igst,
+            'cgst': igst / 2,
+            'sgst': igst / 2,
+            'invoice_value': taxable + igst,
+            'payment_method': 'cash',
+            'created_at': created,
+        })
+    return rows
+
+def legacy_cash_sales(rows):
+    """Previous preparation: dates formatted into strings row by row."""
+    return [
+        dict(row, date=row['date'].strftime('%Y-%m-%d'), created_at=row['created_at'].strftime('%Y-%m-%d %H:%M:%S'))
+        for row in rows
+    ]
+
+def parsed_sections(rows):
+    """The parse-excel section frames of a generated sheet, as parse_stock_workbook() returns them."""
+    df = build_sheet(rows)
+    spans = app.index_sections(df)
+    sections = {
+        name: app.section_frame(df, spans[section])
+        for name, section in (('purchases', 'PURCHASE'), ('sales', 'SALES'),
+                              ('consumption', 'CONSUMPTION'), ('balance', 'BALANCE'))
+    }
+    products = pd.concat([frame[['Product Name', 'HSN Code', 'UNITS']] for frame in sections.values()])
+    sections['products'] = products.drop_duplicates().astype(str)
+    return sections
+
+def legacy_parse_excel(sections):
+    """Previous preparation: every frame turned into a list of dicts with NaN replaced cell by cell."""
+    return {name: frame.where(pd.notna(frame), None).to_dict(orient='records') for name, frame in sections.items()}
+
+def best_of(repeat, func):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(func())
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='rows in the parse-excel workbook')
+    parser.add_argument('--sales', type=int, default=50000, help='rows in the cash-sales payload')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    default = DefaultJSONProvider(app.app)
+    fast = json_provider.FastJSONProvider(app.app)
+    orjson = json_provider.orjson
+
+    rows = cash_sales_rows(args.sales)
+    sections = parsed_sections(args.rows)
+    payloads = {
+        'cash-sales': (lambda: default.dumps({'cash_sales': legacy_cash_sales(rows)}), {'cash_sales': rows}),
+        'parse-excel': (lambda: default.dumps(legacy_parse_excel(sections)), sections),
+    }
+
+    print(f"cash-sales: {args.sales} rows, parse-excel: {args.rows} sheet rows, best of {args.repeat}")
+    for name, (legacy, payload) in payloads.items():
+        legacy_time, legacy_size = best_of(args.repeat, legacy)
+        print(f"{name:<12} flask default  {legacy_time:8.3f}s  {legacy_size / 1e6:7.1f}MB")
+        backends = [('orjson', orjson)] if orjson else []
+        backends.append(('stdlib', None))
+        for label, backend in backends:
+            json_provider.orjson = backend
+            elapsed, size = best_of(args.repeat, lambda: fast.encode(payload))
+            print(f"{name:<12} fast ({label:<6})  {elapsed:8.3f}s  {size / 1e6:7.1f}MB  x{legacy_time / elapsed:.1f}")
+        json_provider.orjson = orjson
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark the STOCK DETAILS section parsers.
+
+Compares the section index + vectorized process_*_section() functions in
+app.py against the previous row-by-row implementation (per-section title
+rescans and iterrows()) on a synthetic sheet.
+
+Usage:
+    python benchmarks/bench_section_parsers.py [--rows 50000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+from stock_workbook import build_sheet  # noqa: E402
+
+def legacy_section_rows(df, section):
+    """Previous boundary scan: find the title, then walk the first column row by row to find the end."""
+    titles = list(app.SECTION_TITLES.values())
+    title = app.SECTION_TITLES[section]
+    next_titles = titles[titles.index(title) + 1:]
+
+    matches = df[df.iloc[:, 0] == title]
+    if matches.empty:
+        return df.iloc[0:0]
+    start_idx = matches.index[0] + 2
+    end_idx = len(df) - 1
+    for idx in range(start_idx, len(df)):
+        if df.iloc[idx, 0] in next_titles:
+            end_idx = idx - 1
+            break
+
+    data = df.iloc[start_idx:end_idx + 1].copy()
+    headers = app.SECTION_HEADERS[section]
+    data.columns = headers + [f'Unnamed_{i}' for i in range(len(headers), df.shape[1])]
+    return data[data['Product Name'].notna()]
+
+def legacy_rows(data, fields, text_fields):
+    """Row-by-row record building equivalent to the previous process_*_section implementations."""
+    records = []
+    for _, row in data.iterrows():
+        record = {
+            'id': str(uuid.uuid4()),
+            'product_name': row.get('Product Name', ''),
+            'hsn_code': row.get('HSN Code', ''),
+            'unit': app.standardize_unit(str(row.get('UNITS', ''))),
+        }
+        for field, column in fields.items():
+            value = row.get(column, None)
+            record[field] = value if field == 'date' else app.fix_floating_point_errors(value)
+        for field, (column, default) in text_fields.items():
+            record[field] = row.get(column, default) if column in row else default
+        records.append(record)
+    return records
+
+def legacy_parse(df):
+    return (
+        legacy_rows(legacy_section_rows(df, 'PURCHASE'), app.PURCHASE_FIELDS,
+                    {'invoice_no': ('Invoice No.', ''), 'supplier': ('Supplier', '')}),
+        legacy_rows(legacy_section_rows(df, 'SALES'), app.SALES_FIELDS,
+                    {'invoice_no': ('Invoice No.', ''), 'customer': ('Customer', ''),
+                     'payment_method': ('Payment Method', 'cash')}),
+        legacy_rows(legacy_section_rows(df, 'CONSUMPTION'), app.CONSUMPTION_FIELDS,
+                    {'purpose': ('Purpose', '')}),
+        legacy_rows(legacy_section_rows(df, 'BALANCE'), app.BALANCE_FIELDS, {}),
+    )
+
+def vectorized_parse(df):
+    spans = app.index_sections(df)
+    return (
+        app.process_purchase_section(df, spans),
+        app.process_sales_section(df, spans),
+        app.process_consumption_section(df, spans),
+        app.process_balance_section(df, spans),
+    )
+
+def best_of(func, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(df)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = build_sheet(args.rows)
+
+    legacy_time, legacy = best_of(legacy_parse, df, args.repeat)
+    vector_time, vector = best_of(vectorized_parse, df, args.repeat)
+
+    legacy_counts = [len(section) for section in legacy]
+    vector_counts = [len(section) for section in vector]
+    if legacy_counts != vector_counts:
+        raise SystemExit(f"Row counts differ: legacy={legacy_counts} vectorized={vector_counts}")
+
+    print(f"rows:        {args.rows}")
+    print(f"sections:    {vector_counts}")
+    print(f"iterrows:    {legacy_time:.3f}s")
+    print(f"vectorized:  {vector_time:.3f}s")
+    print(f"speedup:     {legacy_time / vector_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare peak memory of the full-sheet and streaming STOCK DETAILS imports.
+
+Each mode runs in a fresh subprocess that parses the workbook and pushes
+every batch through the section writers against a stand-in cursor, so the
+numbers cover parsing and row materialization but not MySQL itself.
+
+Usage:
+    python benchmarks/bench_stream_import.py [--rows 200000] [--workbook path.xlsx]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from common import StandInConnection, peak_rss_mb  # noqa: E402
+from stock_workbook import write_workbook  # noqa: E402
+
+def run_child(mode, path):
+    import app
+
+    baseline = peak_rss_mb()
+    connection = StandInConnection()
+    cursor = connection.cursor()
+    started = time.perf_counter()
+
+    if mode == 'stream':
+        _, counts, _ = app.import_stock_stream(cursor, path)
+        rows = sum(counts.values())
+    else:
+        import pandas as pd
+        df = pd.read_excel(path, sheet_name='STOCK DETAILS', header=None)
+        spans = app.index_sections(df)
+        sections = [
+            app.process_purchase_section(df, spans),
+            app.process_sales_section(df, spans),
+            app.process_consumption_section(df, spans),
+            app.process_balance_section(df, spans),
+        ]
+        product_ids = app.upsert_products(cursor, app.extract_unique_products(sections))
+        for (section, writer), batch in zip(app.SECTION_WRITERS.items(), sections):
+            writer(cursor, app.prepare_import_batch(cursor, section, batch, 'full'), product_ids)
+        rows = sum(len(batch) for batch in sections)
+
+    print(json.dumps({
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(time.perf_counter() - started, 3),
+        'statements': connection.statements,
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--workbook', help='existing workbook to import instead of a generated one')
+    parser.add_argument('--child', choices=['full', 'stream'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.workbook)
+        return
+
+    path = args.workbook
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), 'stock_details.xlsx')
+        print(f"generating {args.rows} rows -> {path}", file=sys.stderr)
+        write_workbook(path, args.rows)
+
+    try:
+        for mode in ('full', 'stream'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--child', mode, '--workbook', path],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(
+                f"{mode:<7} rows={result['rows']:<8} time={result['seconds']:>7.2f}s "
+                f"peak_rss={result['peak_rss_mb']:>7.1f}MB "
+                f"(+{result['peak_rss_mb'] - result['baseline_rss_mb']:.1f}MB over import baseline)"
+            )
+    finally:
+        if not args.workbook:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+if __name__ == '__main__':
+    main()
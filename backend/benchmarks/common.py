@@ -0,0 +1,103 @@
+"""
+Shared pieces of the benchmark scripts: a stand-in database connection and
+peak memory measurement.
+"""
+import resource
+import sys
+
+class StandInCursor:
+    """
+    Accepts every statement without a database and answers the lookups the
+    write paths depend on: product ids by (name, hsn_code) or by id, and sales
+    idempotency keys inserted earlier through the same connection.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.connection.statements += 1
+        self._rows = []
+        self.rowcount = 0
+        sql = sql.lstrip()
+        if sql.startswith('SELECT id, name, hsn_code FROM products'):
+            pairs = zip(params[0::2], params[1::2])
+            self._rows = [(f'{name}|{hsn_code}', name, hsn_code) for name, hsn_code in pairs]
+        elif sql.startswith('SELECT id FROM products WHERE id IN'):
+            self._rows = [(product_id,) for product_id in params]
+        elif sql.startswith('SELECT idempotency_key, id FROM sales'):
+            keys = self.connection.idempotency_keys
+            self._rows = [(key, keys[key]) for key in params if key in keys]
+        elif sql.startswith('INSERT INTO sales') and 'idempotency_key' in sql:
+            columns = [column.strip() for column in sql[sql.index('(') + 1:sql.index(')')].split(',')]
+            width = len(columns)
+            key_at = columns.index('idempotency_key')
+            for start in range(0, len(params), width):
+                row = params[start:start + width]
+                if row[key_at] is not None:
+                    self.connection.idempotency_keys.setdefault(row[key_at], row[0])
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+class StandInConnection:
+    """Connection handing out StandInCursors; counts the statements they were sent."""
+
+    def __init__(self):
+        self.statements = 0
+        self.idempotency_keys = {}
+
+    def cursor(self, **kwargs):
+        return StandInCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (since the last reset_peak_rss() where supported)."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def reset_peak_rss():
+    """
+    Reset the peak to the current resident memory (Linux), so a measurement is not
+    hidden by a larger transient peak from start-up. Elsewhere this does nothing.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
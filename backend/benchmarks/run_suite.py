@@ -0,0 +1,307 @@
+"""
+Time the hot request paths of app.py at several workbook sizes and write the results as JSON.
+
+Each (benchmark, size) pair runs in a fresh subprocess, through the Flask test
+client, so peak memory is measured per run:
+
+- parse:          POST /api/inventory/parse-excel
+- parse_columnar: POST /api/inventory/parse-excel with Accept: application/vnd.salon.columnar+json
+- extract:        POST /api/extract-stock (whole-sheet import)
+- extract_stream: POST /api/extract-stock with stream=1
+- export:         POST /api/inventory/export-excel with the rows as JSON
+- export_db:      GET /api/inventory/export-excel (only with --db)
+- sync:           POST /api/inventory/sync-pos with one line per row (capped by --sync-lines)
+
+Without --db the database is a stand-in that accepts every statement, so the
+numbers cover parsing, row building and response encoding but not MySQL. With
+--db the runs use the DB_* settings (.env); point them at a scratch database,
+because the imported rows are left in place. Each importing benchmark then gets
+its own workbook with fresh product names, so no run re-imports rows stored by
+an earlier one.
+
+Usage:
+    python benchmarks/run_suite.py [--sizes 1000,10000,100000] [--benchmarks parse,extract]
+                                   [--output results.json] [--compare baseline.json]
+                                   [--threshold 1.25] [--db] [--sync-lines 20000]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from common import StandInConnection, peak_rss_mb, reset_peak_rss  # noqa: E402
+import stock_workbook  # noqa: E402
+
+BENCHMARKS = ('parse', 'parse_columnar', 'extract', 'extract_stream', 'export', 'export_db', 'sync')
+DB_ONLY = ('export_db',)
+# Benchmarks that store the workbook's rows when run against a database
+DB_WRITES = ('extract', 'extract_stream')
+
+def export_payload_path(workbook):
+    return f'{workbook}.export.json'
+
+def export_payload(rows, seed=0):
+    """Build the JSON body of POST /api/inventory/export-excel for a generated workbook of `rows` rows."""
+    import numpy as np
+    import app
+
+    rng = np.random.default_rng(seed)
+    products = stock_workbook.catalogue(rows, seed)
+    sizes = stock_workbook.section_sizes(rows, products)
+    payload = {
+        'products': [
+            {'name': name, 'hsn_code': str(hsn_code), 'unit': unit}
+            for name, hsn_code, unit in zip(products['name'], products['hsn_code'], products['unit'])
+        ]
+    }
+    for section, key in app.EXPORT_SOURCES.items():
+        fields = [field for field, _ in app.EXPORT_FIELDS[section]]
+        columns = [
+            column.tolist() if hasattr(column, 'tolist') else column
+            for column in stock_workbook.section_chunk(section, sizes[section], products, rng)
+        ]
+        if 'date' in fields:
+            columns[0] = [day.strftime('%Y-%m-%d') for day in columns[0]]
+        payload[key] = [dict(zip(fields, values)) for values in zip(*columns)]
+    return json.dumps(payload).encode()
+
+def sync_payload(product_ids, lines, seed=0):
+    """Build a POS sync batch of `lines` product lines with idempotency keys."""
+    import random
+
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]
+    return {
+        'pos_sales': [
+            {
+                'type': 'product',
+                'product_id': rng.choice(product_ids),
+                'quantity': rng.randint(1, 3),
+                'price': rng.choice([199, 349, 599, 1299]),
+                'discount_percentage': rng.choice([0, 0, 10]),
+                'idempotency_key': f'bench-{run_id}-{index}',
+            }
+            for index in range(lines)
+        ]
+    }
+
+def prepare(name, client, app, rows, workbook, sync_lines):
+    """Build the request for one benchmark outside the timed section; returns a zero-argument callable."""
+    if name in ('parse', 'parse_columnar', 'extract', 'extract_stream'):
+        with open(workbook, 'rb') as handle:
+            content = handle.read()
+        parse = name.startswith('parse')
+        url = '/api/inventory/parse-excel' if parse else '/api/extract-stock'
+        form = {} if parse else {'stream': '1' if name == 'extract_stream' else '0'}
+        headers = {'Accept': app.COLUMNAR_JSON} if name == 'parse_columnar' else {}
+
+        def call():
+            data = dict(form, file=(io.BytesIO(content), 'STOCK_DETAILS.xlsx'))
+            return client.post(url, data=data, content_type='multipart/form-data', headers=headers)
+        return call
+
+    if name == 'export':
+        # Built by the parent process, so the child's memory baseline holds only the request body
+        with open(export_payload_path(workbook), 'rb') as handle:
+            body = handle.read()
+        return lambda: client.post('/api/inventory/export-excel', data=body, content_type='application/json')
+
+    if name == 'export_db':
+        return lambda: client.get('/api/inventory/export-excel')
+
+    conn = app.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM products LIMIT 500")
+    product_ids = [row[0] for row in cursor.fetchall()] or [str(uuid.uuid4()) for _ in range(500)]
+    cursor.close()
+    conn.close()
+    payload = sync_payload(product_ids, min(rows, sync_lines))
+    return lambda: client.post('/api/inventory/sync-pos', json=payload)
+
+def run_child(name, rows, workbook, use_db, sync_lines):
+    """Run one benchmark in this (fresh) process and print its result as JSON."""
+    # A disk cache tier would turn repeated parse runs into cache hits
+    os.environ.pop('PARSE_CACHE_DIR', None)
+    import app
+
+    connection = None
+    if not use_db:
+        connection = StandInConnection()
+        app.get_db_connection = lambda: app.InstrumentedConnection(connection, app.current_query_stats)
+
+    client = app.app.test_client()
+    call = prepare(name, client, app, rows, workbook, sync_lines)
+    statements_before = connection.statements if connection else None
+
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    response = call()
+    body = response.get_data()
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'benchmark': name,
+        'rows': rows,
+        'seconds': round(elapsed, 4),
+        'status': response.status_code,
+        'response_bytes': len(body),
+        'statements': connection.statements - statements_before if connection else None,
+        'db_query_count': int(response.headers['X-DB-Query-Count']) if 'X-DB-Query-Count' in response.headers else None,
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment(use_db):
+    import numpy
+    import openpyxl
+    import pandas
+
+    import json_provider
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'openpyxl': openpyxl.__version__,
+        'json_encoder': 'orjson' if json_provider.orjson else 'stdlib',
+        'database': 'mysql' if use_db else 'stand-in',
+    }
+
+def compare(results, baseline_path, threshold):
+    """Print time and memory ratios against an earlier results file; return the number of regressions."""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    previous = {(result['benchmark'], result['rows']): result for result in baseline['results']}
+
+    print(f"\ncompared with {baseline_path} (commit {baseline['environment'].get('commit')})")
+    regressions = 0
+    for result in results:
+        before = previous.get((result['benchmark'], result['rows']))
+        if not before or 'error' in before or not before['seconds']:
+            continue
+        time_ratio = result['seconds'] / before['seconds']
+        growth_before = max(before['peak_rss_mb'] - before['baseline_rss_mb'], 1.0)
+        growth_now = max(result['peak_rss_mb'] - result['baseline_rss_mb'], 1.0)
+        memory_ratio = growth_now / growth_before
+        regressed = time_ratio > threshold or memory_ratio > threshold
+        regressions += regressed
+        print(
+            f"{'SLOWER' if regressed else 'ok':<7} {result['benchmark']:<15} rows={result['rows']:<8} "
+            f"time x{time_ratio:.2f} memory x{memory_ratio:.2f}"
+        )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated row counts (up to 1000000)')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS), help='comma-separated benchmark names')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='time or memory ratio over the baseline reported as a regression')
+    parser.add_argument('--db', action='store_true', help='use the configured database instead of a stand-in')
+    parser.add_argument('--sync-lines', type=int, default=20000, help='most POS lines in one sync request')
+    parser.add_argument('--workbook-dir', help='keep generated workbooks here and reuse them between runs')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--workbook', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.child:
+        run_child(args.child, sizes[0], args.workbook, args.db, args.sync_lines)
+        return
+
+    names = [name for name in args.benchmarks.split(',') if name]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if not args.db:
+        names = [name for name in names if name not in DB_ONLY]
+    else:
+        import app
+
+        conn = app.get_db_connection()
+        if not conn:
+            sys.exit('Database connection failed; check the DB_* settings')
+        conn.close()
+
+    workbook_dir = args.workbook_dir or tempfile.mkdtemp()
+    os.makedirs(workbook_dir, exist_ok=True)
+
+    results = []
+    try:
+        for rows in sizes:
+            workbook = os.path.join(workbook_dir, f'stock_details_{rows}.xlsx')
+            if not os.path.exists(workbook):
+                print(f"generating {rows} rows -> {workbook}", file=sys.stderr)
+                stock_workbook.write_workbook(workbook, rows)
+            if 'export' in names and not os.path.exists(export_payload_path(workbook)):
+                with open(export_payload_path(workbook), 'wb') as handle:
+                    handle.write(export_payload(rows))
+
+            for name in names:
+                run_workbook = workbook
+                if args.db and name in DB_WRITES:
+                    # Fresh product names per run, so the import never meets rows stored by an earlier one
+                    run_workbook = os.path.join(workbook_dir, f'stock_details_{rows}_{name}.xlsx')
+                    print(f"generating {rows} rows -> {run_workbook}", file=sys.stderr)
+                    stock_workbook.write_workbook(run_workbook, rows, prefix=f'Bench {uuid.uuid4().hex[:8]}')
+
+                command = [
+                    sys.executable, __file__, '--child', name, '--sizes', str(rows),
+                    '--workbook', run_workbook, '--sync-lines', str(args.sync_lines)
+                ]
+                if args.db:
+                    command.append('--db')
+                completed = subprocess.run(command, capture_output=True, text=True)
+                if completed.returncode:
+                    print(f"{name} rows={rows} failed:\n{completed.stderr}", file=sys.stderr)
+                    results.append({'benchmark': name, 'rows': rows, 'error': completed.stderr.strip()[-2000:]})
+                    continue
+
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(
+                    f"{name:<15} rows={rows:<8} time={result['seconds']:>8.3f}s "
+                    f"peak_rss={result['peak_rss_mb']:>7.1f}MB "
+                    f"(+{result['peak_rss_mb'] - result['baseline_rss_mb']:.1f}MB) HTTP {result['status']}"
+                )
+    finally:
+        if not args.workbook_dir:
+            for filename in os.listdir(workbook_dir):
+                os.remove(os.path.join(workbook_dir, filename))
+            os.rmdir(workbook_dir)
+
+    with open(args.output, 'w') as handle:
+        json.dump({'environment': environment(args.db), 'results': results}, handle, indent=2)
+    print(f"results written to {args.output}")
+
+    failed = sum('error' in result or result['status'] >= 400 for result in results)
+    if args.compare:
+        failed += compare([result for result in results if 'error' not in result], args.compare, args.threshold)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Generate realistic STOCK DETAILS workbooks for the benchmarks.
+
+The sheet looks like the ones salons upload: a banner, then each of the four
+sections as a title row over a column header row (with the occasional blank
+header cell), unit strings such as BTL-BOTTLES, blank spacer rows and
+spreadsheet-style floating point noise in the computed amounts. Rows are
+produced in vectorized chunks and can be streamed straight into a write-only
+workbook, so 1M-row files are generated in bounded memory.
+
+Usage:
+    python benchmarks/stock_workbook.py --rows 100000 stock_details.xlsx
+"""
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+UNITS = ['BTL-BOTTLES', 'PCS-PIECES', 'BOX-BOXES', 'JAR-JARS', 'PKT-PACKETS', 'TUBE', 'KIT']
+HSN_CODES = [3305, 3304, 3307, 3401, 9603]
+GST_RATES = [0.18, 0.12, 0.05]
+START_DATE = date(2023, 4, 1)
+
+# Share of the transaction rows that goes to each section; BALANCE has one row per product
+SECTION_SHARES = {'PURCHASE': 0.25, 'SALES': 0.5, 'CONSUMPTION': 0.25}
+
+CHUNK_ROWS = 10000
+
+def catalogue(rows, seed=0, prefix='Product'):
+    """Return the product catalogue (names, HSN codes, units, MRPs) for a workbook of `rows` rows."""
+    rng = np.random.default_rng(seed)
+    count = max(10, rows // 50)
+    return pd.DataFrame({
+        'name': [f'{prefix} {index:05d}' for index in range(count)],
+        'hsn_code': rng.choice(HSN_CODES, count),
+        'unit': rng.choice(UNITS, count),
+        'mrp': np.round(rng.uniform(99, 2499, count), 0),
+        'gst': rng.choice(GST_RATES, count),
+    })
+
+def section_sizes(rows, products):
+    """Split `rows` into per-section row counts (BALANCE first takes one row per product)."""
+    transactions = max(rows - len(products), 0)
+    sizes = {section: int(transactions * share) for section, share in SECTION_SHARES.items()}
+    sizes['SALES'] += transactions - sum(sizes.values())
+    sizes['BALANCE'] = min(len(products), rows)
+    return sizes
+
+def section_chunk(section, count, products, rng):
+    """Build `count` rows of `section` in SECTION_HEADERS order as a list of column arrays."""
+    if section == 'BALANCE':
+        picked = products.iloc[:count]
+    else:
+        picked = products.iloc[rng.integers(0, len(products), count)]
+    names = picked['name'].to_numpy()
+    hsn = picked['hsn_code'].to_numpy()
+    units = picked['unit'].to_numpy()
+    mrp = picked['mrp'].to_numpy()
+    gst = picked['gst'].to_numpy()
+
+    # Division by (1 + GST) leaves the float noise real sheets carry
+    cost = mrp / (1 + gst) * 0.6
+    if section == 'BALANCE':
+        qty = rng.integers(0, 200, count)
+        taxable = qty * cost
+        igst = taxable * gst
+        return [names, hsn, units, qty, taxable, igst, igst / 2, igst / 2, taxable + igst]
+
+    days = rng.integers(0, 365, count)
+    dates = [datetime.combine(START_DATE + timedelta(days=int(day)), datetime.min.time()) for day in days]
+    serials = rng.integers(1, 10 ** 6, count)
+
+    if section == 'PURCHASE':
+        qty = rng.integers(1, 25, count)
+        incl = cost * (1 + gst)
+        discount = rng.choice([0, 5, 10], count)
+        unit_cost = cost * (1 - discount / 100)
+        taxable = qty * unit_cost
+        igst = taxable * gst
+        return [
+            dates, names, hsn, units, [f'PI-{serial}' for serial in serials], qty,
+            incl, cost, discount, unit_cost, gst, taxable, igst, igst / 2, igst / 2, taxable + igst
+        ]
+
+    if section == 'SALES':
+        qty = rng.integers(1, 4, count)
+        purchase_taxable = qty * cost
+        purchase_igst = purchase_taxable * gst
+        mrp_ex = mrp / (1 + gst)
+        discount = rng.choice([0, 0, 10, 20], count)
+        rate = mrp_ex * (1 - discount / 100)
+        taxable = qty * rate
+        igst = taxable * gst
+        return [
+            dates, names, hsn, units, [f'SI-{serial}' for serial in serials], qty,
+            cost, gst, purchase_taxable, purchase_igst, purchase_igst / 2, purchase_igst / 2,
+            purchase_taxable + purchase_igst, mrp, mrp_ex, discount, rate, gst,
+            taxable, igst, igst / 2, igst / 2, taxable + igst
+        ]
+
+    qty = rng.integers(1, 3, count)
+    taxable = qty * cost
+    igst = taxable * gst
+    return [
+        dates, names, hsn, units, [f'RV-{serial}' for serial in serials], qty,
+        cost, gst, taxable, igst, igst / 2, igst / 2, taxable + igst
+    ]
+
+def section_headers(section, rng):
+    """Return a section's header row; now and then one trailing amount caption is left blank."""
+    headers = list(app.SECTION_HEADERS[section])
+    if rng.random() < 0.5:
+        headers[-2] = None
+    return headers
+
+def iter_sheet_rows(rows, seed=0, prefix='Product'):
+    """Yield the raw STOCK DETAILS rows (tuples) of a workbook with about `rows` data rows."""
+    rng = np.random.default_rng(seed)
+    products = catalogue(rows, seed, prefix)
+    sizes = section_sizes(rows, products)
+
+    yield ('STOCK DETAILS',)
+    yield (f'Period: {START_DATE:%d-%m-%Y} to {START_DATE + timedelta(days=364):%d-%m-%Y}',)
+    yield ()
+    for section, title in app.SECTION_TITLES.items():
+        yield (title,)
+        yield tuple(section_headers(section, rng))
+        remaining = sizes[section]
+        while remaining > 0:
+            count = min(CHUNK_ROWS, remaining)
+            columns = section_chunk(section, count, products, rng)
+            yield from zip(*[column.tolist() if hasattr(column, 'tolist') else column for column in columns])
+            remaining -= count
+        yield ()
+        yield ()
+
+def build_sheet(rows, seed=0, prefix='Product'):
+    """Return the raw (header=None) frame of a generated sheet, as pd.read_excel would load it."""
+    return pd.DataFrame(list(iter_sheet_rows(rows, seed, prefix))).fillna(value=np.nan)
+
+def write_workbook(path, rows, seed=0, prefix='Product'):
+    """Stream a generated STOCK DETAILS sheet into a write-only .xlsx workbook at `path`."""
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('STOCK DETAILS')
+    for values in iter_sheet_rows(rows, seed, prefix):
+        worksheet.append(values)
+    workbook.save(path)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='Product', help='product name prefix')
+    args = parser.parse_args()
+    write_workbook(args.path, args.rows, args.seed, args.prefix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Fire parallel POS syncs at the same products and check that no balance update is lost.
+
+Needs a MySQL database configured through the usual DB_* variables (.env).
+The script creates a few throwaway products with an opening balance. It then
+sends concurrent /api/inventory/sync-pos batches for them and compares the
+final balance_stock quantities and sales row counts with what was sent.
+Requests go through the in-process Flask test client by default. With --url
+they go to a running server instead, e.g. several gunicorn workers.
+
+Usage:
+    python benchmarks/stress_pos_sync.py [--threads 8] [--requests 50] [--lines 5]
+                                         [--products 3] [--url http://localhost:5000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+OPENING_QTY = 100000
+
+def create_products(conn, run_id, count):
+    """Insert throwaway products with an opening balance and return their ids."""
+    cursor = conn.cursor()
+    now = datetime.now()
+    product_ids = []
+    for index in range(count):
+        product_id = str(uuid.uuid4())
+        cursor.execute(
+            "INSERT INTO products (id, name, hsn_code, unit, created_at) VALUES (%s, %s, %s, %s, %s)",
+            (product_id, f'stress-{run_id}-{index}', 'STRESS', 'PCS', now)
+        )
+        cursor.execute(
+            "INSERT INTO balance_stock (id, product_id, qty, created_at) VALUES (%s, %s, %s, %s)",
+            (str(uuid.uuid4()), product_id, OPENING_QTY, now)
+        )
+        product_ids.append(product_id)
+    conn.commit()
+    cursor.close()
+    return product_ids
+
+def remove_products(conn, product_ids):
+    cursor = conn.cursor()
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    for table in ('sales', 'balance_stock', 'product_cost_stats', 'stock_ledger'):
+        cursor.execute(f"DELETE FROM {table} WHERE product_id IN ({placeholders})", product_ids)
+    cursor.execute(f"DELETE FROM products WHERE id IN ({placeholders})", product_ids)
+    conn.commit()
+    cursor.close()
+
+def make_poster(url):
+    """Return a function that posts a sync payload and returns (status, body)."""
+    if url:
+        def post(payload):
+            request = urllib.request.Request(
+                url.rstrip('/') + '/api/inventory/sync-pos',
+                data=json.dumps(payload).encode(),
+                headers={'Content-Type': 'application/json'}
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    return response.status, json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                return e.code, json.loads(e.read() or b'{}')
+        return post
+
+    import app
+    local = threading.local()
+
+    def post(payload):
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        response = local.client.post('/api/inventory/sync-pos', json=payload)
+        return response.status_code, response.get_json()
+    return post
+
+def worker(post, product_ids, requests, lines, sent, failures, lock, seed):
+    rng = random.Random(seed)
+    sold = Counter()
+    line_count = Counter()
+    for _ in range(requests):
+        batch = []
+        for _ in range(lines):
+            product_id = rng.choice(product_ids)
+            qty = rng.randint(1, 3)
+            batch.append({'type': 'product', 'product_id': product_id, 'quantity': qty, 'price': 100})
+        status, body = post({'pos_sales': batch})
+        if status != 200 or body.get('errors'):
+            with lock:
+                failures.append((status, body))
+            continue
+        for line in batch:
+            sold[line['product_id']] += line['quantity']
+            line_count[line['product_id']] += 1
+    with lock:
+        sent['qty'].update(sold)
+        sent['lines'].update(line_count)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='sync requests per thread')
+    parser.add_argument('--lines', type=int, default=5, help='POS lines per request')
+    parser.add_argument('--products', type=int, default=3, help='products shared by all threads')
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated rows for inspection')
+    args = parser.parse_args()
+
+    import app
+
+    conn = app.get_db_connection()
+    if not conn:
+        sys.exit('Database connection failed')
+
+    run_id = uuid.uuid4().hex[:8]
+    product_ids = create_products(conn, run_id, args.products)
+    post = make_poster(args.url)
+    sent = {'qty': Counter(), 'lines': Counter()}
+    failures = []
+    lock = threading.Lock()
+
+    try:
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(post, product_ids, args.requests, args.lines, sent, failures, lock, index)
+            )
+            for index in range(args.threads)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        cursor.execute(f"SELECT product_id, qty FROM balance_stock WHERE product_id IN ({placeholders})", product_ids)
+        balances = {product_id: float(qty) for product_id, qty in cursor.fetchall()}
+        cursor.execute(
+            f"SELECT product_id, COUNT(*) FROM sales WHERE product_id IN ({placeholders}) GROUP BY product_id",
+            product_ids
+        )
+        sales_rows = dict(cursor.fetchall())
+        conn.commit()
+        cursor.close()
+
+        total_requests = args.threads * args.requests
+        print(
+            f"{total_requests} requests x {args.lines} lines on {args.threads} threads "
+            f"in {elapsed:.2f}s ({total_requests / elapsed:.1f} req/s), {len(failures)} failed"
+        )
+
+        mismatches = 0
+        for product_id in product_ids:
+            expected_qty = OPENING_QTY - sent['qty'][product_id]
+            expected_lines = sent['lines'][product_id]
+            actual_qty = balances.get(product_id)
+            actual_lines = sales_rows.get(product_id, 0)
+            ok = actual_qty == expected_qty and actual_lines == expected_lines
+            mismatches += not ok
+            print(
+                f"{'ok  ' if ok else 'FAIL'} {product_id} qty={actual_qty} (expected {expected_qty}) "
+                f"sales={actual_lines} (expected {expected_lines})"
+            )
+        for status, body in failures[:5]:
+            print(f"failed request: HTTP {status} {body}")
+    finally:
+        if not args.keep:
+            remove_products(conn, product_ids)
+        conn.close()
+
+    sys.exit(1 if mismatches or failures else 0)
+
+if __name__ == '__main__':
+    main()
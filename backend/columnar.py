@@ -0,0 +1,102 @@
+from datetime import date, datetime, time
+
+import numpy as np
+import pandas as pd
+
+# Optional encoders: their formats are offered only when the package is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.salon.columnar+json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+# ?format= values, for clients that cannot set Accept (e.g. plain download links)
+FORMATS = {'json': JSON, 'columnar': COLUMNAR_JSON, 'msgpack': MSGPACK, 'arrow': ARROW}
+MEDIA_ALIASES = {'application/x-msgpack': MSGPACK, 'application/vnd.apache.arrow.file': ARROW}
+
+
+def available_formats():
+    """Media types this process can produce, the plain JSON default first."""
+    offered = [JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        offered.append(MSGPACK)
+    if pa is not None:
+        offered.append(ARROW)
+    return offered
+
+
+def negotiate(accept, requested=None):
+    """
+    Pick the response media type from an explicit `requested` format name or
+    the Accept header (a werkzeug MIMEAccept), defaulting to plain JSON.
+    Returns None when the requested format's encoder is not installed and
+    raises ValueError for an unknown format name.
+    """
+    offered = available_formats()
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+        media_type = FORMATS[requested]
+        return media_type if media_type in offered else None
+
+    aliases = [alias for alias, media_type in MEDIA_ALIASES.items() if media_type in offered]
+    media_type = accept.best_match(offered + aliases, default=JSON)
+    return MEDIA_ALIASES.get(media_type, media_type)
+
+
+def column_values(series):
+    """A column as a list of Python values with every missing value as None."""
+    values = series.to_numpy(dtype=object, copy=True)
+    values[pd.isna(values)] = None
+    return values.tolist()
+
+
+def frame_columns(frame):
+    """
+    Column-oriented form of a frame: column names plus one value list per
+    column, built without materializing a dict per row.
+    """
+    return {
+        'columns': [str(column) for column in frame.columns],
+        'data': [column_values(frame[column]) for column in frame.columns],
+        'length': len(frame),
+    }
+
+
+def encode_value(value):
+    """msgpack `default` hook for values it does not know."""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def msgpack_body(payload):
+    return msgpack.packb(payload, default=encode_value, use_bin_type=True)
+
+
+def arrow_column(values):
+    """Build an Arrow array, falling back to strings for columns of mixed cell types."""
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def arrow_body(frame):
+    """Serialize one frame as an Arrow IPC stream."""
+    table = pa.table({str(column): arrow_column(column_values(frame[column])) for column in frame.columns})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeout(Error):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class PooledConnection:
+    """Proxy around a raw MySQL connection that returns it to the pool on close()."""
+
+    def __init__(self, pool, raw_conn, created_at):
+        self._pool = pool
+        self._conn = raw_conn
+        self._created_at = created_at
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        """Return the connection to the pool instead of closing the socket."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool._release(self._conn, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool.
+
+    Keeps up to `size` idle connections and allows `max_overflow` extra
+    connections under load, which are closed again when returned while the
+    idle set is full. Checked-out connections are pinged first when
+    `pre_ping` is set and replaced once they are older than `recycle` seconds.
+    """
+
+    def __init__(self, db_config, size=5, max_overflow=10, timeout=30.0,
+                 recycle=1800, pre_ping=True):
+        self.db_config = dict(db_config)
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._idle = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'invalidated': 0,
+            'acquire_time_total': 0.0,
+            'acquire_time_max': 0.0,
+            'wait_time_total': 0.0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.db_config)
+        with self._cond:
+            self._metrics['connects'] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _is_usable(self, conn, created_at):
+        """Check a connection before handing it out."""
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            self._discard(conn)
+            with self._cond:
+                self._metrics['recycled'] += 1
+            return False
+
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False, attempts=1)
+            except Error:
+                self._discard(conn)
+                with self._cond:
+                    self._metrics['invalidated'] += 1
+                return False
+
+        return True
+
+    def acquire(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to free up."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.size + self.max_overflow:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a database connection"
+                        )
+                    if not waited:
+                        waited = True
+                        self._metrics['waits'] += 1
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                else:
+                    conn, created_at = None, None
+                    self._open += 1
+
+            if conn is not None and not self._is_usable(conn, created_at):
+                # Free its slot and try the next idle connection before opening a new one
+                with self._cond:
+                    self._open -= 1
+                continue
+
+            if conn is None:
+                try:
+                    conn, created_at = self._connect()
+                except Error:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._metrics['checkouts'] += 1
+                self._metrics['acquire_time_total'] += elapsed
+                self._metrics['acquire_time_max'] = max(self._metrics['acquire_time_max'], elapsed)
+                if waited:
+                    self._metrics['wait_time_total'] += elapsed
+            return PooledConnection(self, conn, created_at)
+
+    def _release(self, conn, created_at):
+        """Reset a returned connection and put it back in the idle set (or close it)."""
+        keep = False
+        try:
+            if conn.is_connected():
+                if conn.in_transaction:
+                    conn.rollback()
+                keep = True
+        except Error:
+            keep = False
+
+        with self._cond:
+            if keep and len(self._idle) < self.size:
+                self._idle.append((conn, created_at))
+            else:
+                # Overflow or broken connection: give the slot back.
+                self._open -= 1
+                keep = False
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def close_all(self):
+        """Close every idle connection; checked-out connections close when released."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Return a snapshot of pool sizing and checkout metrics."""
+        with self._cond:
+            metrics = dict(self._metrics)
+            idle = len(self._idle)
+            open_conns = self._open
+
+        checkouts = metrics['checkouts']
+        return {
+            'size': self.size,
+            'max_overflow': self.max_overflow,
+            'open': open_conns,
+            'idle': idle,
+            'in_use': open_conns - idle,
+            'checkouts': checkouts,
+            'waits': metrics['waits'],
+            'timeouts': metrics['timeouts'],
+            'connects': metrics['connects'],
+            'recycled': metrics['recycled'],
+            'invalidated': metrics['invalidated'],
+            'acquire_ms_avg': round(metrics['acquire_time_total'] / checkouts * 1000, 3) if checkouts else 0.0,
+            'acquire_ms_max': round(metrics['acquire_time_max'] * 1000, 3),
+            'wait_ms_total': round(metrics['wait_time_total'] * 1000, 3),
+        }
@@ -0,0 +1,207 @@
+"""
+EXPLAIN the queries the app issues and fail if any of them does a full table scan,
+or if a keyset-paginated query sorts its rows instead of reading them in index order.
+
+Run it against a local MySQL/MariaDB database that has schema.sql and all
+migrations applied. With --seed ROWS it first fills the tables with synthetic
+rows, because on empty tables the optimizer may pick a scan anyway. The rows
+are removed again afterwards.
+
+    python explain_check.py [--seed 20000] [--allow QUERY_NAME ...]
+
+Exits with status 1 when a query uses a full scan (EXPLAIN type ALL), or when a
+query in KEYSET_QUERIES needs a filesort: such a query must read its page in index
+order so that LIMIT ends the read, otherwise every page sorts all matching rows.
+"""
+import argparse
+import random
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+
+import app
+
+SEED_HSN = 'EXPLAIN-SEED'
+
+# Queries whose ORDER BY ... LIMIT must be served by the index, without a filesort
+KEYSET_QUERIES = ('cash sales: first page', 'cash sales: next page')
+
+
+def by_ids(template, ids):
+    """Fill the {ids} placeholder list of a fetch_by_ids() template, as the app does per chunk."""
+    return template.format(ids=', '.join(['%s'] * len(ids))), list(ids)
+
+
+def hot_queries(sample):
+    """
+    Return (name, sql, params) for each query the app runs on a hot path. Every
+    statement comes from the app's own SQL builders, so the check follows the code.
+    """
+    product_id = sample['product_id']
+    filters = {'from': sample['from'], 'to': sample['to'], 'product_ids': [], 'hsn_codes': []}
+    product_filters = dict(filters, product_ids=[product_id])
+    ledger_start = {product_id: sample['from'].isoformat()}
+    lock, insert, update = app.conversion_queries([sample['sale_id']], datetime.now())
+
+    queries = [
+        ('cash sales: first page', *app.cash_sales_query(list(app.CASH_SALE_FIELDS), None, 501)),
+        ('cash sales: next page', *app.cash_sales_query(
+            list(app.CASH_SALE_FIELDS), (sample['to'].isoformat(), sample['sale_id']), 501
+        )),
+        ('conversion candidates: date range', *app.conversion_candidates_query(
+            {'from': sample['from'], 'to': sample['to']}
+        )),
+        ('conversion candidates: product', *app.conversion_candidates_query({'product_id': product_id})),
+        ('conversion: lock sales', *lock),
+        ('conversion: insert consumption', *insert),
+        ('conversion: mark sales', *update),
+        ('products by id', *by_ids(app.PRODUCTS_BY_ID_SQL, [product_id])),
+        ('products by name and hsn', *app.products_by_key_query([(sample['product_name'], SEED_HSN)])),
+        ('cost stats by product', *by_ids(app.COST_STATS_SQL, [product_id])),
+        ('sales by idempotency key', *by_ids(app.SALES_BY_IDEMPOTENCY_KEY_SQL, ['explain-key'])),
+        *[
+            (f'{table} by fingerprint', *by_ids(app.stored_rows_sql(section), ['0' * 40]))
+            for section, table in app.FINGERPRINT_TABLES.items()
+        ],
+        ('stock ledger: as of', *app.ledger_closing_query(sample['to'])),
+        ('stock ledger: product as of', *app.ledger_closing_query(
+            sample['to'], ' AND l.product_id IN (%s)', [product_id]
+        )),
+        ('stock ledger: previous day', *app.ledger_previous_days_query(ledger_start)),
+        ('stock ledger: recompute range', *app.ledger_range_query(ledger_start)),
+    ]
+    for name, sql in app.RECONCILE_SOURCES.items():
+        queries.append((f'reconcile {name}: product range', sql.format(products='product_id BETWEEN %s AND %s'),
+                        [product_id, product_id]))
+    for section in app.SECTION_TITLES:
+        if section != 'BALANCE':
+            queries.append((f'export {section.lower()}: date range', *app.export_query(section, filters)))
+        queries.append((f'export {section.lower()}: product', *app.export_query(section, product_filters)))
+    return queries
+
+
+def seed(conn, rows):
+    """Insert synthetic products and transactions; returns sample values for the queries."""
+    cursor = conn.cursor()
+    rng = random.Random(7)
+    now = datetime.now()
+    start = date.today() - timedelta(days=730)
+
+    product_count = max(10, rows // 20)
+    products = [(str(uuid.uuid4()), f'explain product {index}') for index in range(product_count)]
+    app.bulk_insert(cursor, 'products', ('id', 'name', 'hsn_code', 'unit', 'created_at'),
+                    [[product_id, name, SEED_HSN, 'PCS', now] for product_id, name in products])
+
+    def transactions():
+        for _ in range(rows):
+            product_id = rng.choice(products)[0]
+            yield str(uuid.uuid4()), product_id, start + timedelta(days=rng.randrange(730)), rng.randint(1, 5)
+
+    app.bulk_insert(cursor, 'purchases', ('id', 'product_id', 'date', 'invoice_no', 'qty', 'created_at'),
+                    [[row_id, product_id, day, 'SEED', qty, now] for row_id, product_id, day, qty in transactions()])
+    sales = [
+        [row_id, product_id, day, 'SEED', qty, rng.choice(['cash', 'card']), now]
+        for row_id, product_id, day, qty in transactions()
+    ]
+    app.bulk_insert(cursor, 'sales', ('id', 'product_id', 'date', 'invoice_no', 'qty', 'payment_method', 'created_at'),
+                    sales)
+    app.bulk_insert(cursor, 'consumption', ('id', 'product_id', 'date', 'qty', 'created_at'),
+                    [[row_id, product_id, day, qty, now] for row_id, product_id, day, qty in transactions()])
+    app.bulk_insert(cursor, 'balance_stock', ('id', 'product_id', 'qty', 'created_at'),
+                    [[str(uuid.uuid4()), product_id, 0, now] for product_id, _ in products])
+    for chunk in app.chunked([product_id for product_id, _ in products], app.LEDGER_RECOMPUTE_CHUNK):
+        app.backfill_stock_ledger(cursor, chunk)
+    conn.commit()
+
+    for table in ('products', 'purchases', 'sales', 'consumption', 'balance_stock', 'stock_ledger'):
+        cursor.execute(f"ANALYZE TABLE {table}")
+        cursor.fetchall()
+    cursor.close()
+
+    return {
+        'product_id': products[0][0],
+        'product_name': products[0][1],
+        'sale_id': sales[0][0],
+        'from': date.today() - timedelta(days=30),
+        'to': date.today(),
+    }
+
+
+def unseed(conn):
+    cursor = conn.cursor()
+    for table in ('purchases', 'sales', 'consumption', 'balance_stock', 'product_cost_stats', 'stock_ledger'):
+        cursor.execute(
+            f"DELETE t FROM {table} t JOIN products p ON t.product_id = p.id WHERE p.hsn_code = %s", (SEED_HSN,)
+        )
+    cursor.execute("DELETE FROM products WHERE hsn_code = %s", (SEED_HSN,))
+    conn.commit()
+    cursor.close()
+
+
+def existing_sample(conn):
+    """Pick sample parameter values from whatever data is already in the database."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name FROM products LIMIT 1")
+    product = cursor.fetchone() or (str(uuid.uuid4()), 'none')
+    cursor.execute("SELECT id FROM sales LIMIT 1")
+    sale = cursor.fetchone() or (str(uuid.uuid4()),)
+    cursor.close()
+    return {
+        'product_id': product[0],
+        'product_name': product[1],
+        'sale_id': sale[0],
+        'from': date.today() - timedelta(days=30),
+        'to': date.today(),
+    }
+
+
+def explain(conn, sql, params):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"EXPLAIN {sql}", params)
+    plan = cursor.fetchall()
+    cursor.close()
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seed', type=int, metavar='ROWS', help='seed this many rows per transaction table first')
+    parser.add_argument('--allow', action='append', default=[], metavar='QUERY_NAME',
+                        help='query name allowed to scan (repeatable)')
+    args = parser.parse_args()
+
+    conn = app.get_db_connection()
+    if not conn:
+        sys.exit('Database connection failed')
+
+    failures = 0
+    try:
+        sample = seed(conn, args.seed) if args.seed else existing_sample(conn)
+        for name, sql, params in hot_queries(sample):
+            plan = explain(conn, sql, params)
+            # The target table of an INSERT ... SELECT is listed with type ALL but is not read
+            scans = [
+                step['table'] for step in plan
+                if str(step.get('type')).upper() == 'ALL' and str(step.get('select_type')).upper() != 'INSERT'
+            ]
+            sorts = name in KEYSET_QUERIES and any('Using filesort' in (step.get('Extra') or '') for step in plan)
+            allowed = name in args.allow
+            if (scans or sorts) and not allowed:
+                failures += 1
+            status = 'SCAN' if scans else 'SORT' if sorts else 'ok'
+            if (scans or sorts) and allowed:
+                status = 'allowed'
+            keys = ', '.join(f"{step['table']}:{step.get('key') or '-'}" for step in plan)
+            print(f"{status:<8} {name:<40} {keys}")
+    finally:
+        if args.seed:
+            unseed(conn)
+        conn.close()
+
+    if failures:
+        print(f"{failures} quer{'y' if failures == 1 else 'ies'} with a full table scan or filesort", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class JobQueueFull(Exception):
+    """Raised when the background import queue has no room for another job."""
+
+
+class ImportProgress:
+    """
+    Per-section row counters and per-stage timings for one import.
+
+    `on_change` is called with a snapshot whenever progress moves, at most
+    once every `min_interval` seconds unless the update is forced. `on_stage`,
+    if set, is called with (stage, seconds) each time a stage finishes.
+    """
+
+    def __init__(self, on_change=None, min_interval=0.5, on_stage=None):
+        self.on_change = on_change
+        self.on_stage = on_stage
+        self.min_interval = min_interval
+        self.sections = {}
+        self.timings = {}
+        self.stage_name = None
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; repeated stages (e.g. per batch) accumulate."""
+        started = time.perf_counter()
+        with self._lock:
+            self.stage_name = name
+        self._report()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.timings[name] = round(self.timings.get(name, 0.0) + elapsed, 4)
+            if self.on_stage:
+                self.on_stage(name, elapsed)
+
+    def _section(self, section):
+        return self.sections.setdefault(section, {'parsed': 0, 'written': 0})
+
+    def parsed(self, section, rows):
+        with self._lock:
+            self._section(section)['parsed'] += rows
+        self._report()
+
+    def written(self, section, rows):
+        with self._lock:
+            self._section(section)['written'] += rows
+        self._report()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stage': self.stage_name,
+                'sections': {name: dict(counts) for name, counts in self.sections.items()},
+                'timings': dict(self.timings),
+            }
+
+    def _report(self, force=False):
+        if not self.on_change:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < self.min_interval:
+            return
+        self._last_report = now
+        self.on_change(self.snapshot())
+
+    def flush(self):
+        """Report the current progress regardless of throttling."""
+        self._report(force=True)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    SQLite-backed job records, so job state survives process restarts.
+
+    Each job records its owner (host and pid) and a heartbeat that the owning
+    process refreshes while the job is queued or running. Several processes
+    can share one store: a job is only failed as interrupted once its owner is
+    gone or its heartbeat is older than `stale_after` seconds.
+    """
+
+    # Added after the first release; existing stores get them on open
+    OWNER_COLUMNS = (('owner_host', 'TEXT'), ('owner_pid', 'INTEGER'), ('heartbeat_at', 'REAL'))
+
+    def __init__(self, path, stale_after=120):
+        self.path = path
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS import_jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+                """
+            )
+            existing = {row[1] for row in db.execute("PRAGMA table_info(import_jobs)")}
+            for name, column_type in self.OWNER_COLUMNS:
+                if name not in existing:
+                    db.execute(f"ALTER TABLE import_jobs ADD COLUMN {name} {column_type}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._connect() as db:
+            db.execute(sql, params)
+
+    def create(self, job_id, kind, filename):
+        # The pid is read per call: worker processes may be forked after the store is opened
+        self._execute(
+            """
+            INSERT INTO import_jobs (id, kind, status, filename, created_at, owner_host, owner_pid, heartbeat_at)
+            VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)
+            """,
+            (
+                job_id, kind, filename, datetime.now().isoformat(timespec='seconds'),
+                socket.gethostname(), os.getpid(), time.time()
+            )
+        )
+
+    def heartbeat(self, job_ids):
+        """Refresh the heartbeat of jobs this process is still working on."""
+        if not job_ids:
+            return
+        placeholders = ', '.join(['?'] * len(job_ids))
+        self._execute(
+            f"UPDATE import_jobs SET heartbeat_at = ? WHERE id IN ({placeholders})",
+            (time.time(), *job_ids)
+        )
+
+    def mark_running(self, job_id):
+        self._execute(
+            "UPDATE import_jobs SET status = 'running', started_at = ? WHERE id = ?",
+            (datetime.now().isoformat(timespec='seconds'), job_id)
+        )
+
+    def update_progress(self, job_id, progress):
+        self._execute(
+            "UPDATE import_jobs SET progress = ? WHERE id = ?",
+            (json.dumps(progress), job_id)
+        )
+
+    def finish(self, job_id, status, progress=None, result=None, error=None):
+        self._execute(
+            """
+            UPDATE import_jobs
+            SET status = ?, progress = COALESCE(?, progress), result = ?, error = ?, finished_at = ?
+            WHERE id = ?
+            """,
+            (
+                status,
+                json.dumps(progress) if progress is not None else None,
+                json.dumps(result) if result is not None else None,
+                error,
+                datetime.now().isoformat(timespec='seconds'),
+                job_id
+            )
+        )
+
+    def _owner_gone(self, host, pid, heartbeat_at, now):
+        if heartbeat_at is None or now - heartbeat_at > self.stale_after:
+            return True
+        # A process on this host that has exited needs no heartbeat timeout
+        return host == socket.gethostname() and pid is not None and not process_alive(pid)
+
+    def fail_interrupted(self):
+        """
+        Mark queued or running jobs whose owning process has exited, or whose
+        heartbeat went stale, as failed. Returns the number of jobs failed.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            rows = db.execute(
+                "SELECT id, owner_host, owner_pid, heartbeat_at FROM import_jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            orphaned = [job_id for job_id, host, pid, heartbeat_at in rows if self._owner_gone(host, pid, heartbeat_at, now)]
+            for job_id in orphaned:
+                db.execute(
+                    """
+                    UPDATE import_jobs
+                    SET status = 'failed', error = 'Interrupted: the server process running it stopped', finished_at = ?
+                    WHERE id = ? AND status IN ('queued', 'running')
+                    """,
+                    (datetime.now().isoformat(timespec='seconds'), job_id)
+                )
+            return len(orphaned)
+
+    def get(self, job_id):
+        with self._lock, self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        for field in ('progress', 'result'):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+
+class JobRunner:
+    """
+    Bounded background worker pool for import jobs.
+
+    At most `workers` jobs run at once and at most `max_pending` may be queued
+    or running; further submissions raise JobQueueFull. While jobs are pending
+    their heartbeat is refreshed every `heartbeat_interval` seconds.
+    """
+
+    def __init__(self, store, workers=2, max_pending=8, heartbeat_interval=15):
+        self.store = store
+        self.max_pending = max_pending
+        self.heartbeat_interval = heartbeat_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import-job')
+        self._pending = 0
+        self._active = set()
+        self._heartbeat_thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_heartbeat(self):
+        # Started on first use rather than in __init__, so it runs in the process that owns the jobs
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = threading.Thread(
+                target=self._heartbeat_loop, name='import-job-heartbeat', daemon=True
+            )
+            self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                self.store.heartbeat(job_ids)
+            except sqlite3.Error as e:
+                print(f"Error refreshing import job heartbeats: {e}")
+
+    def submit(self, kind, filename, func, *args, cleanup_path=None):
+        """
+        Queue `func(*args, progress=ImportProgress)` and return the new job id.
+        The function's return value is stored as the job result. `cleanup_path`
+        is removed once the job finishes, whatever the outcome.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"Import queue is full ({self.max_pending} jobs pending)")
+            self._pending += 1
+            self._ensure_heartbeat()
+
+        job_id = str(uuid.uuid4())
+        try:
+            self.store.create(job_id, kind, filename)
+            with self._lock:
+                self._active.add(job_id)
+            self._executor.submit(self._run, job_id, func, args, cleanup_path)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._active.discard(job_id)
+            raise
+        return job_id
+
+    def _run(self, job_id, func, args, cleanup_path):
+        progress = ImportProgress(on_change=lambda snapshot: self.store.update_progress(job_id, snapshot))
+        try:
+            self.store.mark_running(job_id)
+            result = func(*args, progress=progress)
+            self.store.finish(job_id, 'completed', progress=progress.snapshot(), result=result)
+        except Exception as e:
+            self.store.finish(job_id, 'failed', progress=progress.snapshot(), error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._active.discard(job_id)
+            if cleanup_path:
+                try:
+                    os.remove(cleanup_path)
+                except OSError:
+                    pass
+
+    def pending(self):
+        with self._lock:
+            return self._pending
@@ -0,0 +1,139 @@
+import dataclasses
+import decimal
+import json
+import math
+import re
+import uuid
+from datetime import date, datetime, time
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import JSONProvider
+
+# Optional: a much faster encoder with the same output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+# The standard library writes non-finite floats as bare NaN/Infinity tokens; string literals are matched
+# first so that text inside them is left alone
+NON_FINITE = re.compile(r'("(?:[^"\\]|\\.)*")|-?Infinity|NaN')
+
+FRAGMENT_TOKEN = '\x00json-fragment-{}\x00'
+
+
+def frame_records(frame):
+    """Encode a DataFrame as a JSON array of row objects with pandas' C encoder (missing cells are null)."""
+    return frame.to_json(orient='records', date_format='iso', date_unit='s', double_precision=15,
+                         default_handler=str)
+
+
+def to_builtin(value):
+    """JSON-ready form of a value the encoders do not handle natively. Raises TypeError otherwise."""
+    if isinstance(value, np.generic):
+        value = value.item()
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        if not isinstance(value, (datetime, date, time)):
+            return value
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        # Kept as a string, like Flask's default, so amounts are never rounded through a float
+        return str(value)
+    if isinstance(value, (np.ndarray, pd.Series, pd.Index)):
+        return value.tolist()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def orjson_default(value):
+    if isinstance(value, pd.DataFrame):
+        return orjson.Fragment(frame_records(value))
+    return to_builtin(value)
+
+
+def stdlib_dumps(obj, **kwargs):
+    """Standard library encoding with the same output as the orjson path."""
+    fragments = []
+
+    def default(value):
+        if isinstance(value, pd.DataFrame):
+            fragments.append(frame_records(value))
+            return FRAGMENT_TOKEN.format(len(fragments) - 1)
+        return to_builtin(value)
+
+    kwargs.setdefault('ensure_ascii', False)
+    kwargs.setdefault('separators', (',', ':'))
+    text = json.dumps(obj, default=default, **kwargs)
+    if 'NaN' in text or 'Infinity' in text:
+        text = NON_FINITE.sub(lambda match: match.group(1) or 'null', text)
+    for index, fragment in enumerate(fragments):
+        text = text.replace(json.dumps(FRAGMENT_TOKEN.format(index)), fragment, 1)
+    return text
+
+
+class FastJSONProvider(JSONProvider):
+    """
+    JSON provider for the app: orjson when it is installed, the standard library
+    otherwise, with identical output. Dates and times are ISO 8601, Decimals
+    strings, NumPy values plain numbers, NaN/NaT/infinity null, and DataFrames
+    lists of row objects encoded by pandas. Keys keep their insertion order.
+    """
+
+    mimetype = 'application/json'
+
+    def encode(self, obj):
+        """Encode `obj` as UTF-8 JSON bytes."""
+        if orjson is not None:
+            return orjson.dumps(obj, default=orjson_default, option=ORJSON_OPTIONS)
+        return stdlib_dumps(obj).encode()
+
+    def dumps(self, obj, **kwargs):
+        # Formatting options such as indent are only understood by the standard library path
+        if orjson is not None and not kwargs:
+            return self.encode(obj).decode()
+        return stdlib_dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
+
+    def stream(self, items, ndjson=False, chunk_size=1000):
+        """
+        Encode an iterable piece by piece for a streamed response: a JSON array,
+        or one item per line with `ndjson`. Each piece holds `chunk_size` items.
+        """
+        items = iter(items)
+        separator = '\n' if ndjson else ','
+        if not ndjson:
+            yield '['
+        first = True
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+            body = separator.join(self.dumps(item) for item in chunk)
+            if ndjson:
+                yield body + '\n'
+            else:
+                yield body if first else ',' + body
+            first = False
+        if not ndjson:
+            yield ']'
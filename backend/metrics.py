@@ -0,0 +1,158 @@
+import bisect
+import threading
+import time
+
+# Bucket upper bounds; imports of large workbooks run for minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))  # 1 KiB .. 256 MiB
+QUANTILES = (0.5, 0.95, 0.99)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class NullSpan:
+    """Stand-in for Span while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """Context manager that observes its elapsed time into a histogram."""
+
+    __slots__ = ('histogram', 'label_values', 'started')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        return False
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label combination, as Prometheus expects,
+    with p50/p95/p99 estimated from the buckets. Observing does nothing while
+    the histogram is disabled.
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS, enabled=True):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values):
+        """Return a context manager that observes the time spent inside it."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, label_values)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def estimate_quantile(self, q, counts, count):
+        """Interpolate the q-quantile within the bucket holding it (like histogram_quantile())."""
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return float(self.buckets[-1])
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return float(self.buckets[-1])
+
+    def quantiles(self, *label_values):
+        """Return {q: estimate} for one label combination."""
+        counts, _, count = self.snapshot().get(label_values, ([0] * (len(self.buckets) + 1), 0.0, 0))
+        return {q: self.estimate_quantile(q, counts, count) for q in QUANTILES}
+
+    def render(self):
+        """Return the exposition lines of the histogram and its quantile estimates."""
+        series = sorted(self.snapshot().items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, label_values, [('le', format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+
+        estimate = f'{self.name}_quantile'
+        lines.append(f'# HELP {estimate} p50/p95/p99 of {self.name} estimated from its buckets')
+        lines.append(f'# TYPE {estimate} gauge')
+        for label_values, (counts, _, count) in series:
+            for q in QUANTILES:
+                labels = format_labels(self.labels, label_values, [('quantile', q)])
+                lines.append(f'{estimate}{labels} {format_value(round(self.estimate_quantile(q, counts, count), 6))}')
+        return lines
+
+
+class MetricsRegistry:
+    """The process's histograms, rendered together in the Prometheus text format."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        histogram = Histogram(name, documentation, labels, buckets, enabled=self.enabled)
+        self._metrics.append(histogram)
+        return histogram
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
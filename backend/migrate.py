@@ -0,0 +1,138 @@
+"""
+Apply the versioned SQL migrations in migrations/ to the configured database.
+
+Each migrations/NNNN_name.sql file is applied once, in version order, and
+recorded in the schema_migrations table. Run it after loading schema.sql and
+after every upgrade:
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending migrations
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+
+import mysql.connector
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# The statement's change is already in place: a table, column or index that already
+# exists (schema.sql creates some objects a migration adds to older databases), or an
+# index or column to drop that is already gone (a partial apply or a manual drop).
+# Such statements are skipped, so re-running a migration is safe.
+ALREADY_APPLIED_ERRORS = (1050, 1060, 1061, 1091)
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Return (version, name, path) for every migration file, ordered by version."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError('Duplicate migration version numbers')
+    return migrations
+
+
+def split_statements(sql):
+    """Split a migration file into statements (comment lines dropped, split on ';')."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def ensure_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+        """
+    )
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, directory=MIGRATIONS_DIR, log=print):
+    """
+    Apply pending migrations in order and return the versions applied.
+
+    MySQL commits DDL implicitly, so a migration is recorded only once all
+    its statements succeed. A failed migration stops the run and must be
+    fixed (or finished by hand) before migrating again. Statements whose
+    change is already in place (an object to create exists, or an index or
+    column to drop is gone) are skipped.
+    """
+    cursor = conn.cursor()
+    ensure_table(cursor)
+    done = applied_versions(cursor)
+
+    applied = []
+    for version, name, path in discover(directory):
+        if version in done:
+            continue
+        log(f"applying {version:04d}_{name}")
+        with open(path, encoding='utf-8') as handle:
+            statements = split_statements(handle.read())
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except mysql.connector.Error as e:
+                if e.errno not in ALREADY_APPLIED_ERRORS:
+                    raise
+                log(f"  skipped, already applied: {e.msg}")
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+            (version, name, datetime.now())
+        )
+        conn.commit()
+        applied.append(version)
+
+    cursor.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--status', action='store_true', help='list migrations without applying them')
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = mysql.connector.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        database=os.getenv('DB_NAME', 'salon_inventory'),
+        user=os.getenv('DB_USER', 'root'),
+        password=os.getenv('DB_PASSWORD', ''),
+    )
+    try:
+        if args.status:
+            cursor = conn.cursor()
+            ensure_table(cursor)
+            done = applied_versions(cursor)
+            for version, name, _ in discover():
+                print(f"{'applied' if version in done else 'pending'}  {version:04d}_{name}")
+            return
+
+        applied = migrate(conn)
+        print(f"{len(applied)} migration(s) applied" if applied else 'Database is up to date')
+    except mysql.connector.Error as e:
+        print(f"Migration failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+-- Composite indexes for the hot access paths
+
+-- Cash sales listing: unconverted cash sales in (date, id) keyset order
+DROP INDEX idx_sales_payment_conversion ON sales;
+CREATE INDEX idx_sales_cash_keyset ON sales (payment_method, converted_to_consumption, date, id);
+
+-- Per-product history (cost stats rebuild, reconciliation) in date order
+CREATE INDEX idx_purchases_product_date ON purchases (product_id, date);
+CREATE INDEX idx_sales_product_date ON sales (product_id, date);
+CREATE INDEX idx_consumption_product_date ON consumption (product_id, date);
+
+-- Date-range scans (exports, period reports, conversion by date)
+CREATE INDEX idx_purchases_date ON purchases (date, id);
+CREATE INDEX idx_sales_date ON sales (date, id);
+CREATE INDEX idx_consumption_date ON consumption (date, id);
@@ -0,0 +1,20 @@
+-- Per-product, per-day stock ledger maintained by every write path
+-- (backfill existing history with: flask --app app backfill-stock-ledger)
+
+CREATE TABLE IF NOT EXISTS stock_ledger (
+    product_id VARCHAR(36) NOT NULL,
+    date DATE NOT NULL,
+    opening_qty DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    in_qty DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    out_qty DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    consumed_qty DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    closing_qty DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    in_value DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    out_value DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_id, date),
+    FOREIGN KEY (product_id) REFERENCES products(id)
+);
+
+-- Period summaries across all products read a date range
+CREATE INDEX idx_stock_ledger_date ON stock_ledger (date, product_id);
@@ -0,0 +1,11 @@
+-- Content fingerprints of imported workbook rows, so delta imports can skip rows already stored
+-- (rows written outside Excel imports, e.g. POS syncs and conversions, keep NULL)
+
+ALTER TABLE purchases ADD COLUMN row_fingerprint CHAR(40) NULL;
+CREATE UNIQUE INDEX idx_purchases_row_fingerprint ON purchases (row_fingerprint);
+
+ALTER TABLE sales ADD COLUMN row_fingerprint CHAR(40) NULL;
+CREATE UNIQUE INDEX idx_sales_row_fingerprint ON sales (row_fingerprint);
+
+ALTER TABLE consumption ADD COLUMN row_fingerprint CHAR(40) NULL;
+CREATE UNIQUE INDEX idx_consumption_row_fingerprint ON consumption (row_fingerprint);
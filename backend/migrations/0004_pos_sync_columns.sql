@@ -0,0 +1,50 @@
+-- Tables and columns the batched, idempotent POS sync relies on, for databases created
+-- from schema.sql before they existed. Fresh installs already have them from schema.sql;
+-- migrate.py skips statements whose table, column or index is already present.
+-- (fill the cost table for existing purchases with: flask --app app rebuild-cost-stats)
+
+-- Running purchase sums per product, read by POS sync instead of aggregating purchases
+CREATE TABLE IF NOT EXISTS product_cost_stats (
+    product_id VARCHAR(36) PRIMARY KEY,
+    purchase_count INT NOT NULL DEFAULT 0,
+    ex_gst_count INT NOT NULL DEFAULT 0,
+    sum_ex_gst DECIMAL(18, 4) NOT NULL DEFAULT 0,
+    gst_rate_count INT NOT NULL DEFAULT 0,
+    sum_gst_rate DECIMAL(20, 8) NOT NULL DEFAULT 0,
+    total_qty DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    total_taxable_value DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    total_igst DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id)
+);
+
+-- Purchase cost and sales price breakdown stored with every POS sale line
+ALTER TABLE sales
+    ADD COLUMN purchase_cost_per_unit_ex_gst DECIMAL(10, 2) DEFAULT 0 AFTER consumption_id,
+    ADD COLUMN purchase_gst_percentage DECIMAL(10, 4) DEFAULT 0 AFTER purchase_cost_per_unit_ex_gst,
+    ADD COLUMN purchase_taxable_value DECIMAL(10, 2) DEFAULT 0 AFTER purchase_gst_percentage,
+    ADD COLUMN purchase_igst DECIMAL(10, 2) DEFAULT 0 AFTER purchase_taxable_value,
+    ADD COLUMN purchase_cgst DECIMAL(10, 2) DEFAULT 0 AFTER purchase_igst,
+    ADD COLUMN purchase_sgst DECIMAL(10, 2) DEFAULT 0 AFTER purchase_cgst,
+    ADD COLUMN total_purchase_cost DECIMAL(10, 2) DEFAULT 0 AFTER purchase_sgst,
+    ADD COLUMN mrp_incl_gst DECIMAL(10, 2) DEFAULT 0 AFTER total_purchase_cost,
+    ADD COLUMN mrp_ex_gst DECIMAL(10, 2) DEFAULT 0 AFTER mrp_incl_gst,
+    ADD COLUMN discount_percentage DECIMAL(5, 2) DEFAULT 0 AFTER mrp_ex_gst,
+    ADD COLUMN discounted_sales_rate_ex_gst DECIMAL(10, 2) DEFAULT 0 AFTER discount_percentage,
+    ADD COLUMN sales_gst_percentage DECIMAL(10, 4) DEFAULT 0 AFTER discounted_sales_rate_ex_gst,
+    ADD COLUMN sales_taxable_value DECIMAL(10, 2) DEFAULT 0 AFTER sales_gst_percentage,
+    ADD COLUMN sales_igst DECIMAL(10, 2) DEFAULT 0 AFTER sales_taxable_value,
+    ADD COLUMN sales_cgst DECIMAL(10, 2) DEFAULT 0 AFTER sales_igst,
+    ADD COLUMN sales_sgst DECIMAL(10, 2) DEFAULT 0 AFTER sales_cgst;
+
+-- Stock value kept next to the quantity, changed by the same atomic increments
+ALTER TABLE balance_stock
+    ADD COLUMN taxable_value DECIMAL(12, 2) DEFAULT 0 AFTER qty,
+    ADD COLUMN igst DECIMAL(12, 2) DEFAULT 0 AFTER taxable_value,
+    ADD COLUMN cgst DECIMAL(12, 2) DEFAULT 0 AFTER igst,
+    ADD COLUMN sgst DECIMAL(12, 2) DEFAULT 0 AFTER cgst,
+    ADD COLUMN invoice_value DECIMAL(12, 2) DEFAULT 0 AFTER sgst;
+
+-- Client-supplied key per POS line, so a retried sync batch is not stored twice
+ALTER TABLE sales ADD COLUMN idempotency_key VARCHAR(100) DEFAULT NULL AFTER sales_sgst;
+CREATE UNIQUE INDEX idempotency_key_unique ON sales (idempotency_key);
@@ -0,0 +1,6 @@
+-- Unconverted sales are matched with converted_to_consumption = 0 only. With NULLs allowed,
+-- the "= 0 OR IS NULL" filter read two ranges of idx_sales_cash_keyset (ref_or_null), whose
+-- rows are not in (date, id) order, so every cash sales page sorted all unconverted sales
+
+UPDATE sales SET converted_to_consumption = 0 WHERE converted_to_consumption IS NULL;
+ALTER TABLE sales MODIFY converted_to_consumption BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def payload_size(payload):
+    """Approximate the in-memory size of a parsed payload (a dict of DataFrames) in bytes."""
+    total = 0
+    for value in payload.values():
+        if isinstance(value, pd.DataFrame):
+            total += int(value.memory_usage(index=True, deep=True).sum())
+    return total
+
+
+class ParseCache:
+    """
+    Cache of parsed workbook payloads keyed by the SHA-256 of the uploaded
+    bytes and the parser version.
+
+    The memory tier is an LRU bounded by both entry count and an approximate
+    byte budget. When `cache_dir` is set, payloads are also pickled to disk
+    (bounded by `disk_max_bytes`, oldest files evicted first) and promoted back
+    into memory on a disk hit. Cached payloads are shared between requests and
+    must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=256 * 1024 * 1024, cache_dir=None,
+                 disk_max_bytes=1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, version):
+        """Build the cache key for the raw upload bytes and a parser version."""
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{version}-{digest}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached payload for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry[0]
+
+        payload = self._read_disk(key)
+
+        with self._lock:
+            if payload is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            self._counters['disk_hits'] += 1
+            self._store(key, payload, payload_size(payload))
+        return payload
+
+    def put(self, key, payload):
+        """Cache a freshly parsed payload in memory and, if configured, on disk."""
+        size = payload_size(payload)
+        with self._lock:
+            self._store(key, payload, size)
+        self._write_disk(key, payload)
+
+    def _store(self, key, payload, size):
+        if size > self.max_bytes:
+            # Too large for the memory tier; the disk tier may still keep it
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+
+        self._entries[key] = (payload, size)
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters['evictions'] += 1
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as handle:
+                payload = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # Touch the file so disk eviction stays least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def _write_disk(self, key, payload):
+        if not self.cache_dir:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as handle:
+                pickle.dump(payload, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing parse cache entry: {e}")
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            files = [
+                entry for entry in os.scandir(self.cache_dir)
+                if entry.is_file() and entry.name.endswith('.pkl')
+            ]
+        except OSError:
+            return
+
+        # DirEntry caches its stat() result, so sizes stay valid after removal
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in files)
+        for entry in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= entry.stat().st_size
+
+    def clear(self):
+        """Drop every in-memory entry (disk entries are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and current memory usage."""
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            used = self._bytes
+
+        lookups = counters['hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': entries,
+            'bytes': used,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'disk_enabled': bool(self.cache_dir),
+        }
@@ -0,0 +1,149 @@
+import heapq
+import re
+import time
+
+# Literals and placeholder lists are folded so that statements differing only
+# in their values (or IN-list / VALUES-list lengths) normalize to the same text
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+NUMBER_LITERAL = re.compile(r'(?<![\w.])\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+REPEATED_GROUP = re.compile(r'(\([^()]*\))(?:\s*(,|OR|AND)\s*\1)+', re.IGNORECASE)
+
+
+def normalize_statement(sql):
+    """Reduce a statement to its shape: literals and placeholders become ?, repeated lists collapse."""
+    text = ' '.join(str(sql).split())
+    text = STRING_LITERAL.sub('?', text)
+    text = NUMBER_LITERAL.sub('?', text)
+    text = text.replace('%s', '?')
+    text = PLACEHOLDER_LIST.sub('(?+)', text)
+    return REPEATED_GROUP.sub(lambda match: f"{match.group(1)} {match.group(2).upper()} ...", text)
+
+
+class QueryStats:
+    """Statement count, DB time, rows fetched and slowest statements of one unit of work (a request)."""
+
+    def __init__(self, slowest=5):
+        self.statements = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.by_statement = {}
+        self._slowest_limit = slowest
+        self._slowest = []
+
+    def record(self, sql, seconds):
+        """Record one executed statement and how long it took."""
+        normalized = normalize_statement(sql)
+        self.statements += 1
+        self.seconds += seconds
+
+        entry = self.by_statement.setdefault(normalized, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+        item = (seconds, self.statements, normalized)
+        if len(self._slowest) < self._slowest_limit:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def fetched(self, rows, seconds=0.0):
+        """Record rows read from a result set (and the time spent reading them)."""
+        self.rows += rows
+        self.seconds += seconds
+
+    def repeated(self, threshold):
+        """Return (normalized statement, count) for statements run more than `threshold` times."""
+        return sorted(
+            ((statement, count) for statement, (count, _) in self.by_statement.items() if count > threshold),
+            key=lambda item: -item[1]
+        )
+
+    def slowest(self):
+        return [
+            {'statement': statement, 'ms': round(seconds * 1000, 2)}
+            for seconds, _, statement in sorted(self._slowest, reverse=True)
+        ]
+
+    def summary(self):
+        return {
+            'statements': self.statements,
+            'db_time_ms': round(self.seconds * 1000, 2),
+            'rows': self.rows,
+            'distinct_statements': len(self.by_statement),
+            'slowest': self.slowest(),
+        }
+
+
+class InstrumentedCursor:
+    """Cursor proxy that reports every execute and fetch to the current QueryStats."""
+
+    def __init__(self, cursor, stats_for):
+        self._cursor = cursor
+        self._stats_for = stats_for
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed(self, sql, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(sql, *args, **kwargs)
+        finally:
+            stats = self._stats_for()
+            if stats is not None:
+                stats.record(sql, time.perf_counter() - started)
+
+    def execute(self, sql, *args, **kwargs):
+        return self._timed(sql, self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return self._timed(sql, self._cursor.executemany, *args, **kwargs)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        stats = self._stats_for()
+        if stats is not None:
+            count = len(rows) if isinstance(rows, list) else int(rows is not None)
+            stats.fetched(count, time.perf_counter() - started)
+        return rows
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class InstrumentedConnection:
+    """
+    Connection proxy whose cursors report to the QueryStats returned by
+    `stats_for()` at the time of each call (None disables recording).
+    """
+
+    def __init__(self, conn, stats_for):
+        self._conn = conn
+        self._stats_for = stats_for
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._stats_for)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -51,12 +51,30 @@ CREATE TABLE IF NOT EXISTS sales (
     customer VARCHAR(255) DEFAULT '',
     payment_method ENUM('cash', 'card', 'online', 'other') DEFAULT 'cash',
     transaction_type ENUM('sale') DEFAULT 'sale',
-    converted_to_consumption BOOLEAN DEFAULT FALSE,
+    converted_to_consumption BOOLEAN NOT NULL DEFAULT FALSE,
     converted_at DATETIME DEFAULT NULL,
     consumption_id VARCHAR(36) DEFAULT NULL,
+    purchase_cost_per_unit_ex_gst DECIMAL(10, 2) DEFAULT 0,
+    purchase_gst_percentage DECIMAL(10, 4) DEFAULT 0,
+    purchase_taxable_value DECIMAL(10, 2) DEFAULT 0,
+    purchase_igst DECIMAL(10, 2) DEFAULT 0,
+    purchase_cgst DECIMAL(10, 2) DEFAULT 0,
+    purchase_sgst DECIMAL(10, 2) DEFAULT 0,
+    total_purchase_cost DECIMAL(10, 2) DEFAULT 0,
+    mrp_incl_gst DECIMAL(10, 2) DEFAULT 0,
+    mrp_ex_gst DECIMAL(10, 2) DEFAULT 0,
+    discount_percentage DECIMAL(5, 2) DEFAULT 0,
+    discounted_sales_rate_ex_gst DECIMAL(10, 2) DEFAULT 0,
+    sales_gst_percentage DECIMAL(10, 4) DEFAULT 0,
+    sales_taxable_value DECIMAL(10, 2) DEFAULT 0,
+    sales_igst DECIMAL(10, 2) DEFAULT 0,
+    sales_cgst DECIMAL(10, 2) DEFAULT 0,
+    sales_sgst DECIMAL(10, 2) DEFAULT 0,
+    idempotency_key VARCHAR(100) DEFAULT NULL,
     created_at DATETIME NOT NULL,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    FOREIGN KEY (product_id) REFERENCES products(id)
+    FOREIGN KEY (product_id) REFERENCES products(id),
+    UNIQUE KEY idempotency_key_unique (idempotency_key)
 );
 
 -- Consumption table
@@ -78,12 +96,33 @@ CREATE TABLE IF NOT EXISTS balance_stock (
     id VARCHAR(36) PRIMARY KEY,
     product_id VARCHAR(36) NOT NULL,
     qty DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    taxable_value DECIMAL(12, 2) DEFAULT 0,
+    igst DECIMAL(12, 2) DEFAULT 0,
+    cgst DECIMAL(12, 2) DEFAULT 0,
+    sgst DECIMAL(12, 2) DEFAULT 0,
+    invoice_value DECIMAL(12, 2) DEFAULT 0,
     created_at DATETIME NOT NULL,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (product_id) REFERENCES products(id),
     UNIQUE KEY product_id_unique (product_id)
 );
 
+-- Running purchase sums per product, maintained alongside every purchase insert,
+-- so POS sync reads average costs by primary key instead of aggregating purchases
+CREATE TABLE IF NOT EXISTS product_cost_stats (
+    product_id VARCHAR(36) PRIMARY KEY,
+    purchase_count INT NOT NULL DEFAULT 0,
+    ex_gst_count INT NOT NULL DEFAULT 0,
+    sum_ex_gst DECIMAL(18, 4) NOT NULL DEFAULT 0,
+    gst_rate_count INT NOT NULL DEFAULT 0,
+    sum_gst_rate DECIMAL(20, 8) NOT NULL DEFAULT 0,
+    total_qty DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    total_taxable_value DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    total_igst DECIMAL(18, 2) NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id)
+);
+
 -- User roles table for authorization
 CREATE TABLE IF NOT EXISTS user_roles (
     id VARCHAR(36) PRIMARY KEY,
@@ -94,6 +133,7 @@ CREATE TABLE IF NOT EXISTS user_roles (
 );
 
 -- Create an index on the payment_method and converted_to_consumption columns for faster queries
+-- (migrations/0001 extends it with date and id for the keyset-paginated cash sales listing)
 CREATE INDEX idx_sales_payment_conversion ON sales(payment_method, converted_to_consumption);
 
 -- Create an index on the transaction_type column for faster queries
@@ -126,6 +166,6 @@ JOIN
     products p ON s.product_id = p.id
 WHERE 
     s.payment_method = 'cash' 
-    AND (s.converted_to_consumption = 0 OR s.converted_to_consumption IS NULL)
+    AND s.converted_to_consumption = 0
 ORDER BY 
     s.date DESC; 
\ No newline at end of file